@@ -1,3 +1,38 @@
-from .websockets.machine import CachingMachine
+import importlib
+from typing import TYPE_CHECKING, Any, List
 
-__all__ = ["CachingMachine"]
+if TYPE_CHECKING:
+    from .websockets.fleet import Fleet, HostHealth
+    from .websockets.machine import CachingMachine
+    from .websockets.protocol import AuthTokenCache
+    from .websockets.tls import ResumingSSLContext
+
+__all__ = [
+    "AuthTokenCache",
+    "CachingMachine",
+    "Fleet",
+    "HostHealth",
+    "ResumingSSLContext",
+]
+
+# Importing the websockets client pulls in asyncio, ssl and every entity module,
+# so it is left until one of these is first used.
+_LAZY_ATTRIBUTES = {
+    "AuthTokenCache": ".websockets.protocol",
+    "CachingMachine": ".websockets.machine",
+    "Fleet": ".websockets.fleet",
+    "HostHealth": ".websockets.fleet",
+    "ResumingSSLContext": ".websockets.tls",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
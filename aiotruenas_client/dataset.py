@@ -71,6 +71,10 @@ class Dataset(ABC):
     def __init__(self, id: str) -> None:
         self._id = id
 
+    @abstractmethod
+    async def refresh(self) -> None:
+        """Refreshes the state of the dataset from the remote machine."""
+
     @property
     @abstractmethod
     def available_bytes(self) -> int:
@@ -23,6 +23,10 @@ class Disk(ABC):
     def __init__(self, serial: str) -> None:
         self._serial = serial.strip()
 
+    @abstractmethod
+    async def refresh(self) -> None:
+        """Refreshes the state of the disk from the remote machine."""
+
     @property
     @abstractmethod
     def description(self) -> str:
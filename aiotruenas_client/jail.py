@@ -34,6 +34,10 @@ class Jail(ABC):
     async def restart(self) -> bool:
         """Restarts a running jail."""
 
+    @abstractmethod
+    async def refresh(self) -> None:
+        """Refreshes the state of the jail from the remote machine."""
+
     @property
     def name(self) -> str:
         """The name of the jail."""
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from abc import ABC, abstractmethod
 from enum import Enum, unique
-from typing import Any, Optional
+from typing import Any, Dict, Optional
 
 TJobId = int
 
@@ -31,6 +31,24 @@ class JobStatus(Enum):
         return job_status == cls.FAILED or job_status == cls.SUCCESS
 
 
+class JobProgress(object):
+    """Represents the progress of a Job in TrueNAS"""
+
+    def __init__(self, raw: Dict[str, Any]) -> None:
+        self._description: Optional[str] = raw.get("description")
+        self._percent: Optional[float] = raw.get("percent")
+
+    @property
+    def description(self) -> Optional[str]:
+        """What the job is currently doing."""
+        return self._description
+
+    @property
+    def percent(self) -> Optional[float]:
+        """How far along the job is, if known."""
+        return self._percent
+
+
 class Job(ABC):
     def __init__(
         self,
@@ -40,6 +58,15 @@ class Job(ABC):
         self._id = id
         self._method = method
 
+    @abstractmethod
+    async def abort(self) -> None:
+        """Asks the remote machine to abort the job."""
+
+    @property
+    @abstractmethod
+    def abortable(self) -> bool:
+        """If the job can be aborted."""
+
     @property
     @abstractmethod
     def error(self) -> Optional[str]:
@@ -55,6 +82,11 @@ class Job(ABC):
         """The method that created the job."""
         return self._method
 
+    @property
+    @abstractmethod
+    def progress(self) -> JobProgress:
+        """The progress of the job."""
+
     @property
     @abstractmethod
     def result(self) -> Optional[Any]:
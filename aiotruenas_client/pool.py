@@ -40,6 +40,10 @@ class Pool(ABC):
     def __init__(self, guid: str) -> None:
         self._guid = guid
 
+    @abstractmethod
+    async def refresh(self) -> None:
+        """Refreshes the state of the pool from the remote machine."""
+
     @property
     @abstractmethod
     def encrypt(self) -> int:
@@ -34,6 +34,10 @@ class VirtualMachine(ABC):
     async def restart(self) -> bool:
         """Restarts a running virtual machine."""
 
+    @abstractmethod
+    async def refresh(self) -> None:
+        """Refreshes the state of the virtual machine from the remote machine."""
+
     @property
     @abstractmethod
     def description(self) -> str:
@@ -1,3 +1,38 @@
-from .machine import CachingMachine
+import importlib
+from typing import TYPE_CHECKING, Any, List
 
-__all__ = ["CachingMachine"]
+if TYPE_CHECKING:
+    from .fleet import Fleet, HostHealth
+    from .machine import CachingMachine
+    from .protocol import AuthTokenCache
+    from .tls import ResumingSSLContext
+
+__all__ = [
+    "AuthTokenCache",
+    "CachingMachine",
+    "Fleet",
+    "HostHealth",
+    "ResumingSSLContext",
+]
+
+# Loaded on first use, as in the parent package, so that importing a light
+# module such as `bulk` does not pull in the websockets client.
+_LAZY_ATTRIBUTES = {
+    "AuthTokenCache": ".protocol",
+    "CachingMachine": ".machine",
+    "Fleet": ".fleet",
+    "HostHealth": ".fleet",
+    "ResumingSSLContext": ".tls",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
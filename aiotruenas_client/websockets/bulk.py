@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+from ..job import Job, TJobId
+from .interfaces import WebsocketMachine
+
+K = TypeVar("K")
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def gather_bounded(
+    items: Iterable[T],
+    operation: Callable[[T], Awaitable[R]],
+    max_concurrency: Optional[int] = None,
+) -> List[Union[R, BaseException]]:
+    """Runs `operation` on every item, with at most `max_concurrency` in flight.
+
+    Results, or the exception raised, are returned in the order of `items`.
+    """
+    if max_concurrency is not None and max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1.")
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    async def run(item: T) -> R:
+        if semaphore is None:
+            return await operation(item)
+        async with semaphore:
+            return await operation(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+def merge_state(
+    state: Dict[K, Dict[str, Any]],
+    keys: Iterable[K],
+    rows: Mapping[K, Dict[str, Any]],
+    index_fields: Sequence[str] = (),
+) -> bool:
+    """Merges freshly queried `rows` for `keys` into `state`.
+
+    Keys that are missing from `rows` no longer exist, and are removed.  The
+    rest of `state` is left alone.  Returns if entities were added or removed,
+    or any of `index_fields` changed, in which case the fetcher needs to update
+    its entities and indexes.
+    """
+    changed = False
+    for key in keys:
+        if key not in rows and state.pop(key, None) is not None:
+            changed = True
+    for key, row in rows.items():
+        previous = state.get(key)
+        if previous is None or any(
+            previous.get(field) != row.get(field) for field in index_fields
+        ):
+            changed = True
+        state[key] = row
+    return changed
+
+
+def raise_first_exception(results: List[Union[R, BaseException]]) -> List[R]:
+    """Raises the first exception in `results`, or returns them unchanged."""
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results  # type: ignore
+
+
+async def run_jobs(
+    machine: WebsocketMachine,
+    items: Iterable[T],
+    submit: Callable[[T], Awaitable[TJobId]],
+    max_concurrency: Optional[int] = None,
+) -> List[Union[Job, BaseException]]:
+    """Starts a job for every item, and waits for all of them together.
+
+    At most `max_concurrency` calls to `submit` are in flight at a time, and
+    every job is then waited on separately, so a failure stays with its own
+    item.  Completed jobs, or the exception raised, are returned in the order
+    of `items`.
+    """
+    job_ids = await gather_bounded(items, submit, max_concurrency)
+    unique_ids = list(
+        dict.fromkeys(
+            job_id for job_id in job_ids if not isinstance(job_id, BaseException)
+        )
+    )
+    # Lookups of uncached jobs are still sent as one `core.get_jobs` call.
+    jobs = await asyncio.gather(
+        *(machine.wait_for_job(job_id) for job_id in unique_ids),
+        return_exceptions=True,
+    )
+    completed = dict(zip(unique_ids, jobs))
+    return [
+        job_id if isinstance(job_id, BaseException) else completed[job_id]
+        for job_id in job_ids
+    ]
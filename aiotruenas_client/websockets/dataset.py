@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from ..dataset import Dataset, DatasetProperty, DatasetType
+from .bulk import merge_state
 from .interfaces import WebsocketMachine
 
 
@@ -11,6 +13,7 @@ class CachingDataset(Dataset):
         super().__init__(id)
         self._fetcher = fetcher
         self._cached_state = self._state
+        self._cached_subtree_rollup: Optional[Tuple[int, int]] = None
 
     @property
     def available(self) -> bool:
@@ -36,6 +39,14 @@ class CachingDataset(Dataset):
         assert property is not None
         return float(property.parsedValue)
 
+    def children(self) -> List[CachingDataset]:
+        """The datasets directly beneath this dataset."""
+        return self._fetcher.children(self)
+
+    def descendants(self) -> List[CachingDataset]:
+        """All datasets beneath this dataset, at any depth."""
+        return self._fetcher.descendants(self)
+
     @property
     def pool_name(self) -> str:
         """The name of the dataset's pool."""
@@ -44,6 +55,20 @@ class CachingDataset(Dataset):
             return self._state["pool"]
         return self._cached_state["pool"]
 
+    async def refresh(self) -> None:
+        """Refreshes the state of the dataset from the server."""
+        await self._fetcher.refresh_ids([self.id])
+
+    @property
+    def subtree_count(self) -> int:
+        """The number of datasets in this dataset's subtree, including itself."""
+        return self._get_subtree_rollup()[0]
+
+    @property
+    def subtree_used_bytes(self) -> int:
+        """The sum of `used_bytes` over this dataset and all of its descendants."""
+        return self._get_subtree_rollup()[1]
+
     @property
     def type(self) -> DatasetType:
         """The type of the dataset."""
@@ -64,6 +89,16 @@ class CachingDataset(Dataset):
         """The state of the dataset, according to the Machine."""
         return self._fetcher.get_cached_state(self)
 
+    def _get_subtree_rollup(self) -> Tuple[int, int]:
+        if self.available:
+            self._cached_subtree_rollup = (
+                self._fetcher.subtree_count(self),
+                self._fetcher.subtree_used_bytes(self),
+            )
+        if self._cached_subtree_rollup is None:
+            raise ValueError(f"Dataset {self.id} is no longer available.")
+        return self._cached_subtree_rollup
+
     def _get_property(self, property_name: str) -> Optional[DatasetProperty]:
         if self.available:
             self._cached_state = self._state
@@ -81,6 +116,13 @@ class CachingDatasetStateFetcher(object):
         self._parent = machine
         self._state: Dict[str, Dict[str, Any]] = {}
         self._cached_datasets: List[CachingDataset] = []
+        self._cached_datasets_by_id: Dict[str, CachingDataset] = {}
+        self._cached_datasets_by_pool: Dict[str, List[CachingDataset]] = {}
+        # Keyed by parent dataset id, with `None` holding the pool root datasets.
+        self._children: Dict[Optional[str], Set[str]] = {}
+        # Keyed by dataset id, holding (dataset count, used bytes) of the subtree.
+        # An entry is only present if the entries for all its descendants are too.
+        self._subtree_rollups: Dict[str, Tuple[int, int]] = {}
 
     @classmethod
     async def create(
@@ -92,7 +134,9 @@ class CachingDatasetStateFetcher(object):
 
     async def get_datasets(self) -> List[CachingDataset]:
         """Returns a list of datasets known to the host."""
+        previous_state = self._state
         self._state = await self._fetch_datasets()
+        self._update_hierarchy_from_state(previous_state)
         self._update_properties_from_state()
         return self.datasets
 
@@ -101,14 +145,72 @@ class CachingDatasetStateFetcher(object):
         """Returns a list of datasets known to the host."""
         return self._cached_datasets
 
+    def get_dataset(self, id: str) -> Optional[CachingDataset]:
+        """Returns the cached dataset with the given id, if known."""
+        return self._cached_datasets_by_id.get(id)
+
+    def get_pool_datasets(self, pool_name: str) -> List[CachingDataset]:
+        """Returns the cached datasets on the named pool."""
+        return self._cached_datasets_by_pool.get(pool_name, [])
+
+    def children(self, dataset: Dataset) -> List[CachingDataset]:
+        """Returns the datasets directly beneath `dataset`."""
+        return [
+            self._cached_datasets_by_id[child_id]
+            for child_id in sorted(self._children.get(dataset.id, ()))
+        ]
+
+    def descendants(self, dataset: Dataset) -> List[CachingDataset]:
+        """Returns all datasets beneath `dataset`, parents before their children."""
+        descendants = []
+        pending = deque([dataset.id])
+        while pending:
+            for child_id in sorted(self._children.get(pending.popleft(), ())):
+                descendants.append(self._cached_datasets_by_id[child_id])
+                pending.append(child_id)
+        return descendants
+
+    def subtree_count(self, dataset: Dataset) -> int:
+        """Returns the number of datasets in the subtree rooted at `dataset`."""
+        self._check_available(dataset)
+        return self._get_subtree_rollup(dataset.id)[0]
+
+    def subtree_used_bytes(self, dataset: Dataset) -> int:
+        """Returns the sum of used bytes over the subtree rooted at `dataset`."""
+        self._check_available(dataset)
+        return self._get_subtree_rollup(dataset.id)[1]
+
+    async def refresh_ids(self, ids: Iterable[str]) -> None:
+        """Refreshes the given datasets with a single query.
+
+        Datasets that no longer exist are dropped, and the rest of the cache is
+        left alone.  Children of a dataset are not refreshed along with it.
+        """
+        ids = list(ids)
+        if not ids:
+            return
+        datasets = await self._fetch_datasets([["id", "in", ids]])
+        dataset_ids = set(ids) | datasets.keys()
+        previous_state = {
+            dataset_id: self._state[dataset_id]
+            for dataset_id in dataset_ids
+            if dataset_id in self._state
+        }
+        changed = merge_state(self._state, ids, datasets, ("pool",))
+        self._update_hierarchy_from_state(previous_state, dataset_ids)
+        if changed:
+            self._update_properties_from_state()
+
     def get_cached_state(self, dataset: Dataset) -> Dict[str, Any]:
         return self._state[dataset.id]
 
-    async def _fetch_datasets(self) -> Dict[str, Dict[str, Any]]:
+    async def _fetch_datasets(
+        self, filters: Optional[List[Any]] = None
+    ) -> Dict[str, Dict[str, Any]]:
         datasets = await self._parent.invoke_method(
             "pool.dataset.query",
             [
-                [],
+                filters or [],
                 {
                     "select": [
                         "available",
@@ -124,6 +226,67 @@ class CachingDatasetStateFetcher(object):
         )
         return {dataset["id"]: dataset for dataset in datasets}
 
+    def _check_available(self, dataset: Dataset) -> None:
+        if dataset.id not in self._state:
+            raise ValueError(f"Dataset {dataset.id} is no longer available.")
+
+    def _get_subtree_rollup(self, dataset_id: str) -> Tuple[int, int]:
+        if dataset_id not in self._subtree_rollups:
+            count = 1
+            used = int(self._state[dataset_id]["used"]["parsed"])
+            for child_id in self._children.get(dataset_id, ()):
+                child_count, child_used = self._get_subtree_rollup(child_id)
+                count += child_count
+                used += child_used
+            self._subtree_rollups[dataset_id] = (count, used)
+        return self._subtree_rollups[dataset_id]
+
+    def _invalidate_subtree_rollups(self, dataset_id: str) -> None:
+        # Ancestors can only have a rollup if this dataset does, so stop early.
+        current_id: Optional[str] = dataset_id
+        while current_id is not None and current_id in self._subtree_rollups:
+            del self._subtree_rollups[current_id]
+            current_id = _parent_id(current_id)
+
+    def _update_hierarchy_from_state(
+        self,
+        previous_state: Dict[str, Dict[str, Any]],
+        dataset_ids: Optional[Set[str]] = None,
+    ) -> None:
+        """Updates the hierarchy for `dataset_ids`, defaulting to every dataset."""
+        if dataset_ids is None:
+            dataset_ids = previous_state.keys() | self._state.keys()
+        removed_ids = {
+            dataset_id
+            for dataset_id in dataset_ids
+            if dataset_id in previous_state and dataset_id not in self._state
+        }
+        added_ids = {
+            dataset_id
+            for dataset_id in dataset_ids
+            if dataset_id in self._state and dataset_id not in previous_state
+        }
+        changed_ids = {
+            dataset_id
+            for dataset_id in dataset_ids
+            if dataset_id in self._state
+            and dataset_id in previous_state
+            and self._state[dataset_id] != previous_state[dataset_id]
+        }
+        for dataset_id in removed_ids | changed_ids:
+            self._invalidate_subtree_rollups(dataset_id)
+        for dataset_id in removed_ids:
+            parent_id = _parent_id(dataset_id)
+            siblings = self._children[parent_id]
+            siblings.discard(dataset_id)
+            if not siblings:
+                del self._children[parent_id]
+        for dataset_id in added_ids:
+            parent_id = _parent_id(dataset_id)
+            self._children.setdefault(parent_id, set()).add(dataset_id)
+            if parent_id is not None:
+                self._invalidate_subtree_rollups(parent_id)
+
     def _update_properties_from_state(self) -> None:
         available_datasets_by_id = {
             dataset.id: dataset
@@ -136,3 +299,17 @@ class CachingDatasetStateFetcher(object):
             CachingDataset(fetcher=self, id=dataset_id)
             for dataset_id in dataset_ids_to_add
         ]
+        self._cached_datasets_by_id = {
+            dataset.id: dataset for dataset in self._cached_datasets
+        }
+        self._cached_datasets_by_pool = {}
+        for dataset in self._cached_datasets:
+            pool_name = self._state[dataset.id].get("pool")
+            if pool_name is not None:
+                self._cached_datasets_by_pool.setdefault(pool_name, []).append(dataset)
+
+
+def _parent_id(dataset_id: str) -> Optional[str]:
+    """Returns the id of the parent dataset, or `None` for a pool root dataset."""
+    parent_id, separator, _ = dataset_id.rpartition("/")
+    return parent_id if separator else None
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, List, Optional
 
 from ..disk import Disk, DiskType
+from .bulk import merge_state
 from .interfaces import StateFetcher, WebsocketMachine
 
 
@@ -12,6 +13,10 @@ class CachingDisk(Disk):
         self._fetcher = fetcher
         self._cached_state = self._state
 
+    async def refresh(self) -> None:
+        """Refreshes the state of the disk from the server."""
+        await self._fetcher.refresh_ids([self.name])
+
     @property
     def available(self) -> bool:
         """If the disk exists on the server."""
@@ -76,8 +81,11 @@ class CachingDiskStateFetcher(StateFetcher):
 
     def __init__(self, machine: WebsocketMachine) -> None:
         self._parent = machine
+        self._fetch_temperature = False
         self._state: Dict[str, Dict[str, Any]] = {}
         self._cached_disks: List[CachingDisk] = []
+        self._cached_disks_by_name: Dict[str, CachingDisk] = {}
+        self._cached_disks_by_serial: Dict[str, CachingDisk] = {}
 
     @classmethod
     async def create(
@@ -99,14 +107,42 @@ class CachingDiskStateFetcher(StateFetcher):
         """Returns a list of disks attached to the host."""
         return self._cached_disks
 
+    def get_disk(self, name: str) -> Optional[CachingDisk]:
+        """Returns the cached disk with the given device name, if known."""
+        return self._cached_disks_by_name.get(name)
+
+    def get_disk_by_serial(self, serial: str) -> Optional[CachingDisk]:
+        """Returns the cached disk with the given serial, if known."""
+        return self._cached_disks_by_serial.get(serial.strip())
+
+    async def refresh_ids(self, names: Iterable[str]) -> None:
+        """Refreshes the given disks, by device name, with a single query.
+
+        Disks that no longer exist are dropped, and the rest of the cache is
+        left alone.  Temperatures are included if they were for `get_disks`.
+        """
+        names = list(names)
+        if not names:
+            return
+        disks = await self._fetch_disks([["name", "in", names]])
+        serials = [
+            self._cached_disks_by_name[name].serial
+            for name in names
+            if name in self._cached_disks_by_name
+        ]
+        if merge_state(self._state, serials, disks, ("name",)):
+            self._update_properties_from_state()
+
     def get_cached_state(self, disk: Disk) -> Dict[str, Any]:
         return self._state[disk.serial]
 
-    async def _fetch_disks(self) -> Dict[str, Dict[str, Any]]:
+    async def _fetch_disks(
+        self, filters: Optional[List[Any]] = None
+    ) -> Dict[str, Dict[str, Any]]:
         disks = await self._parent.invoke_method(
             "disk.query",
             [
-                [],
+                filters or [],
                 {
                     "select": [
                         "description",
@@ -136,7 +172,7 @@ class CachingDiskStateFetcher(StateFetcher):
 
     def _update_properties_from_state(self) -> None:
         available_disks_by_serial = {
-            disk.name: disk for disk in self._cached_disks if disk.available
+            disk.serial: disk for disk in self._cached_disks if disk.available
         }
         current_disk_serials = {disk_serial for disk_serial in self._state}
         disk_serials_to_add = current_disk_serials - set(available_disks_by_serial)
@@ -144,3 +180,11 @@ class CachingDiskStateFetcher(StateFetcher):
             CachingDisk(fetcher=self, serial=disk_serial)
             for disk_serial in disk_serials_to_add
         ]
+        self._cached_disks_by_serial = {
+            disk.serial: disk for disk in self._cached_disks
+        }
+        self._cached_disks_by_name = {
+            self._state[disk.serial]["name"]: disk
+            for disk in self._cached_disks
+            if "name" in self._state[disk.serial]
+        }
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    TypeVar,
+)
+
+from .bulk import gather_bounded
+from .disk import CachingDisk
+from .machine import CachingMachine
+from .pool import CachingPool
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+
+class HostHealth(object):
+    """The health of one host in a `Fleet`, as of the last operation on it."""
+
+    def __init__(self) -> None:
+        self.error: Optional[BaseException] = None
+        self.last_success: Optional[float] = None
+
+    @property
+    def healthy(self) -> bool:
+        """If the last operation on the host succeeded."""
+        return self.last_success is not None and self.error is None
+
+
+class Fleet(object):
+    """Many `CachingMachine` connections, driven from one event loop.
+
+    Operations run on at most `max_concurrency` hosts at a time.  A host that
+    fails is left out of the results, and the failure is recorded in `health`
+    instead of being raised.
+    """
+
+    def __init__(
+        self,
+        hosts: Mapping[str, Mapping[str, Any]],
+        max_concurrency: Optional[int] = None,
+    ) -> None:
+        # Keyed by host, the arguments to `CachingMachine.create` for it.
+        self._host_options = {host: dict(options) for host, options in hosts.items()}
+        self._max_concurrency = max_concurrency
+        self._machines: Dict[str, CachingMachine] = {}
+        self._health: Dict[str, HostHealth] = {host: HostHealth() for host in hosts}
+
+    @classmethod
+    async def create(
+        cls,
+        hosts: Mapping[str, Mapping[str, Any]],
+        max_concurrency: Optional[int] = None,
+    ) -> Fleet:
+        """Creates a fleet, and connects to every host.
+
+        `hosts` maps each host to the keyword arguments given to
+        `CachingMachine.create` for it, such as `api_key` or `secure`.
+        """
+        fleet = Fleet(hosts=hosts, max_concurrency=max_concurrency)
+        await fleet.connect()
+        return fleet
+
+    @property
+    def hosts(self) -> List[str]:
+        """Every host in the fleet, connected or not."""
+        return list(self._host_options)
+
+    @property
+    def machines(self) -> Dict[str, CachingMachine]:
+        """The connected machines, keyed by host."""
+        return {
+            host: machine
+            for host, machine in self._machines.items()
+            if not machine.closed
+        }
+
+    @property
+    def health(self) -> Dict[str, HostHealth]:
+        """The health of every host in the fleet."""
+        return self._health
+
+    async def connect(self) -> None:
+        """Connects to every host that is not already connected."""
+        hosts = [host for host in self._host_options if host not in self.machines]
+
+        async def connect(host: str) -> None:
+            stale_machine = self._machines.pop(host, None)
+            if stale_machine is not None:
+                await _close_quietly(stale_machine)
+            self._machines[host] = await CachingMachine.create(
+                host, **self._host_options[host]
+            )
+
+        results = await gather_bounded(hosts, connect, self._max_concurrency)
+        self._record_results(hosts, results)
+
+    async def close(self) -> None:
+        """Closes every connection."""
+        machines = list(self._machines.values())
+        self._machines = {}
+        await gather_bounded(machines, _close_quietly, self._max_concurrency)
+
+    async def run(
+        self, operation: Callable[[CachingMachine], Awaitable[R]]
+    ) -> Dict[str, R]:
+        """Runs `operation` on every connected machine, keyed by host."""
+        machines = self.machines
+        hosts = list(machines)
+        results = await gather_bounded(
+            hosts, lambda host: operation(machines[host]), self._max_concurrency
+        )
+        self._record_results(hosts, results)
+        return {
+            host: result  # type: ignore
+            for host, result in zip(hosts, results)
+            if not isinstance(result, BaseException)
+        }
+
+    async def refresh(self) -> None:
+        """Refreshes the datasets, disks, pools and virtual machines of every host.
+
+        Jails are left out, since not every version of TrueNAS has them.
+        """
+
+        async def refresh(machine: CachingMachine) -> None:
+            await machine.get_pools()
+            await machine.get_datasets()
+            await machine.get_disks()
+            await machine.get_vms()
+
+        await self.run(refresh)
+
+    async def get_disks(
+        self, include_temperature: bool = False
+    ) -> Dict[str, List[CachingDisk]]:
+        """Returns the disks attached to every host, keyed by host."""
+        return await self.run(
+            lambda machine: machine.get_disks(include_temperature=include_temperature)
+        )
+
+    async def get_pools(self) -> Dict[str, List[CachingPool]]:
+        """Returns the pools known to every host, keyed by host."""
+        return await self.run(lambda machine: machine.get_pools())
+
+    def _record_results(self, hosts: Iterable[str], results: List[Any]) -> None:
+        now = time.time()
+        for host, result in zip(hosts, results):
+            health = self._health[host]
+            if isinstance(result, BaseException):
+                logger.warning("Operation on %s failed: %s", host, result)
+                health.error = result
+            else:
+                health.error = None
+                health.last_success = now
+
+
+async def _close_quietly(machine: CachingMachine) -> None:
+    try:
+        await machine.close()
+    except Exception as exc:
+        logger.debug("Unable to close connection cleanly: %s", exc)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import asyncio
 from abc import ABC, abstractmethod
-from typing import Any, List, Optional
+from typing import Any, AsyncIterator, Iterable, List, Optional
 
 from ..job import Job, TJobId
 from ..machine import Machine
@@ -60,9 +60,18 @@ class WebsocketMachine(Machine):
         """If the connection to the server is closed or not."""
 
     @abstractmethod
-    async def wait_for_job(self, id: TJobId) -> Job:
+    async def wait_for_job(self, id: TJobId, timeout: Optional[float] = None) -> Job:
         """Wait for the specified Job from the remote machine to complete, and return it."""
 
+    @abstractmethod
+    def wait_for_jobs(
+        self,
+        ids: Iterable[TJobId],
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[Job]:
+        """Wait for the specified Jobs to complete, yielding them in completion order."""
+
     @abstractmethod
     async def invoke_method(self, method: str, params: List[Any] = []) -> Any:
         """Invokes a method and returns its result.
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Union
 
 from ..jail import Jail, JailStatus
+from ..job import Job, TJobId
+from .bulk import merge_state, raise_first_exception, run_jobs
 from .interfaces import StateFetcher, WebsocketMachine
 
+logger = logging.getLogger(__name__)
+
 
 class CachingJail(Jail):
     def __init__(self, fetcher: CachingJailStateFetcher, name: str) -> None:
@@ -24,6 +29,10 @@ class CachingJail(Jail):
         """Restarts a running jail."""
         return await self._fetcher.restart_jail(self)
 
+    async def refresh(self) -> None:
+        """Refreshes the state of the jail from the server."""
+        await self._fetcher.refresh_ids([self.name])
+
     @property
     def available(self) -> bool:
         """If the jail exists on the server."""
@@ -46,6 +55,7 @@ class CachingJailStateFetcher(StateFetcher):
         self._parent = machine
         self._state: Dict[str, Dict[str, Any]] = {}
         self._cached_jails: List[CachingJail] = []
+        self._cached_jails_by_name: Dict[str, CachingJail] = {}
 
     @classmethod
     async def create(
@@ -66,6 +76,10 @@ class CachingJailStateFetcher(StateFetcher):
         """Returns a list of jails on the host."""
         return self._cached_jails
 
+    def get_jail(self, name: str) -> Optional[CachingJail]:
+        """Returns the cached jail with the given name, if known."""
+        return self._cached_jails_by_name.get(name)
+
     async def start_jail(self, jail: Jail) -> bool:
         if jail.status != JailStatus.DOWN:
             raise RuntimeError(f"Jail {jail.name} is already running.")
@@ -96,17 +110,100 @@ class CachingJailStateFetcher(StateFetcher):
 
         job_id = await self._parent.invoke_method("jail.restart", [jail.name])
         job = await self._parent.wait_for_job(id=job_id)
-        # TODO: update cached state
+        await self.refresh_ids([jail.name])
         return job.result_or_raise_error
 
+    async def start_jails(
+        self,
+        jails: Iterable[Jail],
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Starts many stopped jails, returning the results in order.
+
+        At most `max_concurrency` jobs are started at a time, and they are then
+        waited on together.  The cached state of every jail is refreshed with a
+        single query at the end.  Like `asyncio.gather`, the first error is
+        raised unless `return_exceptions` is set.
+        """
+        jails = list(jails)
+
+        async def start(jail: Jail) -> TJobId:
+            if jail.status != JailStatus.DOWN:
+                raise RuntimeError(f"Jail {jail.name} is already running.")
+            return await self._parent.invoke_method("jail.start", [jail.name])
+
+        jobs = await run_jobs(self._parent, jails, start, max_concurrency)
+        results = [_job_result(job) for job in jobs]
+        return await self._finish_bulk(jails, results, return_exceptions)
+
+    async def stop_jails(
+        self,
+        jails: Iterable[Jail],
+        force: bool = False,
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Stops many running jails, returning the results in order.
+
+        See `start_jails` for how concurrency, state and errors are handled.
+        """
+        jails = list(jails)
+
+        async def stop(jail: Jail) -> TJobId:
+            if jail.status != JailStatus.UP:
+                raise RuntimeError(f"Jail {jail.name} is not running.")
+            return await self._parent.invoke_method("jail.stop", [jail.name, force])
+
+        jobs = await run_jobs(self._parent, jails, stop, max_concurrency)
+        # Stop seems to return `None`, so check for that if we are not throwing.
+        results = [_job_result(job, returns_none=True) for job in jobs]
+        return await self._finish_bulk(jails, results, return_exceptions)
+
+    async def restart_jails(
+        self,
+        jails: Iterable[Jail],
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Restarts many running jails, returning the results in order.
+
+        See `start_jails` for how concurrency, state and errors are handled.
+        """
+        jails = list(jails)
+
+        async def restart(jail: Jail) -> TJobId:
+            if jail.status != JailStatus.UP:
+                raise RuntimeError(f"Jail {jail.name} is not running.")
+            return await self._parent.invoke_method("jail.restart", [jail.name])
+
+        jobs = await run_jobs(self._parent, jails, restart, max_concurrency)
+        results = [_job_result(job) for job in jobs]
+        return await self._finish_bulk(jails, results, return_exceptions)
+
+    async def refresh_ids(self, names: Iterable[str]) -> None:
+        """Refreshes the given jails with a single query.
+
+        Jails that no longer exist are dropped, and the rest of the cache is
+        left alone.
+        """
+        names = list(names)
+        if not names:
+            return
+        jails = await self._fetch_jails([["id", "in", names]])
+        if merge_state(self._state, names, jails):
+            self._update_properties_from_state()
+
     def get_cached_state(self, jail: Jail) -> Dict[str, Any]:
         return self._state[jail.name]
 
-    async def _fetch_jails(self) -> Dict[str, Dict[str, Any]]:
+    async def _fetch_jails(
+        self, filters: Optional[List[Any]] = None
+    ) -> Dict[str, Dict[str, Any]]:
         jails = await self._parent.invoke_method(
             "jail.query",
             [
-                [],
+                filters or [],
                 {
                     "select": [
                         "id",
@@ -117,6 +214,22 @@ class CachingJailStateFetcher(StateFetcher):
         )
         return {jail["id"]: jail for jail in jails}
 
+    async def _finish_bulk(
+        self,
+        jails: List[Jail],
+        results: List[Union[bool, BaseException]],
+        return_exceptions: bool,
+    ) -> List[Union[bool, BaseException]]:
+        if jails:
+            try:
+                await self.refresh_ids([jail.name for jail in jails])
+            except Exception as exc:
+                # The operations themselves are done; only the cache is stale.
+                logger.warning("Unable to refresh jail state: %s", exc)
+        if return_exceptions:
+            return results
+        return raise_first_exception(results)
+
     def _update_properties_from_state(self) -> None:
         available_jails_by_name = {
             jail.name: jail for jail in self._cached_jails if jail.available
@@ -126,3 +239,16 @@ class CachingJailStateFetcher(StateFetcher):
         self._cached_jails = [*available_jails_by_name.values()] + [
             CachingJail(fetcher=self, name=jail_name) for jail_name in jail_names_to_add
         ]
+        self._cached_jails_by_name = {jail.name: jail for jail in self._cached_jails}
+
+
+def _job_result(
+    job: Union[Job, BaseException], returns_none: bool = False
+) -> Union[bool, BaseException]:
+    if isinstance(job, BaseException):
+        return job
+    try:
+        result = job.result_or_raise_error
+    except Exception as exc:
+        return exc
+    return result == None if returns_none else result
@@ -2,13 +2,33 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Any, Dict, Optional
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Coroutine, Dict, Iterable, List, Optional, Set
 
-from ..job import Job, JobStatus, TJobId
+from ..job import Job, JobProgress, JobStatus, TJobId
 from .interfaces import StateFetcher, Subscriber, WebsocketMachine
 
 logger = logging.getLogger(__name__)
 
+# The only fields of `core.get_jobs` results that are read by this library.
+# Everything else (`arguments`, `logs_excerpt`, `exc_info`, ...) is dropped
+# when the job is stored.
+_JOB_FIELDS = ("abortable", "error", "id", "method", "progress", "result", "state")
+
+_COMPLETED_STATES = (JobStatus.FAILED.value, JobStatus.SUCCESS.value)
+
+
+class _JobProgressListener(object):
+    """Holds the latest progress of a job for one `progress_updates` consumer."""
+
+    def __init__(self, progress: JobProgress, completed: bool) -> None:
+        self.progress = progress
+        self.completed = completed
+        self.closed = False
+        self.updated = asyncio.Event()
+        self.updated.set()
+
 
 class CachingJob(Job):
     def __init__(
@@ -21,20 +41,62 @@ class CachingJob(Job):
         self._fetcher = fetcher
         self._cached_state = self._state
 
+    async def abort(self) -> None:
+        """Asks the remote machine to abort the job."""
+        await self._fetcher.abort_job(self)
+
+    @property
+    def abortable(self) -> bool:
+        """If the job can be aborted."""
+        if self.available:
+            self._cached_state = self._state
+            return bool(self._state.get("abortable"))
+        return bool(self._cached_state.get("abortable"))
+
+    @property
+    def available(self) -> bool:
+        """If the job is still held in the fetcher's cache."""
+        return self._id in self._fetcher._state  # type: ignore
+
     @property
     def error(self) -> Optional[str]:
         """The error message from the API."""
-        return self._state["error"]
+        if self.available:
+            self._cached_state = self._state
+            return self._state["error"]
+        return self._cached_state["error"]
+
+    @property
+    def progress(self) -> JobProgress:
+        """The progress of the job."""
+        if self.available:
+            self._cached_state = self._state
+            return JobProgress(self._state.get("progress") or {})
+        return JobProgress(self._cached_state.get("progress") or {})
+
+    def progress_updates(self, min_interval: float = 1.0) -> AsyncIterator[JobProgress]:
+        """Yields the progress of the job as it changes, until it completes.
+
+        Updates arriving less than `min_interval` seconds apart are coalesced
+        into the latest one.
+        """
+        return self._fetcher.progress_updates(self, min_interval=min_interval)
 
     @property
     def result(self) -> Optional[Any]:
         """The result of the job."""
-        return self._state["result"]
+        if self.available:
+            self._cached_state = self._state
+            return self._state["result"]
+        return self._cached_state["result"]
 
     @property
     def status(self) -> JobStatus:
         """The state of the job."""
-        return JobStatus.fromValue(self._state["state"])
+        if self.available:
+            self._cached_state = self._state
+            return JobStatus.fromValue(self._state["state"])
+        return JobStatus.fromValue(self._cached_state["state"])
 
     @property
     def _state(self) -> Dict[str, Any]:
@@ -45,18 +107,64 @@ class CachingJob(Job):
 class CachingJobFetcher(StateFetcher, Subscriber):
     _subscription_task: asyncio.Task
 
-    def __init__(self, machine: WebsocketMachine) -> None:
+    def __init__(
+        self,
+        machine: WebsocketMachine,
+        max_jobs: int = 1000,
+        max_job_age: Optional[float] = 3600,
+        job_fetch_window: float = 0.005,
+        abort_cancelled_jobs: bool = False,
+    ) -> None:
+        if max_jobs < 1:
+            raise ValueError("max_jobs must be at least 1.")
+        self._abort_cancelled_jobs = abort_cancelled_jobs
+        # Tasks started in the background, held until they finish.
+        self._background_tasks: Set[asyncio.Task] = set()
+        # Keyed by job id, shared by every caller waiting on that job.
         self._job_wait_futures: Dict[TJobId, asyncio.Future] = {}
+        # Keyed by job id, the number of callers waiting on the future above.
+        self._job_waiter_counts: Dict[TJobId, int] = {}
+        # Keyed by job id, every consumer of `progress_updates` for that job.
+        self._progress_listeners: Dict[TJobId, Set[_JobProgressListener]] = {}
+        # Keyed by job id, the jobs to look up with the next `core.get_jobs` call.
+        self._job_fetch_futures: Dict[TJobId, asyncio.Future] = {}
+        self._job_fetch_task: Optional[asyncio.Task] = None
+        self._job_fetch_window = job_fetch_window
+        self._max_jobs = max_jobs
+        self._max_job_age = max_job_age
         self._parent = machine
-        # This is probably not the best approach, as this will grow unbounded over time...
-        self._state: Dict[TJobId, Dict[str, Any]] = {}
+        # Ordered from least to most recently used, so eviction happens from the front.
+        self._state: OrderedDict[TJobId, Dict[str, Any]] = OrderedDict()
+        # Keyed by job id, holding the `time.monotonic()` of the last use.
+        self._state_last_used: Dict[TJobId, float] = {}
+        # Jobs restored from a snapshot before completing, that the server has
+        # not told us about since.
+        self._restored_job_ids: Set[TJobId] = set()
 
     @classmethod
     async def create(
         cls,
         machine: WebsocketMachine,
+        max_jobs: int = 1000,
+        max_job_age: Optional[float] = 3600,
+        job_fetch_window: float = 0.005,
+        abort_cancelled_jobs: bool = False,
     ) -> CachingJobFetcher:
-        cjf = CachingJobFetcher(machine=machine)
+        """Creates the fetcher and subscribes to job updates.
+
+        At most `max_jobs` jobs are cached, and jobs unused for `max_job_age`
+        seconds are dropped.  Jobs that are being waited on are never dropped.
+
+        If `abort_cancelled_jobs` is set, an abortable job is aborted on the
+        server once every caller waiting on it has been cancelled.
+        """
+        cjf = CachingJobFetcher(
+            machine=machine,
+            max_jobs=max_jobs,
+            max_job_age=max_job_age,
+            job_fetch_window=job_fetch_window,
+            abort_cancelled_jobs=abort_cancelled_jobs,
+        )
         queue = await machine.subscribe(cjf, "core.get_jobs")
         cjf._subscription_task = asyncio.create_task(
             cjf._subscription_queue_processor(queue)
@@ -71,47 +179,371 @@ class CachingJobFetcher(StateFetcher, Subscriber):
         for future in self._job_wait_futures.values():
             future.cancel()
         self._job_wait_futures = {}
+        self._job_waiter_counts = {}
+
+        # Cancel background work.  Lookups that were already sent cancel their
+        # own futures, so only the batch still being collected is left.
+        for task in self._background_tasks:
+            task.cancel()
+        self._background_tasks = set()
+        for future in self._job_fetch_futures.values():
+            future.cancel()
+        self._job_fetch_futures = {}
+        self._job_fetch_task = None
+
+        # End all progress updates, since no more will arrive.
+        for listeners in self._progress_listeners.values():
+            for listener in listeners:
+                listener.closed = True
+                listener.updated.set()
+        self._progress_listeners = {}
 
     async def get_job(self, id: TJobId) -> CachingJob:
-        if id not in self._state:
-            jobs = await self._parent.invoke_method("core.get_jobs", ["id", "=", id])
-            self._state[id] = jobs[0]
+        """Returns the job, looking it up on the server if it is not cached.
 
-        return CachingJob(fetcher=self, id=id, method=self._state[id]["method"])
+        Lookups made within `job_fetch_window` seconds of each other are sent
+        as a single `core.get_jobs` call.
+        """
+        if id in self._state:
+            return CachingJob(fetcher=self, id=id, method=self._state[id]["method"])
+
+        future = self._job_fetch_futures.get(id)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._job_fetch_futures[id] = future
+            if self._job_fetch_task is None:
+                self._job_fetch_task = self._start_background_task(
+                    self._fetch_pending_jobs()
+                )
+        # Other callers may be waiting on the same lookup.
+        return await asyncio.shield(future)
+
+    async def _fetch_pending_jobs(self) -> None:
+        await asyncio.sleep(self._job_fetch_window)
+        futures = self._job_fetch_futures
+        self._job_fetch_futures = {}
+        self._job_fetch_task = None
+        try:
+            jobs = await self._parent.invoke_method(
+                "core.get_jobs", [[["id", "in", list(futures)]]]
+            )
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+        except Exception as exc:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for job_state in jobs:
+            id = job_state["id"]
+            future = futures.pop(id, None)
+            if id not in self._state:
+                # The subscription may have delivered a newer state while this
+                # lookup was in flight.
+                self._store_job_state(job_state)
+            if future is not None and not future.done():
+                future.set_result(self._get_job_no_fetch(id))
+        for id, future in futures.items():
+            if future.done():
+                continue
+            if id in self._state:
+                # Started after the lookup was answered, and delivered by the
+                # subscription since.
+                future.set_result(self._get_job_no_fetch(id))
+            else:
+                future.set_exception(RuntimeError(f"Job {id} does not exist."))
+
+    async def wait_for_job(
+        self, id: TJobId, timeout: Optional[float] = None
+    ) -> CachingJob:
+        """Waits for the job to complete, and returns it.
+
+        Any number of callers may wait on the same job.  Raises
+        `asyncio.TimeoutError` if `timeout` seconds pass first.
+        """
+        future = self._add_job_waiter(id)
+        cancelled = False
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._remove_job_waiter(id, future, cancelled=cancelled)
+
+    async def abort_job(self, job: Job) -> None:
+        """Asks the remote machine to abort the job."""
+        await self._parent.invoke_method("core.job_abort", [job.id])
+
+    async def wait_for_jobs(
+        self,
+        ids: Iterable[TJobId],
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[CachingJob]:
+        """Waits for the jobs to complete, yielding each one as it completes.
+
+        Each distinct job is yielded once.  At most `max_concurrency` jobs are
+        waited on at a time, and `asyncio.TimeoutError` is raised if all of the
+        jobs have not completed within `timeout` seconds.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        unique_ids = list(dict.fromkeys(ids))
+        if max_concurrency is None:
+            max_concurrency = len(unique_ids)
+        elif max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1.")
+        pending_ids = iter(unique_ids)
+        # Completed job ids, fed by the done callbacks of the futures below.
+        completed: asyncio.Queue = asyncio.Queue()
+        waiting: Dict[TJobId, asyncio.Future] = {}
+
+        def wait_for_next_job() -> None:
+            id = next(pending_ids, None)
+            if id is None:
+                return
+            future = self._add_job_waiter(id)
+            future.add_done_callback(lambda _: completed.put_nowait(id))
+            waiting[id] = future
+
+        cancelled = False
+        try:
+            for _ in range(max_concurrency):
+                wait_for_next_job()
+            while waiting:
+                if completed.empty():
+                    remaining = None if deadline is None else deadline - loop.time()
+                    id = await asyncio.wait_for(completed.get(), remaining)
+                else:
+                    id = completed.get_nowait()
+                if id not in waiting:
+                    continue
+                future = waiting.pop(id)
+                self._remove_job_waiter(id, future)
+                wait_for_next_job()
+                yield future.result()
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            for id, future in waiting.items():
+                self._remove_job_waiter(id, future, cancelled=cancelled)
+
+    async def progress_updates(
+        self, job: CachingJob, min_interval: float = 1.0
+    ) -> AsyncIterator[JobProgress]:
+        """Yields the progress of `job` as it changes, until it completes.
+
+        The current progress is yielded first.  Updates arriving less than
+        `min_interval` seconds apart are coalesced into the latest one.
+        """
+        loop = asyncio.get_event_loop()
+        listener = _JobProgressListener(
+            job.progress, JobStatus.is_completed(job.status)
+        )
+        self._progress_listeners.setdefault(job.id, set()).add(listener)
+        try:
+            last_yield_time: Optional[float] = None
+            while True:
+                await listener.updated.wait()
+                if last_yield_time is not None:
+                    delay = last_yield_time + min_interval - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if listener.closed:
+                    return
+                listener.updated.clear()
+                last_yield_time = loop.time()
+                yield listener.progress
+                if listener.completed:
+                    return
+        finally:
+            listeners = self._progress_listeners.get(job.id)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._progress_listeners[job.id]
+
+    def _notify_progress_listeners(self, job: CachingJob) -> None:
+        if job.id not in self._progress_listeners:
+            return
+        progress = job.progress
+        completed = JobStatus.is_completed(job.status)
+        for listener in self._progress_listeners[job.id]:
+            listener.progress = progress
+            listener.completed = completed
+            listener.updated.set()
+
+    def _add_job_waiter(self, id: TJobId) -> asyncio.Future:
+        future = self._job_wait_futures.get(id)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._job_wait_futures[id] = future
+            self._job_waiter_counts[id] = 0
+            # The job may have completed before anyone started waiting on it.  The
+            # future is registered first so that no update is missed in between.
+            self._start_background_task(self._resolve_if_completed(id, future))
+        self._job_waiter_counts[id] += 1
+        return future
+
+    def _remove_job_waiter(
+        self, id: TJobId, future: asyncio.Future, cancelled: bool = False
+    ) -> None:
+        if self._job_wait_futures.get(id) is not future:
+            # Already resolved, and no longer tracked.
+            return
+        self._job_waiter_counts[id] -= 1
+        if self._job_waiter_counts[id] == 0:
+            # Nobody is left waiting, so stop tracking the job.
+            del self._job_wait_futures[id]
+            del self._job_waiter_counts[id]
+            future.cancel()
+            if cancelled and self._abort_cancelled_jobs:
+                self._start_background_task(self._abort_abandoned_job(id))
+
+    def _start_background_task(
+        self, coroutine: Coroutine[Any, Any, None]
+    ) -> asyncio.Task:
+        # The event loop only keeps weak references to tasks, so hold on to them.
+        task = asyncio.create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
 
-    async def wait_for_job(self, id: TJobId) -> CachingJob:
-        assert id not in self._job_wait_futures, f"Already waiting for job {id}"
-        future = asyncio.get_event_loop().create_future()
-        self._job_wait_futures[id] = future
-        return await future
+    async def _abort_abandoned_job(self, id: TJobId) -> None:
+        # The job may not be cached yet if the wait was cancelled while it was
+        # being looked up, so let the server decide whether it can be aborted.
+        if id in self._state and not self._state[id].get("abortable"):
+            return
+        try:
+            await self._parent.invoke_method("core.job_abort", [id])
+        except Exception as exc:
+            logger.warning("Unable to abort abandoned job %d: %s", id, exc)
+
+    async def _resolve_if_completed(self, id: TJobId, future: asyncio.Future) -> None:
+        try:
+            job = await self.get_job(id)
+        except Exception as exc:
+            if self._job_wait_futures.get(id) is future:
+                del self._job_wait_futures[id]
+                del self._job_waiter_counts[id]
+                future.set_exception(exc)
+            return
+        if JobStatus.is_completed(job.status):
+            self._resolve_job_waiters(job)
+
+    def _resolve_job_waiters(self, job: CachingJob) -> None:
+        if job.id not in self._job_wait_futures:
+            return
+        future = self._job_wait_futures.pop(job.id)
+        del self._job_waiter_counts[job.id]
+        future.set_result(job)
+
+    def restore_jobs(self, job_states: List[Dict[str, Any]]) -> None:
+        """Caches jobs saved in a snapshot.
+
+        Jobs that had not completed may have changed since, and are looked up
+        again by `refresh_restored_jobs`.
+        """
+        for job_state in job_states:
+            self._store_job_state(job_state)
+            if job_state.get("state") not in _COMPLETED_STATES:
+                self._restored_job_ids.add(job_state["id"])
+
+    async def refresh_restored_jobs(self) -> None:
+        """Looks up every restored job that had not completed, in one call."""
+        ids = list(self._restored_job_ids)
+        if not ids:
+            return
+        jobs = await self._parent.invoke_method("core.get_jobs", [[["id", "in", ids]]])
+        returned = set()
+        for job_state in jobs:
+            id = job_state["id"]
+            returned.add(id)
+            # The subscription may have delivered a newer state while this
+            # lookup was in flight.
+            if id in self._restored_job_ids:
+                self._store_job_state(job_state)
+                self._handle_job_update(self._get_job_no_fetch(id))
+        for id in ids:
+            if id in self._restored_job_ids and id not in returned:
+                # Gone from the server, so it will never complete.
+                self._state.pop(id, None)
+                self._state_last_used.pop(id, None)
+                future = self._job_wait_futures.pop(id, None)
+                if future is not None:
+                    del self._job_waiter_counts[id]
+                    future.set_exception(RuntimeError(f"Job {id} does not exist."))
+        self._restored_job_ids.difference_update(ids)
+
+    def _handle_job_update(self, job: CachingJob) -> None:
+        self._notify_progress_listeners(job)
+        if JobStatus.is_completed(job.status):
+            self._resolve_job_waiters(job)
 
     def _get_job_no_fetch(self, id: TJobId) -> CachingJob:
         assert id in self._state
         return CachingJob(fetcher=self, id=id, method=self._state[id]["method"])
 
     def get_cached_state(self, job: Job) -> Dict[str, Any]:
+        self._mark_used(job.id)
         return self._state[job.id]
 
+    def _mark_used(self, id: TJobId) -> None:
+        self._state.move_to_end(id)
+        self._state_last_used[id] = time.monotonic()
+
+    def _store_job_state(self, job_state: Dict[str, Any]) -> None:
+        id = job_state["id"]
+        self._state[id] = {
+            field: job_state[field] for field in _JOB_FIELDS if field in job_state
+        }
+        self._mark_used(id)
+        # Never evict the job just stored, as callers go on to read it.
+        self._evict_jobs(keep=id)
+
+    def _evict_jobs(self, keep: Optional[TJobId] = None) -> None:
+        now = time.monotonic()
+        # Each iteration either evicts or rotates the least recently used job, so
+        # this visits every job at most once.
+        for _ in range(len(self._state)):
+            id = next(iter(self._state))
+            over_capacity = len(self._state) > self._max_jobs
+            expired = (
+                self._max_job_age is not None
+                and now - self._state_last_used[id] > self._max_job_age
+            )
+            if not over_capacity and not expired:
+                return
+            if id in self._job_wait_futures or id == keep:
+                # Someone is still waiting on this job, so keep it around, even
+                # if that leaves the cache over capacity.
+                self._mark_used(id)
+                continue
+            del self._state[id]
+            del self._state_last_used[id]
+
     async def _subscription_queue_processor(self, queue: asyncio.Queue) -> None:
-        try:
-            while True:
+        while True:
+            try:
                 item = await queue.get()
+            except asyncio.CancelledError:
+                logger.debug(
+                    "core.get_jobs subscription work processing is getting canceled"
+                )
+                raise
+            # One bad item must not stop the updates for every other job.
+            try:
                 job_state = item["fields"]
-                self._state[job_state["id"]] = job_state
+                self._store_job_state(job_state)
+                self._restored_job_ids.discard(job_state["id"])
+                self._handle_job_update(self._get_job_no_fetch(job_state["id"]))
+            except Exception as exc:
+                logger.exception(
+                    "exception while processing core.get_jobs data", exc_info=exc
+                )
+            finally:
                 queue.task_done()
-                job = self._get_job_no_fetch(job_state["id"])
-                if (
-                    JobStatus.is_completed(job.status)
-                    and job.id in self._job_wait_futures
-                ):
-                    self._job_wait_futures[job.id].set_result(job)
-                    del self._job_wait_futures[job.id]
-        except asyncio.CancelledError:
-            logger.debug(
-                "core.get_jobs subscription work processing is getting canceled"
-            )
-            raise
-        except Exception as exc:
-            logger.exception(
-                "exception while processing core.get_jobs data", exc_info=exc
-            )
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
+import os
 import ssl
-from typing import Any, Dict, List, Optional, cast
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Union, cast
+from urllib.parse import urlsplit
 
 from aiotruenas_client.job import TJobId
 from aiotruenas_client.websockets.jail import CachingJail, CachingJailStateFetcher
@@ -15,10 +18,15 @@ from .disk import CachingDisk, CachingDiskStateFetcher
 from .interfaces import Subscriber, WebsocketMachine
 from .pool import CachingPool, CachingPoolStateFetcher
 from .protocol import (
+    AuthTokenCache,
     TrueNASWebSocketClientProtocol,
     truenas_api_key_auth_protocol_factory,
     truenas_password_auth_protocol_factory,
+    truenas_token_auth_protocol_factory,
 )
+from .recording import TrafficRecorder
+from .snapshot import SnapshotError, dump_snapshot, load_snapshot
+from .tls import ResumingSSLContext, default_ssl_context
 from .virtualmachine import CachingVirtualMachine, CachingVirtualMachineStateFetcher
 
 logger = logging.getLogger(__name__)
@@ -34,9 +42,19 @@ class CachingMachine(WebsocketMachine):
     _pool_fetcher: CachingPoolStateFetcher
     _vm_fetcher: CachingVirtualMachineStateFetcher
 
+    # The seconds to wait before retrying a failed refresh of state restored from
+    # a snapshot, doubled after each failure up to the maximum.
+    _stale_refresh_retry_delay = 1.0
+    _stale_refresh_max_retry_delay = 60.0
+
     def __init__(self):
         self._client: Optional[TrueNASWebSocketClientProtocol] = None
         self._subscribers: List[Subscriber] = []
+        self._recorder: Optional[TrafficRecorder] = None
+        self._stale = False
+        self._stale_refresh_task: Optional[asyncio.Task] = None
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._tls_port: Optional[int] = None
 
     @classmethod
     async def create(
@@ -46,22 +64,69 @@ class CachingMachine(WebsocketMachine):
         password: Optional[str] = None,
         username: Optional[str] = None,
         secure: bool = True,
+        max_jobs: int = 1000,
+        max_job_age: Optional[float] = 3600,
+        job_fetch_window: float = 0.005,
+        abort_cancelled_jobs: bool = False,
+        warm_start: Optional[str] = None,
+        record_traffic: Optional[str] = None,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        auth_tokens: Optional[AuthTokenCache] = None,
+        max_message_size: Optional[int] = 2**20,
     ) -> CachingMachine:
+        """Connects to the remote machine.
+
+        Secure connections use `ssl_context` if given, or else a context shared
+        by every machine that does not check certificates.  A
+        `ResumingSSLContext` resumes TLS sessions on later connections to the
+        same host and port.
+
+        With a username and password, passing `auth_tokens` logs in with a
+        session token from it when there is one, and otherwise adds a token to
+        it after logging in with the password.  Sharing one cache between
+        machines spares later connections the server's slow password check.
+
+        If `warm_start` names a file written by `save_snapshot`, the cached
+        state is restored from it and marked `stale` until it has been
+        refreshed from the server in the background, which is retried until it
+        succeeds.  Jobs that had not completed when the snapshot was saved are
+        looked up again as part of that refresh.
+
+        If `record_traffic` is set, every frame sent and received is written to
+        that path, to be replayed by the fake server in the tests.
+
+        Replies larger than `max_message_size` bytes close the connection, so
+        machines with very many datasets or disks may need it raised, or set to
+        `None` for no limit.
+        """
         m = CachingMachine()
+        if record_traffic is not None:
+            m._recorder = TrafficRecorder(record_traffic)
         await m.connect(
             host=host,
             api_key=api_key,
             password=password,
             username=username,
             secure=secure,
+            ssl_context=ssl_context,
+            auth_tokens=auth_tokens,
+            max_message_size=max_message_size,
+        )
+        m._job_fetcher = await CachingJobFetcher.create(
+            machine=m,
+            max_jobs=max_jobs,
+            max_job_age=max_job_age,
+            job_fetch_window=job_fetch_window,
+            abort_cancelled_jobs=abort_cancelled_jobs,
         )
-        m._job_fetcher = await CachingJobFetcher.create(machine=m)
 
         m._dataset_fetcher = await CachingDatasetStateFetcher.create(machine=m)
         m._disk_fetcher = await CachingDiskStateFetcher.create(machine=m)
         m._jail_fetcher = await CachingJailStateFetcher.create(machine=m)
         m._pool_fetcher = await CachingPoolStateFetcher.create(machine=m)
         m._vm_fetcher = await CachingVirtualMachineStateFetcher.create(machine=m)
+        if warm_start is not None:
+            await m._warm_start(warm_start)
         return m
 
     async def connect(
@@ -71,6 +136,9 @@ class CachingMachine(WebsocketMachine):
         password: Optional[str],
         username: Optional[str],
         secure: bool,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        auth_tokens: Optional[AuthTokenCache] = None,
+        max_message_size: Optional[int] = 2**20,
     ) -> None:
         """Connects to the remote machine."""
         if api_key and (password or username):
@@ -84,12 +152,18 @@ class CachingMachine(WebsocketMachine):
 
         if api_key:
             auth_protocol = truenas_api_key_auth_protocol_factory(api_key)
+        elif username and password and auth_tokens is not None:
+            auth_protocol = truenas_token_auth_protocol_factory(
+                username, password, auth_tokens, f"{username}@{host}"
+            )
         elif username and password:
             auth_protocol = truenas_password_auth_protocol_factory(username, password)
         else:
             raise AssertionError
+        if self._recorder is not None:
+            auth_protocol = functools.partial(auth_protocol, recorder=self._recorder)
 
-        await self._connect(auth_protocol, host, secure)
+        await self._connect(auth_protocol, host, secure, ssl_context, max_message_size)
         assert self._client is not None
         ip_address = self._client.remote_address[0]
         port = self._client.remote_address[1]
@@ -98,6 +172,9 @@ class CachingMachine(WebsocketMachine):
     async def close(self) -> None:
         """Closes the conenction to the server."""
         assert self._client is not None
+        if self._stale_refresh_task is not None:
+            self._stale_refresh_task.cancel()
+            self._stale_refresh_task = None
         for subscriber in self._subscribers:
             try:
                 await subscriber.unsubscribe()
@@ -108,9 +185,15 @@ class CachingMachine(WebsocketMachine):
                 )
         ip_address = self._client.remote_address[0]
         port = self._client.remote_address[1]
+        # TLS 1.3 sends session tickets after the handshake, so the session may
+        # have changed since connecting.
+        self._save_tls_session()
         await self._client.close()
         logger.debug("Connection closed to %s on port %d", ip_address, port)
         self._client = None
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
 
     @property
     def closed(self) -> bool:
@@ -134,6 +217,14 @@ class CachingMachine(WebsocketMachine):
         """Returns a list of cached datasets on the host."""
         return self._dataset_fetcher.datasets
 
+    def get_dataset(self, id: str) -> Optional[CachingDataset]:
+        """Returns the cached dataset with the given id, if known."""
+        return self._dataset_fetcher.get_dataset(id)
+
+    def get_pool_datasets(self, pool_name: str) -> List[CachingDataset]:
+        """Returns the cached datasets on the named pool."""
+        return self._dataset_fetcher.get_pool_datasets(pool_name)
+
     async def get_disks(self, include_temperature: bool = False) -> List[CachingDisk]:
         """Returns a list of disks attached to the host."""
         return await self._disk_fetcher.get_disks(
@@ -145,6 +236,14 @@ class CachingMachine(WebsocketMachine):
         """Returns a list of cached disks attached to the host."""
         return self._disk_fetcher.disks
 
+    def get_disk(self, name: str) -> Optional[CachingDisk]:
+        """Returns the cached disk with the given device name, if known."""
+        return self._disk_fetcher.get_disk(name)
+
+    def get_disk_by_serial(self, serial: str) -> Optional[CachingDisk]:
+        """Returns the cached disk with the given serial, if known."""
+        return self._disk_fetcher.get_disk_by_serial(serial)
+
     async def get_jails(self) -> List[CachingJail]:
         """Returns a list of jails configured on the host."""
         return await self._jail_fetcher.get_jails()
@@ -154,13 +253,139 @@ class CachingMachine(WebsocketMachine):
         """Returns a list of cached jails configured on the host."""
         return self._jail_fetcher.jails
 
+    async def start_jails(
+        self,
+        jails: Iterable[CachingJail],
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Starts many jails, with at most `max_concurrency` at a time."""
+        return await self._jail_fetcher.start_jails(
+            jails,
+            max_concurrency=max_concurrency,
+            return_exceptions=return_exceptions,
+        )
+
+    async def stop_jails(
+        self,
+        jails: Iterable[CachingJail],
+        force: bool = False,
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Stops many jails, with at most `max_concurrency` at a time."""
+        return await self._jail_fetcher.stop_jails(
+            jails,
+            force=force,
+            max_concurrency=max_concurrency,
+            return_exceptions=return_exceptions,
+        )
+
+    async def restart_jails(
+        self,
+        jails: Iterable[CachingJail],
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Restarts many jails, with at most `max_concurrency` at a time."""
+        return await self._jail_fetcher.restart_jails(
+            jails,
+            max_concurrency=max_concurrency,
+            return_exceptions=return_exceptions,
+        )
+
+    def get_jail(self, name: str) -> Optional[CachingJail]:
+        """Returns the cached jail with the given name, if known."""
+        return self._jail_fetcher.get_jail(name)
+
     async def get_job(self, id: TJobId) -> CachingJob:
         """Get the specified Job from the remote machine."""
         return await self._job_fetcher.get_job(id=id)
 
-    async def wait_for_job(self, id: TJobId) -> CachingJob:
+    async def wait_for_job(
+        self, id: TJobId, timeout: Optional[float] = None
+    ) -> CachingJob:
         """Wait for the specified Job from the remote machine to complete, and return it."""
-        return await self._job_fetcher.wait_for_job(id=id)
+        return await self._job_fetcher.wait_for_job(id=id, timeout=timeout)
+
+    def wait_for_jobs(
+        self,
+        ids: Iterable[TJobId],
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator[CachingJob]:
+        """Wait for the specified Jobs from the remote machine to complete, yielding them in completion order."""
+        return self._job_fetcher.wait_for_jobs(
+            ids=ids, max_concurrency=max_concurrency, timeout=timeout
+        )
+
+    @property
+    def stale(self) -> bool:
+        """If the cached state came from a snapshot, and is not refreshed yet."""
+        return self._stale
+
+    async def save_snapshot(self, path: str) -> None:
+        """Saves the cached state, to warm start a later `CachingMachine` from."""
+        data = dump_snapshot(self)
+
+        def write() -> None:
+            # Written next to the destination first, so a crash never leaves a
+            # partial snapshot behind.
+            temporary_path = f"{path}.tmp"
+            with open(temporary_path, "wb") as file:
+                file.write(data)
+            os.replace(temporary_path, path)
+
+        await asyncio.get_event_loop().run_in_executor(None, write)
+
+    async def _warm_start(self, path: str) -> None:
+        def read() -> bytes:
+            with open(path, "rb") as file:
+                return file.read()
+
+        try:
+            data = await asyncio.get_event_loop().run_in_executor(None, read)
+            kinds = load_snapshot(self, data)
+        except FileNotFoundError:
+            logger.debug("No snapshot at %s, starting cold.", path)
+            return
+        except (OSError, SnapshotError) as exc:
+            logger.warning("Unable to warm start from %s: %s", path, exc)
+            return
+        self._stale = True
+        self._stale_refresh_task = asyncio.create_task(self._refresh_stale(kinds))
+
+    async def _refresh_stale(self, kinds: List[str]) -> None:
+        refreshers = {
+            "datasets": self.get_datasets,
+            "disks": lambda: self.get_disks(
+                include_temperature=self._disk_fetcher._fetch_temperature
+            ),
+            "jails": self.get_jails,
+            "pools": self.get_pools,
+            "vms": self.get_vms,
+            "jobs": self._job_fetcher.refresh_restored_jobs,
+        }
+        remaining = [*kinds, "jobs"]
+        retry_delay = self._stale_refresh_retry_delay
+        while remaining:
+            try:
+                await refreshers[remaining[0]]()
+            except Exception as exc:
+                # Retried until it works, or the machine is closed, as the state
+                # stays stale until then.
+                logger.warning(
+                    "Unable to refresh %s from snapshot, retrying in %.1f seconds: %s",
+                    remaining[0],
+                    retry_delay,
+                    exc,
+                )
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self._stale_refresh_max_retry_delay)
+                continue
+            remaining.pop(0)
+        self._stale = False
+        self._stale_refresh_task = None
 
     async def get_system_info(self) -> Dict[str, Any]:
         """Get some basic information about the remote machine."""
@@ -176,6 +401,18 @@ class CachingMachine(WebsocketMachine):
         """Returns a list of pools known to the host."""
         return self._pool_fetcher.pools
 
+    def get_pool(self, name: str) -> Optional[CachingPool]:
+        """Returns the cached pool with the given name, if known."""
+        return self._pool_fetcher.get_pool(name)
+
+    def get_pool_by_guid(self, guid: str) -> Optional[CachingPool]:
+        """Returns the cached pool with the given guid, if known."""
+        return self._pool_fetcher.get_pool_by_guid(guid)
+
+    def get_pool_by_id(self, id: int) -> Optional[CachingPool]:
+        """Returns the cached pool with the given id, if known."""
+        return self._pool_fetcher.get_pool_by_id(id)
+
     async def get_vms(self) -> List[CachingVirtualMachine]:
         """Returns a list of virtual machines on the host."""
         return await self._vm_fetcher.get_vms()
@@ -185,23 +422,92 @@ class CachingMachine(WebsocketMachine):
         """Returns a list of cached virtual machines on the host."""
         return self._vm_fetcher.vms
 
-    async def _connect(self, auth_protocol, host, secure):
+    async def start_vms(
+        self,
+        vms: Iterable[CachingVirtualMachine],
+        overcommit: bool = False,
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Starts many virtual machines, with at most `max_concurrency` at a time."""
+        return await self._vm_fetcher.start_vms(
+            vms,
+            overcommit=overcommit,
+            max_concurrency=max_concurrency,
+            return_exceptions=return_exceptions,
+        )
+
+    async def stop_vms(
+        self,
+        vms: Iterable[CachingVirtualMachine],
+        force: bool = False,
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Stops many virtual machines, with at most `max_concurrency` at a time."""
+        return await self._vm_fetcher.stop_vms(
+            vms,
+            force=force,
+            max_concurrency=max_concurrency,
+            return_exceptions=return_exceptions,
+        )
+
+    async def restart_vms(
+        self,
+        vms: Iterable[CachingVirtualMachine],
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Restarts many virtual machines, with at most `max_concurrency` at a time."""
+        return await self._vm_fetcher.restart_vms(
+            vms,
+            max_concurrency=max_concurrency,
+            return_exceptions=return_exceptions,
+        )
+
+    def get_vm(self, name: str) -> Optional[CachingVirtualMachine]:
+        """Returns the cached virtual machine with the given name, if known."""
+        return self._vm_fetcher.get_vm(name)
+
+    def get_vm_by_id(self, id: int) -> Optional[CachingVirtualMachine]:
+        """Returns the cached virtual machine with the given id, if known."""
+        return self._vm_fetcher.get_vm_by_id(id)
+
+    async def _connect(
+        self, auth_protocol, host, secure, ssl_context=None, max_message_size=2**20
+    ):
         """Executes connection."""
         assert self._client is None
         if not secure:
             protocol = "ws"
-            context = None
+            self._ssl_context = None
         else:
             protocol = "wss"
-            context = ssl.SSLContext()
-        self._client = cast(
-            TrueNASWebSocketClientProtocol,
-            await connect(
-                f"{protocol}://{host}/websocket",
-                create_protocol=auth_protocol,
-                ssl=context,
-            ),
+            self._ssl_context = ssl_context or default_ssl_context()
+        url = f"{protocol}://{host}/websocket"
+        connection = connect(
+            url,
+            create_protocol=auth_protocol,
+            ssl=self._ssl_context,
+            max_size=max_message_size,
         )
+        if isinstance(self._ssl_context, ResumingSSLContext):
+            # Sessions are resumed with the same port of the host only.
+            self._tls_port = urlsplit(url).port or 443
+            with self._ssl_context.connecting_to(self._tls_port):
+                client = await connection
+        else:
+            client = await connection
+        self._client = cast(TrueNASWebSocketClientProtocol, client)
+        self._save_tls_session()
+
+    def _save_tls_session(self) -> None:
+        if not isinstance(self._ssl_context, ResumingSSLContext):
+            return
+        assert self._client is not None
+        ssl_object = self._client.transport.get_extra_info("ssl_object")
+        if ssl_object is not None:
+            self._ssl_context.save_session(ssl_object, self._tls_port)
 
     async def invoke_method(self, method: str, params: List[Any] = []) -> Any:
         """Invokes a method and returns its result.
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, List, Optional
 
 from ..pool import Pool, PoolStatus
+from .bulk import merge_state
 from .interfaces import WebsocketMachine
 
 
@@ -12,6 +13,10 @@ class CachingPool(Pool):
         self._fetcher = fetcher
         self._cached_state = self._state
 
+    async def refresh(self) -> None:
+        """Refreshes the state of the pool from the server."""
+        await self._fetcher.refresh_ids([self.guid])
+
     @property
     def available(self) -> bool:
         """If the pool exists on the Machine."""
@@ -76,6 +81,9 @@ class CachingPoolStateFetcher(object):
         self._parent = machine
         self._state: Dict[str, Dict[str, Any]] = {}
         self._cached_pools: List[CachingPool] = []
+        self._cached_pools_by_guid: Dict[str, CachingPool] = {}
+        self._cached_pools_by_id: Dict[int, CachingPool] = {}
+        self._cached_pools_by_name: Dict[str, CachingPool] = {}
 
     @classmethod
     async def create(
@@ -96,14 +104,41 @@ class CachingPoolStateFetcher(object):
         """Returns a list of pools known to the host."""
         return self._cached_pools
 
+    def get_pool(self, name: str) -> Optional[CachingPool]:
+        """Returns the cached pool with the given name, if known."""
+        return self._cached_pools_by_name.get(name)
+
+    def get_pool_by_guid(self, guid: str) -> Optional[CachingPool]:
+        """Returns the cached pool with the given guid, if known."""
+        return self._cached_pools_by_guid.get(guid)
+
+    def get_pool_by_id(self, id: int) -> Optional[CachingPool]:
+        """Returns the cached pool with the given id, if known."""
+        return self._cached_pools_by_id.get(id)
+
+    async def refresh_ids(self, guids: Iterable[str]) -> None:
+        """Refreshes the given pools with a single query.
+
+        Pools that no longer exist are dropped, and the rest of the cache is
+        left alone.
+        """
+        guids = list(guids)
+        if not guids:
+            return
+        pools = await self._fetch_pools([["guid", "in", guids]])
+        if merge_state(self._state, guids, pools, ("id", "name")):
+            self._update_properties_from_state()
+
     def get_cached_state(self, pool: Pool) -> Dict[str, Any]:
         return self._state[pool.guid]
 
-    async def _fetch_pools(self) -> Dict[str, Dict[str, Any]]:
+    async def _fetch_pools(
+        self, filters: Optional[List[Any]] = None
+    ) -> Dict[str, Dict[str, Any]]:
         pools = await self._parent.invoke_method(
             "pool.query",
             [
-                [],
+                filters or [],
                 {
                     "select": [
                         "encrypt",
@@ -129,3 +164,12 @@ class CachingPoolStateFetcher(object):
         self._cached_pools = [*available_pools_by_guid.values()] + [
             CachingPool(fetcher=self, guid=pool_guid) for pool_guid in pool_guids_to_add
         ]
+        self._cached_pools_by_guid = {pool.guid: pool for pool in self._cached_pools}
+        self._cached_pools_by_id = {}
+        self._cached_pools_by_name = {}
+        for pool in self._cached_pools:
+            state = self._state[pool.guid]
+            if "id" in state:
+                self._cached_pools_by_id[state["id"]] = pool
+            if "name" in state:
+                self._cached_pools_by_name[state["name"]] = pool
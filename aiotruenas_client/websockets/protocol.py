@@ -2,14 +2,17 @@ import asyncio
 import functools
 import logging
 import pprint
+import time
 import uuid
 from abc import abstractmethod
-from typing import Any, Callable, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import ejson
 
 from websockets.client import WebSocketClientProtocol
-from websockets.exceptions import NegotiationError, SecurityError
+from websockets.exceptions import ConnectionClosed, NegotiationError, SecurityError
+
+from .recording import RECEIVED, SENT, TrafficRecorder
 
 logger = logging.getLogger(__name__)
 
@@ -43,17 +46,29 @@ class SubscriptionData:
 
 
 class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, recorder: Optional[TrafficRecorder] = None, **kwargs):
         super().__init__(*args, **kwargs)
+        # Records every frame, if set.
+        self._recorder = recorder
         # Keyed by the id of the invoke message.
         self._invoke_method_futures: Dict[str, asyncio.Future] = {}
         # Keyed by the id of the subscribing message.
         self._pending_subscription_data: Dict[str, PendingSubscriptionData] = {}
         # Keyed be the "name" when subscribing, which is the "collection" when data comes in.
         self._subscription_data: Dict[str, SubscriptionData] = {}
+        self._message_handler_task: Optional[asyncio.Task] = None
 
     async def handshake(self, *args, **kwargs):
         await WebSocketClientProtocol.handshake(self, *args, **kwargs)
+        try:
+            await self._connect_and_authenticate()
+        except asyncio.CancelledError:
+            # Given up on, such as by a timeout.  Otherwise websockets waits up to
+            # `close_timeout` for the server to close the connection first.
+            self.transport.abort()
+            raise
+
+    async def _connect_and_authenticate(self) -> None:
         await self.send(
             ejson.dumps(
                 {
@@ -68,7 +83,9 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
             await self.close()
             raise NegotiationError("Unable to connect.")
 
-        asyncio.create_task(self._websocket_message_handler())
+        self._message_handler_task = asyncio.create_task(
+            self._websocket_message_handler()
+        )
 
         result = await self._authenticate()
         if not result:
@@ -79,17 +96,21 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
         id = str(uuid.uuid4())
         recv_future = asyncio.get_event_loop().create_future()
         self._invoke_method_futures[id] = recv_future
-        await super().send(
-            ejson.dumps(
-                {
-                    "id": id,
-                    "msg": "method",
-                    "method": method,
-                    "params": params,
-                }
+        try:
+            await self.send(
+                ejson.dumps(
+                    {
+                        "id": id,
+                        "msg": "method",
+                        "method": method,
+                        "params": params,
+                    }
+                )
             )
-        )
-        recv = await recv_future
+            recv = await recv_future
+        finally:
+            # Cancelled callers must not leave their future behind.
+            self._invoke_method_futures.pop(id, None)
         return recv["result"]
 
     async def subscribe(self, name: str) -> asyncio.Queue:
@@ -97,16 +118,19 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
         id = str(uuid.uuid4())
         sub_future = asyncio.get_event_loop().create_future()
         self._pending_subscription_data[id] = PendingSubscriptionData(name, sub_future)
-        await super().send(
-            ejson.dumps(
-                {
-                    "id": id,
-                    "msg": "sub",
-                    "name": name,
-                }
+        try:
+            await self.send(
+                ejson.dumps(
+                    {
+                        "id": id,
+                        "msg": "sub",
+                        "name": name,
+                    }
+                )
             )
-        )
-        return await sub_future
+            return await sub_future
+        finally:
+            self._pending_subscription_data.pop(id, None)
 
     async def unsubscribe(
         self,
@@ -114,7 +138,7 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
     ) -> None:
         assert name in self._subscription_data, f"Not currently subscribed to {name}!"
         id = self._subscription_data[name].id
-        await super().send(
+        await self.send(
             ejson.dumps(
                 {
                     "id": id,
@@ -124,6 +148,17 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
         )
         del self._subscription_data[name]
 
+    async def send(self, message: Any) -> None:
+        if self._recorder is not None:
+            self._recorder.record(SENT, message)
+        await super().send(message)
+
+    async def recv(self) -> Union[str, bytes]:
+        message = await super().recv()
+        if self._recorder is not None:
+            self._recorder.record(RECEIVED, message)
+        return message
+
     @abstractmethod
     async def _authenticate(self) -> Any:
         """
@@ -140,7 +175,8 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
             logger.error(f"Message id %s is not one we are expecting!", message["id"])
             return
         future = self._invoke_method_futures.pop(message["id"])
-        future.set_result(message)
+        if not future.done():
+            future.set_result(message)
 
     def _subscription_ready_handler(self, message: Dict[str, Any]) -> None:
         for id in message["subs"]:
@@ -148,6 +184,8 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
                 logger.error(f"Message id %s is not one we are expecting!", id)
                 continue
             pending_sub_data = self._pending_subscription_data.pop(id)
+            if pending_sub_data.future.done():
+                continue
             queue = asyncio.Queue()
             self._subscription_data[pending_sub_data.name] = SubscriptionData(id, queue)
             pending_sub_data.future.set_result(queue)
@@ -163,18 +201,34 @@ class TrueNASWebSocketClientProtocol(WebSocketClientProtocol):
         queue.put_nowait(message)
 
     async def _websocket_message_handler(self) -> None:
-        async for message in self:
-            recv = ejson.loads(message)
-            if recv["msg"] == "result":
-                self._invoke_method_handler(recv)
-            elif recv["msg"] == "ready":
-                self._subscription_ready_handler(recv)
-            elif recv["msg"] == "added" or recv["msg"] == "changed":
-                self._subscription_message_handler(recv)
-            else:
-                logger.error(
-                    f"Unhandled message from server:\n%s", pprint.pformat(recv)
-                )
+        try:
+            async for message in self:
+                recv = ejson.loads(message)
+                if recv["msg"] == "result":
+                    self._invoke_method_handler(recv)
+                elif recv["msg"] == "ready":
+                    self._subscription_ready_handler(recv)
+                elif recv["msg"] == "added" or recv["msg"] == "changed":
+                    self._subscription_message_handler(recv)
+                else:
+                    logger.error(
+                        f"Unhandled message from server:\n%s", pprint.pformat(recv)
+                    )
+        except ConnectionClosed:
+            pass
+        finally:
+            self._fail_pending(self.connection_closed_exc())
+
+    def _fail_pending(self, exc: Exception) -> None:
+        """Fails every call and subscription still waiting on the server."""
+        futures = list(self._invoke_method_futures.values()) + [
+            pending.future for pending in self._pending_subscription_data.values()
+        ]
+        self._invoke_method_futures.clear()
+        self._pending_subscription_data.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(exc)
 
 
 class TrueNASWebSocketClientProtocolPassword(TrueNASWebSocketClientProtocol):
@@ -189,6 +243,104 @@ class TrueNASWebSocketClientProtocolPassword(TrueNASWebSocketClientProtocol):
         return await self.invoke_method("auth.login", [self._username, self._password])
 
 
+class AuthTokenCache:
+    """Session tokens from `auth.generate_token`, shared between connections.
+
+    Connections that log in with a password keep a token here, and later
+    connections to the same host as the same user log in with it instead.  While
+    connected, the token is regenerated `refresh_margin` of its `ttl` before it
+    expires.
+    """
+
+    def __init__(self, ttl: int = 600, refresh_margin: float = 0.2) -> None:
+        if not 0 < refresh_margin < 1:
+            raise ValueError("refresh_margin must be between 0 and 1.")
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        # Keyed by user and host, the token and when it expires.
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+
+    @property
+    def refresh_interval(self) -> float:
+        return self.ttl * (1 - self.refresh_margin)
+
+    def refresh_delay(self, key: str) -> float:
+        """The seconds until the token for `key` is due to be regenerated.
+
+        Zero if that time has passed, or there is no token.
+        """
+        _, expires = self._tokens.get(key, (None, 0.0))
+        refresh_at = expires - self.ttl * self.refresh_margin
+        return max(refresh_at - time.monotonic(), 0.0)
+
+    def get(self, key: str) -> Optional[str]:
+        token, expires = self._tokens.get(key, (None, 0.0))
+        if token is None or expires <= time.monotonic():
+            self._tokens.pop(key, None)
+            return None
+        return token
+
+    def put(self, key: str, token: str) -> None:
+        self._tokens[key] = (token, time.monotonic() + self.ttl)
+
+    def discard(self, key: str) -> None:
+        self._tokens.pop(key, None)
+
+
+class TrueNASWebSocketClientProtocolToken(TrueNASWebSocketClientProtocolPassword):
+    """Password authentication, replaced by a session token after the first login."""
+
+    def __init__(self, *args, tokens: AuthTokenCache, token_key: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tokens = tokens
+        self._token_key = token_key
+        self._token_refresh_task: Optional[asyncio.Task] = None
+
+    async def _authenticate(self) -> Any:
+        token = self._tokens.get(self._token_key)
+        if token is not None:
+            if await self.invoke_method("auth.token", [token]):
+                self._token_refresh_task = asyncio.create_task(self._refresh_token())
+                return True
+            self._tokens.discard(self._token_key)
+        result = await super()._authenticate()
+        if result:
+            try:
+                await self._generate_token()
+            except ConnectionClosed:
+                raise
+            except Exception as exc:
+                # Logged in all the same, so later connections use the password.
+                logger.warning("Unable to generate a session token: %s", exc)
+                return result
+            self._token_refresh_task = asyncio.create_task(self._refresh_token())
+        return result
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self._token_refresh_task is not None:
+            self._token_refresh_task.cancel()
+            self._token_refresh_task = None
+        super().connection_lost(exc)
+
+    async def _generate_token(self) -> None:
+        token = await self.invoke_method("auth.generate_token", [self._tokens.ttl])
+        self._tokens.put(self._token_key, token)
+
+    async def _refresh_token(self) -> None:
+        # A cached token may have been issued long before this connection, so the
+        # first refresh is timed from when it expires.
+        delay = self._tokens.refresh_delay(self._token_key)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._generate_token()
+            except ConnectionClosed:
+                return
+            except Exception as exc:
+                logger.warning("Unable to refresh the session token: %s", exc)
+            delay = self._tokens.refresh_interval
+
+
 class TrueNASWebSocketClientProtocolApiKey(TrueNASWebSocketClientProtocol):
     """Token authentication."""
 
@@ -209,6 +361,21 @@ def truenas_password_auth_protocol_factory(
     )
 
 
+def truenas_token_auth_protocol_factory(
+    username: str,
+    password: str,
+    tokens: AuthTokenCache,
+    token_key: str,
+) -> Callable[[Any], TrueNASWebSocketClientProtocolToken]:
+    return functools.partial(
+        TrueNASWebSocketClientProtocolToken,
+        username=username,
+        password=password,
+        tokens=tokens,
+        token_key=token_key,
+    )
+
+
 def truenas_api_key_auth_protocol_factory(
     api_key: str,
 ) -> Callable[[Any], TrueNASWebSocketClientProtocolApiKey]:
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import json
+import time
+from typing import Any, Dict, List, Set, Union
+
+RECORDING_VERSION = 1
+
+# The direction of a frame, from the point of view of the client.
+SENT = ">"
+RECEIVED = "<"
+
+# Written in place of credentials, so recordings can be shared.
+REDACTED = "<redacted>"
+
+
+class RecordedFrame(object):
+    """A websocket frame, with the seconds since the recording started."""
+
+    def __init__(self, elapsed: float, direction: str, message: Any) -> None:
+        self.elapsed = elapsed
+        self.direction = direction
+        # The JSON decoded frame, with any ejson types left encoded.
+        self.message = message
+
+
+class TrafficRecorder(object):
+    """Writes every websocket frame sent or received to a log.
+
+    The log is a header line followed by one JSON array per frame, holding the
+    seconds since the recording started, the direction and the frame itself.
+    The parameters of `auth.*` calls and the tokens generated by the server are
+    redacted.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "w", encoding="utf-8")
+        self._start = time.monotonic()
+        # The message ids of `auth.generate_token` calls awaiting their result.
+        self._token_call_ids: Set[Any] = set()
+        self._write({"version": RECORDING_VERSION, "started": time.time()})
+
+    def record(self, direction: str, frame: Union[str, bytes]) -> None:
+        try:
+            message = json.loads(frame)
+        except ValueError:
+            message = frame if isinstance(frame, str) else frame.decode()
+        if isinstance(message, dict):
+            message = self._redact(direction, message)
+        elapsed = round(time.monotonic() - self._start, 6)
+        self._write([elapsed, direction, message])
+
+    def _redact(self, direction: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        if direction == SENT and message.get("msg") == "method":
+            method = message.get("method", "")
+            if method.startswith("auth."):
+                message = {
+                    **message,
+                    "params": [REDACTED for _ in message.get("params", [])],
+                }
+            if method == "auth.generate_token":
+                self._token_call_ids.add(message.get("id"))
+        elif direction == RECEIVED and message.get("msg") == "result":
+            if message.get("id") in self._token_call_ids:
+                self._token_call_ids.discard(message["id"])
+                message = {**message, "result": REDACTED}
+        return message
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _write(self, line: Any) -> None:
+        self._file.write(json.dumps(line, separators=(",", ":")))
+        self._file.write("\n")
+
+
+def read_recording(path: str) -> List[RecordedFrame]:
+    """Reads the frames of a log written by `TrafficRecorder`."""
+    with open(path, "r", encoding="utf-8") as file:
+        header = json.loads(file.readline())
+        if header.get("version") != RECORDING_VERSION:
+            raise ValueError(f"Unsupported recording version {header.get('version')}.")
+        return [RecordedFrame(*json.loads(line)) for line in file if line.strip()]
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import traceback
+from multiprocessing.connection import Connection
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from .fleet import Fleet
+from .machine import CachingMachine
+
+logger = logging.getLogger(__name__)
+
+# Keyed by kind of state, the `CachingMachine` method refreshing it and the
+# attribute holding its fetcher.
+_KINDS: Dict[str, Tuple[str, str]] = {
+    "datasets": ("get_datasets", "_dataset_fetcher"),
+    "disks": ("get_disks", "_disk_fetcher"),
+    "jails": ("get_jails", "_jail_fetcher"),
+    "pools": ("get_pools", "_pool_fetcher"),
+    "vms": ("get_vms", "_vm_fetcher"),
+}
+
+
+class StateDelta(object):
+    """The changes to one kind of state on one host, since the last delta."""
+
+    def __init__(
+        self,
+        host: str,
+        kind: str,
+        changed: Dict[str, Dict[str, Any]],
+        removed: List[str],
+        error: Optional[str] = None,
+    ) -> None:
+        self.host = host
+        self.kind = kind
+        self.changed = changed
+        self.removed = removed
+        # Set instead of the changes if the host could not be refreshed.
+        self.error = error
+
+    def __reduce__(self):
+        # Pickled as a plain tuple, to keep the messages between processes small.
+        return (
+            StateDelta,
+            (self.host, self.kind, self.changed, self.removed, self.error),
+        )
+
+
+class _WorkerFailure(object):
+    """Sent by a worker process that stopped polling its hosts because of an error."""
+
+    def __init__(self, hosts: List[str], error: str) -> None:
+        self.hosts = hosts
+        # The formatted traceback of the error.
+        self.error = error
+
+
+class ShardedFleet(object):
+    """A fleet polled by worker processes, so polling can use every core.
+
+    Hosts are spread over `processes` workers.  Each worker drives a `Fleet` of
+    its hosts on its own event loop, refreshing every `interval` seconds, and
+    sends back only the rows that changed.  The latest state of every host is
+    kept in `state`.  If a worker fails, the error is logged and recorded in
+    `errors` for each of its hosts.
+    """
+
+    def __init__(
+        self,
+        hosts: Mapping[str, Mapping[str, Any]],
+        processes: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        interval: float = 30.0,
+        kinds: Sequence[str] = ("datasets", "disks", "pools", "vms"),
+    ) -> None:
+        unknown_kinds = set(kinds) - set(_KINDS)
+        if unknown_kinds:
+            raise ValueError(f"Unknown kinds of state: {sorted(unknown_kinds)}")
+        processes = min(processes or os.cpu_count() or 1, max(len(hosts), 1))
+        self._shards: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(processes)]
+        for index, (host, options) in enumerate(hosts.items()):
+            self._shards[index % processes][host] = dict(options)
+        self._max_concurrency = max_concurrency
+        self._interval = interval
+        self._kinds = list(kinds)
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._processes: List[multiprocessing.process.BaseProcess] = []
+        self._connections: List[Connection] = []
+        # One for each consumer of `updates`, so deltas are only kept while
+        # someone is reading them.
+        self._update_queues: Set[asyncio.Queue] = set()
+        self._reader_threads: List[threading.Thread] = []
+        # Keyed by host, then kind, then the key of each row.
+        self._state: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]] = {
+            host: {kind: {} for kind in kinds} for host in hosts
+        }
+        # Keyed by host, the error from its last refresh, if it failed.
+        self._errors: Dict[str, Optional[str]] = {host: None for host in hosts}
+
+    @property
+    def state(self) -> Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]:
+        """The latest state of every host, keyed by host, kind and row key."""
+        return self._state
+
+    @property
+    def errors(self) -> Dict[str, Optional[str]]:
+        """The error from the last refresh of every host, if it failed."""
+        return self._errors
+
+    async def start(self) -> None:
+        """Starts the worker processes."""
+        loop = asyncio.get_event_loop()
+        for hosts in self._shards:
+            parent_connection, child_connection = self._context.Pipe(duplex=False)
+            process = self._context.Process(
+                target=_run_shard,
+                args=(
+                    hosts,
+                    self._max_concurrency,
+                    self._interval,
+                    self._kinds,
+                    child_connection,
+                    self._stop_event,
+                ),
+                daemon=True,
+            )
+            process.start()
+            # The worker holds the only writable end now.
+            child_connection.close()
+            self._processes.append(process)
+            self._connections.append(parent_connection)
+            # Each worker gets a thread blocking on its pipe, rather than tying
+            # up the default executor.
+            reader_thread = threading.Thread(
+                target=self._read_deltas,
+                args=(loop, parent_connection),
+                daemon=True,
+            )
+            reader_thread.start()
+            self._reader_threads.append(reader_thread)
+
+    async def close(self) -> None:
+        """Stops the worker processes."""
+        self._stop_event.set()
+        loop = asyncio.get_event_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, self._interval + 5)
+            if process.is_alive():
+                process.terminate()
+        # The readers see the end of their pipe once the workers have exited.
+        for thread in self._reader_threads:
+            await loop.run_in_executor(None, thread.join)
+        for connection in self._connections:
+            connection.close()
+        self._processes = []
+        self._connections = []
+        self._reader_threads = []
+
+    async def updates(self) -> AsyncIterator[StateDelta]:
+        """Yields every delta applied to `state` while iterating."""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._update_queues.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._update_queues.discard(queue)
+
+    def _read_deltas(
+        self, loop: asyncio.AbstractEventLoop, connection: Connection
+    ) -> None:
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                return
+            if isinstance(message, _WorkerFailure):
+                loop.call_soon_threadsafe(self._worker_failed, message)
+            else:
+                loop.call_soon_threadsafe(self._apply_deltas, message)
+
+    def _worker_failed(self, failure: _WorkerFailure) -> None:
+        logger.error(
+            "Worker polling %s stopped: %s", ", ".join(failure.hosts), failure.error
+        )
+        # The last line of the traceback names the error.
+        error = failure.error.strip().splitlines()[-1]
+        self._apply_deltas(
+            [
+                StateDelta(host, kind, {}, [], error)
+                for host in failure.hosts
+                for kind in self._kinds
+            ]
+        )
+
+    def _apply_deltas(self, deltas: List[StateDelta]) -> None:
+        for delta in deltas:
+            self._apply(delta)
+            for queue in self._update_queues:
+                queue.put_nowait(delta)
+
+    def _apply(self, delta: StateDelta) -> None:
+        self._errors[delta.host] = delta.error
+        rows = self._state[delta.host][delta.kind]
+        for key in delta.removed:
+            rows.pop(key, None)
+        rows.update(delta.changed)
+
+
+def _run_shard(
+    hosts: Dict[str, Dict[str, Any]],
+    max_concurrency: Optional[int],
+    interval: float,
+    kinds: List[str],
+    connection: Connection,
+    stop_event: Any,
+) -> None:
+    """The entry point of a worker process."""
+    try:
+        asyncio.run(
+            _poll_shard(hosts, max_concurrency, interval, kinds, connection, stop_event)
+        )
+    except Exception:
+        # Otherwise the parent could not tell this worker's hosts apart from
+        # ones that are not changing.
+        try:
+            connection.send(_WorkerFailure(list(hosts), traceback.format_exc()))
+        except (OSError, ValueError):
+            pass
+        raise
+    finally:
+        connection.close()
+
+
+async def _poll_shard(
+    hosts: Dict[str, Dict[str, Any]],
+    max_concurrency: Optional[int],
+    interval: float,
+    kinds: List[str],
+    connection: Connection,
+    stop_event: Any,
+) -> None:
+    fleet = Fleet(hosts, max_concurrency=max_concurrency)
+    # Keyed by host, then kind, the rows last sent to the parent.
+    sent: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]] = {
+        host: {kind: {} for kind in kinds} for host in hosts
+    }
+    failed_hosts = set()
+
+    async def refresh(machine: CachingMachine) -> None:
+        for kind in kinds:
+            await getattr(machine, _KINDS[kind][0])()
+
+    loop = asyncio.get_event_loop()
+    try:
+        while not stop_event.is_set():
+            await fleet.connect()
+            await fleet.run(refresh)
+            deltas = []
+            for host, health in fleet.health.items():
+                machine = fleet.machines.get(host)
+                if health.error is not None or machine is None:
+                    failed_hosts.add(host)
+                    deltas += [
+                        StateDelta(host, kind, {}, [], str(health.error))
+                        for kind in kinds
+                    ]
+                    continue
+                for kind in kinds:
+                    state = getattr(machine, _KINDS[kind][1])._state
+                    delta = _diff(host, kind, sent[host][kind], state)
+                    if delta is None and host in failed_hosts:
+                        # Still sent, to clear the error.
+                        delta = StateDelta(host, kind, {}, [])
+                    if delta is not None:
+                        deltas.append(delta)
+                    sent[host][kind] = dict(state)
+                failed_hosts.discard(host)
+            if deltas:
+                connection.send(deltas)
+
+            deadline = loop.time() + interval
+            while not stop_event.is_set() and loop.time() < deadline:
+                await asyncio.sleep(min(0.05, interval))
+    finally:
+        await fleet.close()
+
+
+def _diff(
+    host: str,
+    kind: str,
+    previous: Dict[str, Dict[str, Any]],
+    current: Dict[str, Dict[str, Any]],
+) -> Optional[StateDelta]:
+    changed = {key: row for key, row in current.items() if previous.get(key) != row}
+    removed = [key for key in previous if key not in current]
+    if not changed and not removed:
+        return None
+    return StateDelta(host, kind, changed, removed)
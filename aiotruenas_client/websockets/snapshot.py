@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Dict, List
+
+import ejson
+
+if TYPE_CHECKING:
+    from .machine import CachingMachine
+
+# The first line of every snapshot, followed by a line with the format version
+# and then the ejson payload.  The payload is kept uncompressed and on a single
+# line, so a reader can map the file and skip straight to it.
+SNAPSHOT_MAGIC = b"aiotruenas-client snapshot\n"
+SNAPSHOT_VERSION = 1
+
+# Keyed by kind of state, the attribute holding its fetcher.
+SNAPSHOT_KINDS: Dict[str, str] = {
+    "datasets": "_dataset_fetcher",
+    "disks": "_disk_fetcher",
+    "jails": "_jail_fetcher",
+    "pools": "_pool_fetcher",
+    "vms": "_vm_fetcher",
+}
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot can not be read."""
+
+
+def dump_snapshot(machine: CachingMachine) -> bytes:
+    """Serializes the cached state of `machine`."""
+    payload: Dict[str, Any] = {
+        "created": time.time(),
+        "disk_temperatures": machine._disk_fetcher._fetch_temperature,
+        "jobs": list(machine._job_fetcher._state.values()),
+    }
+    for kind, fetcher_name in SNAPSHOT_KINDS.items():
+        payload[kind] = getattr(machine, fetcher_name)._state
+    return (
+        SNAPSHOT_MAGIC
+        + b"%d\n" % SNAPSHOT_VERSION
+        + ejson.dumps(payload, separators=(",", ":")).encode()
+    )
+
+
+def load_snapshot(machine: CachingMachine, data: bytes) -> List[str]:
+    """Restores the cached state of `machine`, returning the kinds restored."""
+    if not data.startswith(SNAPSHOT_MAGIC):
+        raise SnapshotError("Not a snapshot.")
+    version, _, payload = data[len(SNAPSHOT_MAGIC) :].partition(b"\n")
+    if version != b"%d" % SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version!r}.")
+    try:
+        state = ejson.loads(payload.decode())
+    except ValueError as exc:
+        raise SnapshotError(f"Corrupt snapshot: {exc}") from exc
+    _check_payload(state)
+
+    machine._disk_fetcher._fetch_temperature = state["disk_temperatures"]
+    machine._job_fetcher.restore_jobs(state["jobs"])
+    kinds = []
+    for kind, fetcher_name in SNAPSHOT_KINDS.items():
+        if not state[kind]:
+            continue
+        fetcher = getattr(machine, fetcher_name)
+        previous_state = fetcher._state
+        fetcher._state = state[kind]
+        try:
+            if kind == "datasets":
+                fetcher._update_hierarchy_from_state(previous_state)
+            fetcher._update_properties_from_state()
+        except (KeyError, TypeError, ValueError) as exc:
+            fetcher._state = previous_state
+            raise SnapshotError(f"Corrupt {kind} in snapshot: {exc!r}") from exc
+        kinds.append(kind)
+    return kinds
+
+
+def _check_payload(state: Any) -> None:
+    """Raises `SnapshotError` unless `state` has the shape `dump_snapshot` writes.
+
+    Checked before anything is restored, so a bad snapshot changes nothing.
+    """
+    if not isinstance(state, dict):
+        raise SnapshotError("Corrupt snapshot: the payload is not an object.")
+    missing = [
+        key
+        for key in ("disk_temperatures", "jobs", *SNAPSHOT_KINDS)
+        if key not in state
+    ]
+    if missing:
+        raise SnapshotError(f"Corrupt snapshot: missing {', '.join(missing)}.")
+    if not isinstance(state["disk_temperatures"], bool):
+        raise SnapshotError("Corrupt snapshot: disk_temperatures is not a boolean.")
+    if not isinstance(state["jobs"], list) or not all(
+        isinstance(job_state, dict) and "id" in job_state for job_state in state["jobs"]
+    ):
+        raise SnapshotError("Corrupt snapshot: jobs is not a list of jobs.")
+    for kind in SNAPSHOT_KINDS:
+        if not isinstance(state[kind], dict) or not all(
+            isinstance(item, dict) for item in state[kind].values()
+        ):
+            raise SnapshotError(f"Corrupt snapshot: {kind} is not an object.")
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import contextlib
+import ssl
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+_default_ssl_context: Optional[ResumingSSLContext] = None
+
+# The port being connected to, set by `ResumingSSLContext.connecting_to`.
+_connecting_port: ContextVar[Optional[int]] = ContextVar(
+    "_connecting_port", default=None
+)
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """An `SSLContext` that resumes the last TLS session with each host and port.
+
+    Sharing one between machines, or across reconnects, lets connections to a
+    host skip the full handshake.  Like `ssl.create_default_context`, it checks
+    certificates and host names unless told not to.
+    """
+
+    def __new__(
+        cls, protocol: int = ssl.PROTOCOL_TLS_CLIENT, *args: Any, **kwargs: Any
+    ) -> ResumingSSLContext:
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, protocol: int = ssl.PROTOCOL_TLS_CLIENT) -> None:
+        super().__init__()
+        # Keyed by the host name given when connecting, and the port.
+        self._sessions: Dict[Tuple[str, Optional[int]], ssl.SSLSession] = {}
+
+    @contextlib.contextmanager
+    def connecting_to(self, port: int) -> Iterator[None]:
+        """Resumes sessions with `port` for connections made within the block.
+
+        `wrap_bio` is only given the host name, so without this, services on
+        different ports of one host would share a session.
+        """
+        token = _connecting_port.set(port)
+        try:
+            yield
+        finally:
+            _connecting_port.reset(token)
+
+    def wrap_bio(
+        self,
+        incoming: ssl.MemoryBIO,
+        outgoing: ssl.MemoryBIO,
+        server_side: bool = False,
+        server_hostname: Optional[str] = None,
+        session: Optional[ssl.SSLSession] = None,
+    ) -> ssl.SSLObject:
+        # asyncio wraps every connection with this, without a session.
+        if session is None and not server_side and server_hostname is not None:
+            session = self._sessions.get((server_hostname, _connecting_port.get()))
+        return super().wrap_bio(
+            incoming,
+            outgoing,
+            server_side=server_side,
+            server_hostname=server_hostname,
+            session=session,
+        )
+
+    def save_session(
+        self, ssl_object: ssl.SSLObject, port: Optional[int] = None
+    ) -> None:
+        """Keeps the session of a connection to `port`, to resume it on the next one."""
+        session = ssl_object.session
+        if ssl_object.server_hostname is not None and session is not None:
+            self._sessions[(ssl_object.server_hostname, port)] = session
+
+
+def default_ssl_context() -> ResumingSSLContext:
+    """Returns the context shared by machines not given one.
+
+    TrueNAS machines usually have self-signed certificates, so it does not check
+    them.
+    """
+    global _default_ssl_context
+    if _default_ssl_context is None:
+        context = ResumingSSLContext()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        _default_ssl_context = context
+    return _default_ssl_context
@@ -1,10 +1,22 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Union
 
+from ..job import Job, TJobId
 from ..virtualmachine import VirtualMachine, VirtualMachineState
+from .bulk import gather_bounded, merge_state, raise_first_exception, run_jobs
 from .interfaces import WebsocketMachine
 
+logger = logging.getLogger(__name__)
+
+_VM_FIELDS = [
+    "id",
+    "name",
+    "description",
+    "status",
+]
+
 
 class CachingVirtualMachine(VirtualMachine):
     def __init__(self, fetcher: CachingVirtualMachineStateFetcher, id: int) -> None:
@@ -24,6 +36,10 @@ class CachingVirtualMachine(VirtualMachine):
         """Restarts a running virtual machine."""
         return await self._fetcher.restart_vm(self)
 
+    async def refresh(self) -> None:
+        """Refreshes the state of the virtual machine from the server."""
+        await self._fetcher.refresh_ids([self.id])
+
     @property
     def available(self) -> bool:
         """If the virtual machine exists on the server."""
@@ -62,6 +78,8 @@ class CachingVirtualMachineStateFetcher(object):
         self._parent = machine
         self._state: Dict[str, Dict[str, Any]] = {}
         self._cached_vms: List[CachingVirtualMachine] = []
+        self._cached_vms_by_id: Dict[int, CachingVirtualMachine] = {}
+        self._cached_vms_by_name: Dict[str, CachingVirtualMachine] = {}
 
     @classmethod
     async def create(
@@ -82,6 +100,14 @@ class CachingVirtualMachineStateFetcher(object):
         """Returns a list of virtual machines on the host."""
         return self._cached_vms
 
+    def get_vm(self, name: str) -> Optional[CachingVirtualMachine]:
+        """Returns the cached virtual machine with the given name, if known."""
+        return self._cached_vms_by_name.get(name)
+
+    def get_vm_by_id(self, id: int) -> Optional[CachingVirtualMachine]:
+        """Returns the cached virtual machine with the given id, if known."""
+        return self._cached_vms_by_id.get(id)
+
     async def start_vm(self, vm: VirtualMachine, overcommit: bool = False) -> bool:
         return await self._parent.invoke_method(
             "vm.start",
@@ -104,26 +130,119 @@ class CachingVirtualMachineStateFetcher(object):
         # Restart seems to return `None`, so check for that if we are not throwing.
         return job.result_or_raise_error == None
 
+    async def start_vms(
+        self,
+        vms: Iterable[VirtualMachine],
+        overcommit: bool = False,
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Starts many virtual machines, returning the results in order.
+
+        At most `max_concurrency` calls are in flight at a time, and the cached
+        state of every virtual machine is refreshed with a single query at the
+        end.  Like `asyncio.gather`, the first error is raised unless
+        `return_exceptions` is set.
+        """
+        vms = list(vms)
+
+        async def start(vm: VirtualMachine) -> bool:
+            return await self._parent.invoke_method(
+                "vm.start", [vm.id, {"overcommit": overcommit}]
+            )
+
+        results = await gather_bounded(vms, start, max_concurrency)
+        return await self._finish_bulk(vms, results, return_exceptions)
+
+    async def stop_vms(
+        self,
+        vms: Iterable[VirtualMachine],
+        force: bool = False,
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Stops many virtual machines, returning the results in order.
+
+        The jobs are waited on together.  See `start_vms` for how concurrency,
+        state and errors are handled.
+        """
+        vms = list(vms)
+
+        async def stop(vm: VirtualMachine) -> TJobId:
+            return await self._parent.invoke_method(
+                "vm.stop", [vm.id, {"force_after_timeout": force}]
+            )
+
+        jobs = await run_jobs(self._parent, vms, stop, max_concurrency)
+        results = [_job_result(job) for job in jobs]
+        return await self._finish_bulk(vms, results, return_exceptions)
+
+    async def restart_vms(
+        self,
+        vms: Iterable[VirtualMachine],
+        max_concurrency: Optional[int] = None,
+        return_exceptions: bool = False,
+    ) -> List[Union[bool, BaseException]]:
+        """Restarts many virtual machines, returning the results in order.
+
+        The jobs are waited on together.  See `start_vms` for how concurrency,
+        state and errors are handled.
+        """
+        vms = list(vms)
+
+        async def restart(vm: VirtualMachine) -> TJobId:
+            return await self._parent.invoke_method("vm.restart", [vm.id])
+
+        jobs = await run_jobs(self._parent, vms, restart, max_concurrency)
+        results = [_job_result(job) for job in jobs]
+        return await self._finish_bulk(vms, results, return_exceptions)
+
+    async def refresh_ids(self, ids: Iterable[int]) -> None:
+        """Refreshes the given virtual machines with a single query.
+
+        Virtual machines that no longer exist are dropped, and the rest of the
+        cache is left alone.
+        """
+        ids = list(ids)
+        if not ids:
+            return
+        vms = await self._fetch_vms([["id", "in", ids]])
+        if merge_state(self._state, [str(id) for id in ids], vms, ("name",)):
+            self._update_properties_from_state()
+
     def get_cached_state(self, vm: VirtualMachine) -> Dict[str, Any]:
         return self._state[str(vm.id)]
 
-    async def _fetch_vms(self) -> Dict[str, Dict[str, Any]]:
+    async def _fetch_vms(
+        self, filters: Optional[List[Any]] = None
+    ) -> Dict[str, Dict[str, Any]]:
         vms = await self._parent.invoke_method(
             "vm.query",
             [
-                [],
+                filters or [],
                 {
-                    "select": [
-                        "id",
-                        "name",
-                        "description",
-                        "status",
-                    ],
+                    "select": _VM_FIELDS,
                 },
             ],
         )
         return {str(vm["id"]): vm for vm in vms}
 
+    async def _finish_bulk(
+        self,
+        vms: List[VirtualMachine],
+        results: List[Union[bool, BaseException]],
+        return_exceptions: bool,
+    ) -> List[Union[bool, BaseException]]:
+        if vms:
+            try:
+                await self.refresh_ids([vm.id for vm in vms])
+            except Exception as exc:
+                # The operations themselves are done; only the cache is stale.
+                logger.warning("Unable to refresh virtual machine state: %s", exc)
+        if return_exceptions:
+            return results
+        return raise_first_exception(results)
+
     async def _fetch_vm_status(self, vm: VirtualMachine) -> Dict[str, Any]:
         return await self._parent.invoke_method(
             "vm.status",
@@ -142,3 +261,19 @@ class CachingVirtualMachineStateFetcher(object):
             CachingVirtualMachine(fetcher=self, id=int(vm_id))
             for vm_id in vm_ids_to_add
         ]
+        self._cached_vms_by_id = {vm.id: vm for vm in self._cached_vms}
+        self._cached_vms_by_name = {
+            self._state[str(vm.id)]["name"]: vm
+            for vm in self._cached_vms
+            if "name" in self._state[str(vm.id)]
+        }
+
+
+def _job_result(job: Union[Job, BaseException]) -> Union[bool, BaseException]:
+    if isinstance(job, BaseException):
+        return job
+    try:
+        # Stop and restart seem to return `None`, so check for that if we are not throwing.
+        return job.result_or_raise_error == None
+    except Exception as exc:
+        return exc
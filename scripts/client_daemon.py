@@ -0,0 +1,427 @@
+"""Holds authenticated connections to TrueNAS machines for short-lived scripts.
+
+The daemon listens on a Unix socket for requests, one JSON object per line,
+each with an `id` and the `connection` to use:
+
+    {"id": 1, "connection": {...}, "method": "disk.query", "params": []}
+    {"id": 2, "connection": {...}, "subscribe": ["core.get_jobs"]}
+
+Requests are answered with a `result` or an `error` for their `id`, in the
+order they finish.  Once subscribed, a `message` is sent for the `id` of the
+subscription for every message received, until the script disconnects.  Connections are made the first
+time they are asked for, and reused by every later request.  A topic nobody listens to any more is unsubscribed
+from, and a script that falls too far behind reading its messages is disconnected.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, cast
+
+import ejson
+
+from aiotruenas_client.websockets import CachingMachine as Machine
+from aiotruenas_client.websockets.protocol import (
+    TrueNASWebSocketClientProtocol,
+    truenas_api_key_auth_protocol_factory,
+    truenas_password_auth_protocol_factory,
+)
+from aiotruenas_client.websockets.tls import default_ssl_context
+from websockets.exceptions import ConnectionClosed
+from websockets.legacy.client import connect
+
+DEFAULT_SOCKET_PATH = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()),
+    f"aiotruenas-client-{os.getuid()}.sock",
+)
+
+# Host, username, password, api_key and secure.
+TConnectionKey = Tuple[str, Optional[str], Optional[str], Optional[str], bool]
+
+# Scripts with more than this many bytes of messages waiting to be read are
+# disconnected, rather than buffered for without limit.
+MAX_UNREAD_BYTES = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Hold connections to TrueNAS machines for other scripts to use.",
+    )
+    parser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET_PATH,
+        help="The Unix socket to listen on.",
+    )
+    return parser
+
+
+async def connect_client(
+    host: str,
+    username: Optional[str],
+    password: Optional[str],
+    secure: bool,
+    api_key: Optional[str],
+) -> TrueNASWebSocketClientProtocol:
+    # Connects without a machine, so no topics are subscribed to on our behalf.
+    if api_key:
+        auth_protocol = truenas_api_key_auth_protocol_factory(api_key)
+    else:
+        assert username is not None and password is not None
+        auth_protocol = truenas_password_auth_protocol_factory(username, password)
+    return cast(
+        TrueNASWebSocketClientProtocol,
+        await connect(
+            f"{'wss' if secure else 'ws'}://{host}/websocket",
+            create_protocol=auth_protocol,
+            ssl=default_ssl_context() if secure else None,
+        ),
+    )
+
+
+class DaemonError(Exception):
+    """Raised when the daemon could not make a call."""
+
+
+class DaemonClient:
+    """Makes calls through the daemon, as `CachingMachine` would directly."""
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        connection: Dict[str, Any],
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._connection = connection
+        self._next_id = 0
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._read_task = asyncio.ensure_future(self._read_responses())
+
+    @classmethod
+    async def connect(
+        cls,
+        path: str,
+        host: str,
+        username: Optional[str],
+        password: Optional[str],
+        api_key: Optional[str],
+        secure: bool,
+    ) -> Optional["DaemonClient"]:
+        """Connects to the daemon, or returns `None` if it is not running."""
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+        except OSError:
+            return None
+        return cls(
+            reader,
+            writer,
+            {
+                "host": host,
+                "username": username,
+                "password": password,
+                "api_key": api_key,
+                "secure": secure,
+            },
+        )
+
+    async def invoke_method(self, method: str, params: List[Any] = []) -> Any:
+        id = self._send({"method": method, "params": params})
+        return await self._result(id)
+
+    async def subscribe(self, name: str) -> asyncio.Queue:
+        id = self._send({"subscribe": [name]})
+        queue: asyncio.Queue = asyncio.Queue()
+        self._queues[id] = queue
+        # Answered once subscribed, and then with every message.
+        await self._result(id)
+        return queue
+
+    async def wait_closed(self) -> None:
+        await asyncio.shield(self._read_task)
+
+    async def close(self) -> None:
+        self._writer.close()
+        self._read_task.cancel()
+
+    def _send(self, request: Dict[str, Any]) -> int:
+        self._next_id += 1
+        request = {"id": self._next_id, "connection": self._connection, **request}
+        self._writer.write(ejson.dumps(request).encode() + b"\n")
+        return self._next_id
+
+    async def _result(self, id: int) -> Any:
+        future = asyncio.get_event_loop().create_future()
+        self._futures[id] = future
+        try:
+            response = await future
+        finally:
+            self._futures.pop(id, None)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response["result"]
+
+    async def _read_responses(self) -> None:
+        try:
+            async for line in self._reader:
+                response = ejson.loads(line)
+                id = response["id"]
+                if "message" in response:
+                    self._queues[id].put_nowait(response["message"])
+                elif id in self._futures and not self._futures[id].done():
+                    self._futures[id].set_result(response)
+        finally:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(DaemonError("The daemon went away."))
+
+
+class _Topic:
+    """A topic subscribed to on a machine, and the scripts listening to it."""
+
+    def __init__(self, queue: asyncio.Queue) -> None:
+        self.listeners: Set[Tuple[int, asyncio.StreamWriter]] = set()
+        self.task = asyncio.ensure_future(self._forward(queue))
+
+    async def _forward(self, queue: asyncio.Queue) -> None:
+        while True:
+            message = await queue.get()
+            for id, writer in list(self.listeners):
+                if writer.is_closing():
+                    self.listeners.discard((id, writer))
+                    continue
+                if writer.transport.get_write_buffer_size() > MAX_UNREAD_BYTES:
+                    # Messages arrive whether or not a script reads them, so a
+                    # slow one can not be waited for.
+                    logger.warning("Disconnecting a script that is not reading.")
+                    self.listeners.discard((id, writer))
+                    # Closing would wait for the unread messages to be sent.
+                    writer.transport.abort()
+                    continue
+                write_response(writer, {"id": id, "message": message})
+
+
+def write_response(writer: asyncio.StreamWriter, response: Dict[str, Any]) -> None:
+    writer.write(ejson.dumps(response).encode() + b"\n")
+
+
+class ClientDaemon:
+    def __init__(self) -> None:
+        self._machines: Dict[TConnectionKey, asyncio.Future] = {}
+        # A connection of its own for subscriptions, as the machine's fetchers
+        # hold topics such as core.get_jobs.
+        self._subscription_clients: Dict[TConnectionKey, asyncio.Future] = {}
+        self._topics: Dict[Tuple[TConnectionKey, str], _Topic] = {}
+        # Keyed like the subscription connections, held while their topics change.
+        self._topic_locks: Dict[TConnectionKey, asyncio.Lock] = {}
+
+    async def close(self) -> None:
+        for topic in self._topics.values():
+            topic.task.cancel()
+        for futures in (self._machines, self._subscription_clients):
+            for future in futures.values():
+                if future.done() and not future.exception():
+                    await future.result().close()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        tasks: Set[asyncio.Task] = set()
+        # Held while draining, which only one task may do at a time.
+        write_lock = asyncio.Lock()
+        try:
+            async for line in reader:
+                task = asyncio.ensure_future(
+                    self._handle_request(line, writer, write_lock)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            await self._remove_listener(writer)
+
+    async def _handle_request(
+        self, line: bytes, writer: asyncio.StreamWriter, write_lock: asyncio.Lock
+    ) -> None:
+        request: Dict[str, Any] = {}
+        try:
+            request = ejson.loads(line)
+            connection = request["connection"]
+            key: TConnectionKey = (
+                connection["host"],
+                connection.get("username"),
+                connection.get("password"),
+                connection.get("api_key"),
+                connection.get("secure", True),
+            )
+            if "subscribe" in request:
+                for name in request["subscribe"]:
+                    await self._subscribe(key, name, request["id"], writer)
+                response: Dict[str, Any] = {"result": None}
+            else:
+                response = {"result": await self._invoke(key, request)}
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            response = {"error": repr(exc)}
+        write_response(writer, {"id": request.get("id"), **response})
+        async with write_lock:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                # The script went away, and its connection is being cleaned up.
+                pass
+
+    async def _invoke(self, key: TConnectionKey, request: Dict[str, Any]) -> Any:
+        machine = await self._connection(self._machines, key, self._create_machine)
+        try:
+            return await machine.invoke_method(
+                request["method"], request.get("params", [])
+            )
+        except ConnectionClosed:
+            # Reconnect on the next request.
+            self._machines.pop(key, None)
+            raise
+
+    async def _subscribe(
+        self,
+        key: TConnectionKey,
+        name: str,
+        id: int,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        async with self._topic_locks.setdefault(key, asyncio.Lock()):
+            if (key, name) not in self._topics:
+                client = await self._connection(
+                    self._subscription_clients, key, self._create_client
+                )
+                self._topics[(key, name)] = _Topic(await client.subscribe(name))
+            self._topics[(key, name)].listeners.add((id, writer))
+
+    async def _remove_listener(self, writer: asyncio.StreamWriter) -> None:
+        """Stops sending messages to a script, and drops topics nobody listens to."""
+        for (key, name), topic in list(self._topics.items()):
+            topic.listeners = {
+                listener for listener in topic.listeners if listener[1] is not writer
+            }
+            if not topic.listeners:
+                await self._close_topic(key, name)
+
+    async def _close_topic(self, key: TConnectionKey, name: str) -> None:
+        async with self._topic_locks.setdefault(key, asyncio.Lock()):
+            topic = self._topics.get((key, name))
+            if topic is None or topic.listeners:
+                # Closed already, or listened to again since.
+                return
+            del self._topics[(key, name)]
+            topic.task.cancel()
+            future = self._subscription_clients.get(key)
+            if future is None or not future.done() or future.exception():
+                return
+            client = future.result()
+            if any(topic_key == key for topic_key, _ in self._topics):
+                try:
+                    await client.unsubscribe(name)
+                except ConnectionClosed:
+                    self._subscription_clients.pop(key, None)
+                return
+            # Nothing else is subscribed to on the connection, so close it.
+            self._subscription_clients.pop(key, None)
+            await client.close()
+
+    async def _connection(
+        self,
+        connections: Dict[TConnectionKey, asyncio.Future],
+        key: TConnectionKey,
+        create: Callable[..., Awaitable[Any]],
+    ) -> Any:
+        future = connections.get(key)
+        if future is not None and future.done():
+            if future.exception() or future.result().closed:
+                future = None
+        if future is None:
+            logger.info("Connecting to %s.", key[0])
+            future = connections[key] = asyncio.ensure_future(create(*key))
+        try:
+            # Shielded, so one caller going away does not fail the others.
+            return await asyncio.shield(future)
+        except Exception:
+            connections.pop(key, None)
+            raise
+
+    @staticmethod
+    async def _create_machine(
+        host: str,
+        username: Optional[str],
+        password: Optional[str],
+        api_key: Optional[str],
+        secure: bool,
+    ) -> Machine:
+        return await Machine.create(
+            host=host,
+            username=username,
+            password=password,
+            api_key=api_key,
+            secure=secure,
+        )
+
+    @staticmethod
+    async def _create_client(
+        host: str,
+        username: Optional[str],
+        password: Optional[str],
+        api_key: Optional[str],
+        secure: bool,
+    ) -> TrueNASWebSocketClientProtocol:
+        return await connect_client(host, username, password, secure, api_key)
+
+
+async def serve(path: str) -> None:
+    if os.path.exists(path):
+        try:
+            _, writer = await asyncio.open_unix_connection(path)
+        except OSError:
+            # Left behind by a daemon that did not shut down cleanly.
+            os.unlink(path)
+        else:
+            writer.close()
+            sys.exit(f"A daemon is already listening on {path}.")
+    daemon = ClientDaemon()
+    # The daemon makes calls with the credentials it holds, for anyone who can
+    # reach the socket, so only our user may.
+    umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(daemon.handle_connection, path)
+    finally:
+        os.umask(umask)
+    print(f"Listening on {path}...", file=sys.stderr)
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+        await daemon.close()
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    library_logger = logging.getLogger("aiotruenas_client")
+    library_logger.setLevel(logging.ERROR)
+    library_logger.addHandler(logging.StreamHandler())
+
+    try:
+        asyncio.get_event_loop().run_until_complete(serve(args.socket))
+    except KeyboardInterrupt:
+        pass
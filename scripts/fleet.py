@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import ejson
+import yaml
+
+from aiotruenas_client.websockets.protocol import TrueNASWebSocketClientProtocol
+from client_daemon import connect_client
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Invoke a method on many remote TrueNAS machines at once.",
+    )
+    parser.add_argument(
+        "-i",
+        "--insecure",
+        action="store_true",
+        help="Do not encrypt connections, unless a host sets secure itself",
+    )
+    parser.add_argument("method", help="The method to invoke on every machine.")
+    parser.add_argument(
+        "--arguments",
+        help="The JSON-encoded arguments to pass to the method.",
+        default="[]",
+    )
+    parser.add_argument(
+        "--hosts",
+        default="hosts.yaml",
+        help="""A YAML file listing the machines, each with the keys of .auth.yaml:
+        host, and api_key or username and password.""",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=32,
+        help="The most machines to connect to at once.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="The seconds to give each machine to connect and answer.",
+    )
+    parser.add_argument(
+        "--slowest",
+        type=int,
+        default=5,
+        help="The number of slowest machines to list in the summary.",
+    )
+    parser.add_argument(
+        "--log-level",
+        help="The python logging level to print for this library.",
+        default="error",
+        choices=["debug", "warning", "error"],
+    )
+    return parser
+
+
+def load_hosts(path: str, secure: bool) -> List[Dict[str, Any]]:
+    with open(path, "r") as stream:
+        hosts = yaml.safe_load(stream) or []
+    if not isinstance(hosts, list):
+        raise ValueError(f"{path} must hold a list of hosts.")
+    for host in hosts:
+        if "host" not in host:
+            raise ValueError(f"A host in {path} has no host key: {host}")
+        host.setdefault("secure", secure)
+    return hosts
+
+
+async def invoke_on_host(
+    options: Dict[str, Any], method: str, args: List[Any], timeout: float
+) -> Dict[str, Any]:
+    start = time.monotonic()
+    outcome: Dict[str, Any] = {"host": options["host"]}
+    client: Optional[TrueNASWebSocketClientProtocol] = None
+    try:
+
+        async def invoke() -> Any:
+            nonlocal client
+            # A plain connection, as a machine would also subscribe to jobs.
+            client = await connect_client(
+                options["host"],
+                options.get("username"),
+                options.get("password"),
+                options["secure"],
+                options.get("api_key"),
+            )
+            return await client.invoke_method(method, args)
+
+        outcome["result"] = await asyncio.wait_for(invoke(), timeout)
+    except Exception as exc:
+        outcome["error"] = repr(exc)
+    finally:
+        # Also closes a connection made just before the timeout expired.
+        if client is not None:
+            await client.close()
+    outcome["seconds"] = round(time.monotonic() - start, 3)
+    return outcome
+
+
+async def invoke_fleet(
+    hosts: List[Dict[str, Any]],
+    method: str,
+    args: List[Any],
+    max_concurrency: int,
+    timeout: float,
+    slowest: int,
+) -> int:
+    print(f"Calling {method} on {len(hosts)} machines...", file=sys.stderr)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def invoke(options: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await invoke_on_host(options, method, args, timeout)
+
+    outcomes = []
+    for finished in asyncio.as_completed([invoke(options) for options in hosts]):
+        outcome = await finished
+        outcomes.append(outcome)
+        # Written as each machine answers, so slow ones do not hold up the rest.
+        sys.stdout.write(ejson.dumps(outcome) + "\n")
+        sys.stdout.flush()
+
+    failures = [outcome for outcome in outcomes if "error" in outcome]
+    print(
+        f"{len(outcomes) - len(failures)} succeeded, {len(failures)} failed.",
+        file=sys.stderr,
+    )
+    for outcome in failures:
+        print(f"  {outcome['host']}: {outcome['error']}", file=sys.stderr)
+    if outcomes and slowest:
+        print("Slowest:", file=sys.stderr)
+        for outcome in sorted(outcomes, key=lambda o: o["seconds"], reverse=True)[
+            :slowest
+        ]:
+            print(f"  {outcome['host']}: {outcome['seconds']:.3f}s", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def getLogLevel(parsed_value: str) -> int:
+    if parsed_value == "debug":
+        return logging.DEBUG
+    if parsed_value == "warning":
+        return logging.WARNING
+    if parsed_value == "error":
+        return logging.ERROR
+
+    raise ValueError("unepected logging level")
+
+
+if __name__ == "__main__":
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    library_logger = logging.getLogger("aiotruenas_client")
+    library_logger.setLevel(getLogLevel(args.log_level))
+    library_logger.addHandler(logging.StreamHandler())
+
+    hosts = load_hosts(args.hosts, secure=not args.insecure)
+    sys.exit(
+        asyncio.get_event_loop().run_until_complete(
+            invoke_fleet(
+                hosts=hosts,
+                method=args.method,
+                args=json.loads(args.arguments),
+                max_concurrency=args.max_concurrency,
+                timeout=args.timeout,
+                slowest=args.slowest,
+            )
+        )
+    )
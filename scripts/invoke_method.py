@@ -1,13 +1,18 @@
 import argparse
 import asyncio
+import collections
 import json
 import logging
 import pprint
-from typing import Any, List
+import sys
+import time
+from typing import IO, Any, Deque, Dict, List, Optional, Tuple, Union
 
+import ejson
 import yaml
 
 from aiotruenas_client.websockets import CachingMachine as Machine
+from client_daemon import DEFAULT_SOCKET_PATH, DaemonClient
 
 
 def init_argparse() -> argparse.ArgumentParser:
@@ -26,12 +31,38 @@ def init_argparse() -> argparse.ArgumentParser:
         action="store_true",
         help="Do not encrypt connection",
     )
-    parser.add_argument("method", help="The method to invoke on the remote machine.")
+    parser.add_argument(
+        "method",
+        nargs="?",
+        help="The method to invoke on the remote machine.",
+    )
     parser.add_argument(
         "--arguments",
         help="The JSON-encoded arguments to pass to the method.",
         default="[]",
     )
+    parser.add_argument(
+        "--batch",
+        help="""Invoke the methods listed in this file, or "-" for standard input.
+        Each line holds a method and, optionally, its JSON-encoded arguments.
+        Results are written as one JSON object per line, in the order of the input.""",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=16,
+        help="The most batched calls to have waiting on the remote machine at once.",
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        default=DEFAULT_SOCKET_PATH,
+        help="Make calls through scripts/client_daemon.py listening here, if it is running.",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Always connect directly, even if the daemon is running.",
+    )
     parser.add_argument(
         "--host",
         help="The host or IP address of the TrueNAS machine.  Loads from .auth.yaml if not present.",
@@ -61,28 +92,144 @@ def init_argparse() -> argparse.ArgumentParser:
     return parser
 
 
-async def invoke_method(
+async def connect_machine(
     host: str,
     username: str,
     password: str,
     secure: bool,
-    method: str,
     api_key: str,
-    args: List[Any],
-) -> None:
-    print(f"Connecting to {host} to call {method}...")
-    machine = await Machine.create(
+    daemon_socket: Optional[str],
+) -> Union[Machine, DaemonClient]:
+    if daemon_socket is not None:
+        client = await DaemonClient.connect(
+            daemon_socket, host, username, password, api_key, secure
+        )
+        if client is not None:
+            return client
+    return await Machine.create(
         host=host,
         username=username,
         password=password,
         api_key=api_key,
         secure=secure,
     )
+
+
+async def invoke_method(
+    host: str,
+    username: str,
+    password: str,
+    secure: bool,
+    method: str,
+    api_key: str,
+    args: List[Any],
+    daemon_socket: Optional[str],
+) -> None:
+    print(f"Connecting to {host} to call {method}...")
+    machine = await connect_machine(
+        host, username, password, secure, api_key, daemon_socket
+    )
     result = await machine.invoke_method(method, args)
     pprint.pprint(result)
     await machine.close()
 
 
+def parse_batch_line(line: str) -> Tuple[str, List[Any]]:
+    method, _, arguments = line.strip().partition(" ")
+    args = json.loads(arguments) if arguments.strip() else []
+    if not isinstance(args, list):
+        raise ValueError("The arguments must be a JSON list.")
+    return method, args
+
+
+async def invoke_call(
+    machine: Union[Machine, DaemonClient],
+    method: str,
+    args: List[Any],
+    timings: Dict[str, List[float]],
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        return {"result": await machine.invoke_method(method, args)}
+    except Exception as exc:
+        return {"error": repr(exc)}
+    finally:
+        timings[method].append(time.perf_counter() - start)
+
+
+def print_timings(timings: Dict[str, List[float]]) -> None:
+    for method, samples in sorted(timings.items()):
+        samples.sort()
+        p50 = samples[len(samples) // 2] * 1000
+        p99 = samples[min(int(len(samples) * 0.99), len(samples) - 1)] * 1000
+        print(
+            f"{method}: {len(samples)} calls, p50 {p50:.1f}ms, "
+            f"p99 {p99:.1f}ms, max {samples[-1] * 1000:.1f}ms",
+            file=sys.stderr,
+        )
+
+
+async def invoke_batch(
+    host: str,
+    username: str,
+    password: str,
+    secure: bool,
+    api_key: str,
+    input: IO[str],
+    max_in_flight: int,
+    daemon_socket: Optional[str],
+) -> None:
+    print(f"Connecting to {host}...", file=sys.stderr)
+    machine = await connect_machine(
+        host, username, password, secure, api_key, daemon_socket
+    )
+    loop = asyncio.get_event_loop()
+    timings: Dict[str, List[float]] = collections.defaultdict(list)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    # The calls not written out yet, in the order of the input.
+    pending: Deque[Tuple[int, str, asyncio.Future]] = collections.deque()
+
+    async def call(method: str, args: List[Any]) -> Dict[str, Any]:
+        try:
+            return await invoke_call(machine, method, args, timings)
+        finally:
+            in_flight.release()
+
+    def write(line_number: int, method: str, outcome: Dict[str, Any]) -> None:
+        sys.stdout.write(
+            ejson.dumps({"line": line_number, "method": method, **outcome}) + "\n"
+        )
+
+    async def write_finished(wait: bool) -> None:
+        while pending and (wait or pending[0][2].done()):
+            line_number, method, future = pending.popleft()
+            write(line_number, method, await future)
+
+    line_number = 0
+    while True:
+        # Read without blocking the calls already in flight.
+        line = await loop.run_in_executor(None, input.readline)
+        if not line:
+            break
+        line_number += 1
+        if not line.strip() or line.startswith("#"):
+            continue
+        try:
+            method, args = parse_batch_line(line)
+        except ValueError as exc:
+            future = loop.create_future()
+            future.set_result({"error": repr(exc)})
+            pending.append((line_number, line.strip(), future))
+            continue
+        await in_flight.acquire()
+        pending.append((line_number, method, asyncio.ensure_future(call(method, args))))
+        await write_finished(wait=False)
+    await write_finished(wait=True)
+    sys.stdout.flush()
+    await machine.close()
+    print_timings(timings)
+
+
 def getLogLevel(parsed_value: str) -> int:
     if parsed_value == "debug":
         return logging.DEBUG
@@ -122,6 +269,25 @@ if __name__ == "__main__":
             api_key = data.get("api_key", args.api_key)
     except IOError:
         pass
+    daemon_socket = None if args.no_daemon else args.daemon_socket
+    if args.batch is not None:
+        input = sys.stdin if args.batch == "-" else open(args.batch, "r")
+        with input:
+            asyncio.get_event_loop().run_until_complete(
+                invoke_batch(
+                    host=host,
+                    username=username,
+                    password=password,
+                    secure=secure,
+                    api_key=api_key,
+                    input=input,
+                    max_in_flight=args.max_in_flight,
+                    daemon_socket=daemon_socket,
+                )
+            )
+        sys.exit()
+    if args.method is None:
+        parser.error("Either a method or --batch is required.")
     asyncio.get_event_loop().run_until_complete(
         invoke_method(
             host=host,
@@ -131,5 +297,6 @@ if __name__ == "__main__":
             api_key=api_key,
             method=args.method,
             args=json.loads(args.arguments),
+            daemon_socket=daemon_socket,
         )
     )
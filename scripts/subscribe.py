@@ -1,11 +1,16 @@
 import argparse
 import asyncio
 import logging
-import pprint
+import os
+import sys
+import time
+from typing import IO, Dict, List, Optional, Union
 
+import ejson
 import yaml
 
-from aiotruenas_client.websockets import CachingMachine as Machine
+from aiotruenas_client.websockets.protocol import TrueNASWebSocketClientProtocol
+from client_daemon import DEFAULT_SOCKET_PATH, DaemonClient, connect_client
 
 
 def init_argparse() -> argparse.ArgumentParser:
@@ -25,7 +30,43 @@ def init_argparse() -> argparse.ArgumentParser:
         help="Do not encrypt connection",
     )
     parser.add_argument(
-        "name", help="The subscription name to subscribe to on the remote machine."
+        "names",
+        nargs="+",
+        help="The subscription names to subscribe to on the remote machine.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="""The file to write messages to, one JSON object per line, instead of
+        standard output.""",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=0,
+        help="Rotate the output file once it reaches this size.  Never if 0.",
+    )
+    parser.add_argument(
+        "--backup-count",
+        type=int,
+        default=5,
+        help="The number of rotated output files to keep.",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=5.0,
+        help="The seconds between printing event rates to standard error.",
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        default=DEFAULT_SOCKET_PATH,
+        help="Subscribe through scripts/client_daemon.py listening here, if it is running.",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Always connect directly, even if the daemon is running.",
     )
     parser.add_argument(
         "--host",
@@ -55,28 +96,118 @@ def init_argparse() -> argparse.ArgumentParser:
     return parser
 
 
+class MessageWriter:
+    """Writes lines to standard output or a file rotated by size."""
+
+    def __init__(
+        self, path: Optional[str], max_bytes: int = 0, backup_count: int = 0
+    ) -> None:
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._stream: IO[str] = sys.stdout if path is None else open(path, "a")
+        self._size = self._stream.tell() if path is not None else 0
+
+    def write(self, line: str) -> None:
+        if self._max_bytes and self._size + len(line) > self._max_bytes:
+            self._rotate()
+        self._stream.write(line)
+        self._size += len(line)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+    def close(self) -> None:
+        if self._path is None:
+            self._stream.flush()
+        else:
+            self._stream.close()
+
+    def _rotate(self) -> None:
+        assert self._path is not None
+        self._stream.close()
+        for index in range(self._backup_count - 1, 0, -1):
+            source = f"{self._path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self._path}.{index + 1}")
+        if self._backup_count:
+            os.replace(self._path, f"{self._path}.1")
+        self._stream = open(self._path, "w")
+        self._size = 0
+
+
 async def subscribe(
     host: str,
     username: str,
     password: str,
     secure: bool,
-    name: str,
+    names: List[str],
     api_key: str,
+    writer: MessageWriter,
+    stats_interval: float,
+    daemon_socket: Optional[str],
 ) -> None:
-    print(f"Connecting to {host} to subscribe to {name}...")
-    machine = await Machine.create(
-        host=host,
-        username=username,
-        password=password,
-        api_key=api_key,
-        secure=secure,
-    )
-    assert machine._client is not None  # type: ignore
-    queue = await machine._client.subscribe(name)  # type: ignore
-    while True:
-        message = await queue.get()
-        pprint.pprint(message)
-        queue.task_done()
+    print(
+        f"Connecting to {host} to subscribe to {', '.join(names)}...",
+        file=sys.stderr,
+    )
+    client: Union[DaemonClient, TrueNASWebSocketClientProtocol, None] = None
+    if daemon_socket is not None:
+        client = await DaemonClient.connect(
+            daemon_socket, host, username, password, api_key, secure
+        )
+    if client is None:
+        client = await connect_client(host, username, password, secure, api_key)
+    queues: Dict[str, asyncio.Queue] = {}
+    for name in names:
+        queues[name] = await client.subscribe(name)
+    counts = {name: 0 for name in names}
+
+    async def write_messages(name: str, queue: asyncio.Queue) -> None:
+        while True:
+            messages = [await queue.get()]
+            # Write whatever else has queued up in one go, to keep up with storms.
+            while not queue.empty():
+                messages.append(queue.get_nowait())
+            received = time.time()
+            for message in messages:
+                writer.write(
+                    ejson.dumps(
+                        {"time": received, "topic": name, "message": message},
+                        separators=(",", ":"),
+                    )
+                    + "\n"
+                )
+            counts[name] += len(messages)
+
+    async def print_stats() -> None:
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(stats_interval)
+            writer.flush()
+            now = time.monotonic()
+            for name, queue in queues.items():
+                print(
+                    f"{name}: {counts[name] / (now - last):.1f} events/s, "
+                    f"{queue.qsize()} waiting to be written",
+                    file=sys.stderr,
+                )
+                counts[name] = 0
+            last = now
+
+    tasks = [
+        asyncio.ensure_future(write_messages(name, queue))
+        for name, queue in queues.items()
+    ]
+    tasks.append(asyncio.ensure_future(print_stats()))
+    try:
+        # Runs until the connection is closed.
+        await client.wait_closed()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await client.close()
+        writer.close()
 
 
 def getLogLevel(parsed_value: str) -> int:
@@ -118,14 +249,20 @@ if __name__ == "__main__":
             api_key = data.get("api_key", args.api_key)
     except IOError:
         pass
-    asyncio.get_event_loop().run_until_complete(
-        subscribe(
-            host=host,
-            username=username,
-            password=password,
-            secure=secure,
-            api_key=api_key,
-            name=args.name,
+    writer = MessageWriter(args.output, args.max_bytes, args.backup_count)
+    try:
+        asyncio.get_event_loop().run_until_complete(
+            subscribe(
+                host=host,
+                username=username,
+                password=password,
+                secure=secure,
+                api_key=api_key,
+                names=args.names,
+                writer=writer,
+                stats_interval=args.stats_interval,
+                daemon_socket=None if args.no_daemon else args.daemon_socket,
+            )
         )
-    )
-    asyncio.get_event_loop().run_forever()
+    except KeyboardInterrupt:
+        writer.close()
@@ -0,0 +1,287 @@
+"""End-to-end benchmarks of the client against the fake server.
+
+Run from the root of the repository with:
+
+    python -m tests.benchmarks.benchmark --output results.json
+
+Results are written as JSON, so runs before and after a change can be compared.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiotruenas_client.websockets import CachingMachine
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None  # type: ignore
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the client against the fake TrueNAS server.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 1000, 100000],
+        help="The numbers of datasets and disks to query.",
+    )
+    parser.add_argument(
+        "--calls",
+        type=int,
+        default=2000,
+        help="The number of calls to measure latency and throughput with.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="The numbers of concurrent callers to measure throughput with.",
+    )
+    parser.add_argument(
+        "--events",
+        type=int,
+        default=10000,
+        help="The number of job events to send through the subscription.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="The seconds to wait for each query before recording an error.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="The file to write the results to, instead of standard output.",
+    )
+    return parser
+
+
+def dataset_query_result(count: int) -> List[Dict[str, Any]]:
+    def zfs_property(value: Any) -> Dict[str, Any]:
+        return {"parsed": value, "rawvalue": str(value), "source": "NONE"}
+
+    datasets = []
+    for index in range(count):
+        # Spread the datasets over a few levels, as real pools are.
+        id = f"tank/group{index // 1000}/dataset{index}" if index else "tank"
+        datasets.append(
+            {
+                "available": zfs_property(1 << 40),
+                "comments": zfs_property(""),
+                "compressratio": zfs_property("1.00"),
+                "id": id,
+                "pool": "tank",
+                "type": "FILESYSTEM",
+                "used": zfs_property(1 << 20),
+            }
+        )
+    # Every group needs to exist for the hierarchy to be complete.
+    for group in range((count - 1) // 1000 + 1 if count > 1 else 0):
+        datasets.append({**datasets[0], "id": f"tank/group{group}"})
+    return datasets
+
+
+def disk_query_result(count: int) -> List[Dict[str, Any]]:
+    template = CommonQueries.disk_query_result()[0]
+    return [
+        {**template, "name": f"da{index}", "serial": f"SERIAL{index}"}
+        for index in range(count)
+    ]
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarizes samples, in milliseconds."""
+    samples = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)] * 1000
+
+    return {
+        "p50_ms": percentile(0.5),
+        "p90_ms": percentile(0.9),
+        "p99_ms": percentile(0.99),
+        "max_ms": samples[-1] * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+    }
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def measure_latency(machine: CachingMachine, calls: int) -> Dict[str, Any]:
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await machine.invoke_method("core.ping")
+        samples.append(time.perf_counter() - start)
+    return {"calls": calls, **percentiles(samples)}
+
+
+async def measure_throughput(
+    machine: CachingMachine, calls: int, concurrency: int
+) -> Dict[str, Any]:
+    async def caller(count: int) -> None:
+        for _ in range(count):
+            await machine.invoke_method("core.ping")
+
+    per_caller = max(calls // concurrency, 1)
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(per_caller) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "calls": per_caller * concurrency,
+        "calls_per_second": per_caller * concurrency / elapsed,
+    }
+
+
+async def measure_query(
+    server: TrueNASServer,
+    method: str,
+    results: List[Dict[str, Any]],
+    fetch: Callable[[CachingMachine], Awaitable[Any]],
+    timeout: float,
+) -> Dict[str, Any]:
+    server.register_method_handler(method, lambda *args: results, override=True)
+    # Each query gets its own connection, so one that is dropped does not take
+    # the rest of the measurements with it.
+    machine = await create_machine(server)
+    try:
+        start = time.perf_counter()
+        await asyncio.wait_for(fetch(machine), timeout)
+        first = time.perf_counter() - start
+        # A second fetch reuses the cached objects.
+        start = time.perf_counter()
+        await asyncio.wait_for(fetch(machine), timeout)
+        second = time.perf_counter() - start
+    except Exception as exc:
+        return {"rows": len(results), "error": repr(exc)}
+    finally:
+        await machine.close()
+    return {
+        "rows": len(results),
+        "first_fetch_ms": first * 1000,
+        "second_fetch_ms": second * 1000,
+    }
+
+
+async def measure_job_events(
+    machine: CachingMachine, server: TrueNASServer, events: int
+) -> Dict[str, Any]:
+    def job_state(id: int, state: str) -> Dict[str, Any]:
+        return {
+            "error": None,
+            "id": id,
+            "method": "pool.scrub",
+            "progress": {"description": None, "extra": None, "percent": 50},
+            "result": None,
+            "state": state,
+        }
+
+    # Progress updates for a few jobs at a time, ending with every job done.
+    jobs = max(events // 10, 1)
+    start = time.perf_counter()
+    for index in range(events):
+        id = index % jobs
+        state = "SUCCESS" if index >= events - jobs else "RUNNING"
+        server.send_subscription_data(
+            {
+                "msg": "changed",
+                "collection": "core.get_jobs",
+                "id": id,
+                "fields": job_state(id, state),
+            }
+        )
+    async for _ in machine.wait_for_jobs(range(jobs)):
+        pass
+    elapsed = time.perf_counter() - start
+    return {"events": events, "events_per_second": events / elapsed}
+
+
+async def create_machine(server: TrueNASServer, **kwargs: Any) -> CachingMachine:
+    # Replies for the largest sizes are far over the default limit of 1 MiB.
+    return await CachingMachine.create(
+        server.host,
+        api_key=server.api_key,
+        secure=False,
+        max_message_size=None,
+        **kwargs,
+    )
+
+
+async def run(server: TrueNASServer, args: argparse.Namespace) -> Dict[str, Any]:
+    server.register_method_handler("core.ping", lambda: "pong")
+    server.register_method_handler("core.get_jobs", lambda filters: [])
+    server.register_method_handler("pool.dataset.query", lambda *args: [])
+    server.register_method_handler("disk.query", lambda *args: [])
+    results: Dict[str, Any] = {"python": sys.version.split()[0]}
+
+    machine = await create_machine(server, max_jobs=args.events)
+    try:
+        results["latency"] = await measure_latency(machine, args.calls)
+        results["throughput"] = [
+            await measure_throughput(machine, args.calls, concurrency)
+            for concurrency in args.concurrency
+        ]
+        results["job_events"] = await measure_job_events(machine, server, args.events)
+    finally:
+        await machine.close()
+
+    results["datasets"] = [
+        await measure_query(
+            server,
+            "pool.dataset.query",
+            dataset_query_result(size),
+            lambda machine: machine.get_datasets(),
+            args.timeout,
+        )
+        for size in args.sizes
+    ]
+    results["disks"] = [
+        await measure_query(
+            server,
+            "disk.query",
+            disk_query_result(size),
+            lambda machine: machine.get_disks(),
+            args.timeout,
+        )
+        for size in args.sizes
+    ]
+    results["peak_rss_bytes"] = peak_rss_bytes()
+    return results
+
+
+if __name__ == "__main__":
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = TrueNASServer()
+    try:
+        results = loop.run_until_complete(run(server, args))
+    finally:
+        loop.run_until_complete(server.stop())
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,116 @@
+"""Measures how long importing the package takes, against a budget.
+
+Run from the root of the repository with:
+
+    python -m tests.benchmarks.import_time
+
+Each import runs in a fresh interpreter, and the median of the runs is compared
+with the budget.  The exit status is 1 if any import is over its budget.
+"""
+
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Set
+
+# Keyed by statement, the budget in milliseconds for the package's own modules
+# and those they pull in, not counting the interpreter starting up.
+DEFAULT_BUDGETS_MS: Dict[str, float] = {
+    "import aiotruenas_client": 25.0,
+    "from aiotruenas_client.pool import PoolStatus": 25.0,
+    "from aiotruenas_client import CachingMachine": 400.0,
+}
+
+# A line of `python -X importtime` output for a module imported at the top level,
+# rather than by another module.
+IMPORT_TIME_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$")
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Measure the time taken to import the package.",
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=10,
+        help="The number of fresh interpreters to import in.",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Multiplies every budget, for slower machines.",
+    )
+    return parser
+
+
+def top_level_imports(statement: str) -> Dict[str, int]:
+    """Returns the microseconds taken by each module `statement` imported.
+
+    Only modules imported directly are listed, with the time including
+    everything they imported in turn.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports = {}
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            imports[match.group(2)] = int(match.group(1))
+    return imports
+
+
+def import_time_ms(statement: str, start_up: Set[str]) -> float:
+    """Returns the milliseconds `statement` spent importing, in a new interpreter.
+
+    Modules in `start_up`, which the interpreter imports before running any
+    statement, are left out.
+    """
+    imports = top_level_imports(statement)
+    return (
+        sum(
+            microseconds
+            for module, microseconds in imports.items()
+            if module not in start_up
+        )
+        / 1000
+    )
+
+
+def measure(runs: int, budgets: Dict[str, float]) -> List[Dict[str, object]]:
+    start_up = set(top_level_imports("pass"))
+    results = []
+    for statement, budget in budgets.items():
+        samples = [import_time_ms(statement, start_up) for _ in range(runs)]
+        median = statistics.median(samples)
+        results.append(
+            {
+                "statement": statement,
+                "median_ms": round(median, 3),
+                "min_ms": round(min(samples), 3),
+                "budget_ms": budget,
+                "within_budget": median <= budget,
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    budgets = {
+        statement: budget * args.scale
+        for statement, budget in DEFAULT_BUDGETS_MS.items()
+    }
+    results = measure(args.runs, budgets)
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result["within_budget"] for result in results) else 1)
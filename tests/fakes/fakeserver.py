@@ -2,13 +2,21 @@ from __future__ import annotations
 
 import asyncio
 import datetime
+import functools
+import inspect
+import json
 import random
+import ssl
 import string
 import uuid
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from enum import Enum, unique
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
 
 import ejson
 
+from aiotruenas_client.websockets.recording import RECEIVED, SENT, read_recording
+from websockets.exceptions import ConnectionClosed
+from websockets.frames import Frame, Opcode
 from websockets.server import WebSocketServerProtocol, serve
 
 TMethodHandler = Union[
@@ -22,23 +30,143 @@ TPoolQueryResult = List[Dict[str, Any]]
 TVmQueryResult = List[Dict[str, Any]]
 
 
+TLatency = Union[float, Callable[[], float]]
+
+
+@unique
+class Fault(Enum):
+    """A fault `TrueNASServer.inject_fault` can script."""
+
+    # The call is never answered.
+    DROP_REPLY = "DROP_REPLY"
+    # The answer is sent after the fault's delay.
+    DELAY_REPLY = "DELAY_REPLY"
+    # The answer is held back until the next one on the connection is sent.
+    REORDER_REPLY = "REORDER_REPLY"
+    # Half of the answer is sent before the connection is dropped.
+    DISCONNECT = "DISCONNECT"
+    # The `ready` for a subscription is sent after the fault's delay.
+    SLOW_READY = "SLOW_READY"
+    # The event is sent twice.
+    DUPLICATE_EVENT = "DUPLICATE_EVENT"
+    # Authentication fails, even with the right credentials.
+    AUTH_FAILURE = "AUTH_FAILURE"
+
+
+class _InjectedFault(object):
+    def __init__(
+        self, fault: Fault, count: int, method: Optional[str], delay: float
+    ) -> None:
+        self.fault = fault
+        self.remaining = count
+        self.method = method
+        self.delay = delay
+
+
+class _Connection(object):
+    """The state the server keeps for each connected client."""
+
+    def __init__(
+        self, websocket: WebSocketServerProtocol, bandwidth: Optional[float]
+    ) -> None:
+        self.websocket = websocket
+        # Mapping of topic to subscription id
+        self.subscriptions: Dict[str, str] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self._bandwidth = bandwidth
+        self._send_lock = asyncio.Lock()
+        # When the link is next free, if the bandwidth is capped.
+        self._link_free_at = 0.0
+        self._subscription_queue: asyncio.Queue = asyncio.Queue()
+        # Replies waiting for the next one to be sent, to arrive out of order.
+        self.held_replies: List[Dict[str, Any]] = []
+        self.start_task(self._send_subscription_messages())
+
+    def start_task(self, coro: Awaitable[Any]) -> None:
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def cancel_tasks(self) -> None:
+        for task in list(self.tasks):
+            task.cancel()
+
+    def queue_subscription_data(self, data: Any) -> None:
+        if isinstance(data, dict) and "collection" in data:
+            if data["collection"] not in self.subscriptions:
+                return
+        self._subscription_queue.put_nowait(data)
+
+    async def send(self, data: object) -> None:
+        message = ejson.dumps(data)
+        async with self._send_lock:
+            if self._bandwidth:
+                loop = asyncio.get_event_loop()
+                await asyncio.sleep(max(self._link_free_at - loop.time(), 0))
+                self._link_free_at = loop.time() + len(message) / self._bandwidth
+            await self.websocket.send(message)
+
+    async def disconnect_mid_frame(self, data: object) -> None:
+        frame = Frame(Opcode.TEXT, ejson.dumps(data).encode()).serialize(mask=False)
+        async with self._send_lock:
+            transport = self.websocket.transport
+            transport.write(frame[: len(frame) // 2])
+            transport.abort()
+
+    async def _send_subscription_messages(self) -> None:
+        queue = self._subscription_queue
+        while True:
+            item = await queue.get()
+            await self.send(item)
+            queue.task_done()
+
+
 class TrueNASServer(object):
+    """A fake TrueNAS server, for any number of clients at once.
+
+    Each call is answered in its own task, so slow handlers do not hold up other
+    calls on the same connection.  `latency` is the seconds to wait before
+    answering each call, or a function returning them, such as
+    `functools.partial(random.expovariate, 200)`.  Up to `jitter` more seconds
+    are added to it at random.  `bandwidth` caps the bytes per second sent to
+    each client.  All three are attributes that can be changed later, with
+    `bandwidth` applying to clients that connect afterwards.  Passing a `port`
+    of 0 picks a free one.  Given an `ssl_context`, the server only accepts
+    secure connections.
+    """
+
     _username: str
     _password: str
     _api_key: str
     _serve_handle: Optional[serve]
-    # Mapping of topic to subscription id
-    _subscriptions: Dict[str, str] = {}
-    _subscription_queue: asyncio.Queue
-    _subscription_task: Optional[asyncio.Task] = None
+    _port: int
+    _connections: Set[_Connection]
 
     _method_handlers: Dict[str, TMethodHandler]
+    _faults: List[_InjectedFault]
+    # Keyed by topic, the events to replay to each subscriber, with the seconds
+    # to wait after it subscribes.
+    _replay_events: Dict[str, List[Tuple[float, Dict[str, Any]]]]
 
-    def __init__(self):
+    def __init__(
+        self,
+        port: int = 8000,
+        latency: TLatency = 0.0,
+        jitter: float = 0.0,
+        bandwidth: Optional[float] = None,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
         self._username = "".join(random.choice(string.ascii_letters) for _ in range(6))
         self._password = "".join(random.choice(string.ascii_letters) for _ in range(6))
         self._api_key = "".join(random.choice(string.ascii_letters) for _ in range(6))
         self._method_handlers = {}
+        self._replay_events = {}
+        self._connections = set()
+        self._faults = []
+        self._tokens: Set[str] = set()
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
 
         self.register_method_handler(
             "auth.login",
@@ -50,10 +178,21 @@ class TrueNASServer(object):
             lambda t: t == self.api_key,
         )
 
-        self._subscription_queue = asyncio.Queue()
+        self.register_method_handler(
+            "auth.generate_token",
+            self._generate_token,
+        )
 
-        self._serve_handle = serve(self._handle_messages, "localhost", 8000)
-        asyncio.get_event_loop().run_until_complete(self._serve_handle)
+        self.register_method_handler(
+            "auth.token",
+            lambda t: t in self._tokens,
+        )
+
+        self._serve_handle = serve(
+            self._handle_messages, "localhost", port, ssl=ssl_context
+        )
+        ws_server = asyncio.get_event_loop().run_until_complete(self._serve_handle)
+        self._port = ws_server.sockets[0].getsockname()[1]
 
     def register_method_handler(
         self, method_name: str, handler: TMethodHandler, override: bool = False
@@ -63,20 +202,123 @@ class TrueNASServer(object):
             assert method_name in self._method_handlers
         self._method_handlers[method_name] = handler
 
+    def inject_fault(
+        self,
+        fault: Fault,
+        count: int = 1,
+        method: Optional[str] = None,
+        delay: float = 0.0,
+    ) -> None:
+        """Scripts the next `count` occurrences of a fault.
+
+        Reply faults apply to calls of `method`, or any call if not given, and
+        `SLOW_READY` to subscriptions to the topic named by `method`.
+        Authentication failures apply to the `auth` methods whatever `method`
+        is.
+        """
+        self._faults.append(_InjectedFault(fault, count, method, delay))
+
+    def _take_fault(
+        self, fault: Fault, method: Optional[str] = None
+    ) -> Optional[_InjectedFault]:
+        for injected in self._faults:
+            if injected.fault != fault:
+                continue
+            if injected.method is not None and injected.method != method:
+                continue
+            injected.remaining -= 1
+            if injected.remaining <= 0:
+                self._faults.remove(injected)
+            return injected
+        return None
+
     async def stop(self) -> None:
         """Shuts down the fake server."""
         if self._serve_handle is None:
             return
-        if self._subscription_task:
-            self._subscription_task.cancel()
-            self._subscription_task = None
+        for connection in self._connections:
+            connection.cancel_tasks()
         self._serve_handle.ws_server.close()
         await self._serve_handle.ws_server.wait_closed()
         self._serve_handle = None
 
+    def replay(self, path: str, speed: float = 1.0) -> None:
+        """Scripts the server with traffic recorded by a `CachingMachine`.
+
+        Each recorded method answers with its recorded results in order, after
+        the recorded latency, repeating the last one once they run out.  Every
+        subscriber is sent the recorded events for its topic, at the recorded
+        time after subscribing.  A `speed` above 1 replays faster.
+        """
+        # Keyed by message id, the method called and when.
+        calls: Dict[str, Tuple[str, float]] = {}
+        # Keyed by method, the latency and result of each call.
+        results: Dict[str, List[Tuple[float, Any]]] = {}
+        # Keyed by topic, when it was subscribed to.
+        subscribed: Dict[str, float] = {}
+        self._replay_events = {}
+        for frame in read_recording(path):
+            # Turn encoded values, such as dates, back into Python objects.
+            message = ejson.loads(json.dumps(frame.message))
+            if not isinstance(message, dict):
+                continue
+            if frame.direction == SENT and message.get("msg") == "method":
+                calls[message["id"]] = (message["method"], frame.elapsed)
+            elif frame.direction == SENT and message.get("msg") == "sub":
+                subscribed[message["name"]] = frame.elapsed
+            elif frame.direction != RECEIVED:
+                continue
+            elif message.get("msg") == "result" and message["id"] in calls:
+                method, sent = calls.pop(message["id"])
+                results.setdefault(method, []).append(
+                    (frame.elapsed - sent, message["result"])
+                )
+            elif message.get("msg") in ("added", "changed"):
+                topic = message["collection"]
+                delay = (frame.elapsed - subscribed.get(topic, 0)) / speed
+                self._replay_events.setdefault(topic, []).append((delay, message))
+        for method, recorded in results.items():
+            self._method_handlers[method] = functools.partial(
+                self._replay_result, recorded, speed
+            )
+
+    @staticmethod
+    async def _replay_result(
+        recorded: List[Tuple[float, Any]], speed: float, *args: Any
+    ) -> Any:
+        latency, result = recorded.pop(0) if len(recorded) > 1 else recorded[0]
+        await asyncio.sleep(latency / speed)
+        return result
+
+    async def _replay_subscription_events(
+        self, connection: _Connection, topic: str
+    ) -> None:
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        for delay, message in self._replay_events[topic]:
+            await asyncio.sleep(max(start + delay - loop.time(), 0))
+            connection.queue_subscription_data(message)
+
+    def _generate_token(self, ttl: int = 600, attrs: Any = None) -> str:
+        token = "".join(random.choice(string.ascii_letters) for _ in range(16))
+        self._tokens.add(token)
+        return token
+
+    def revoke_tokens(self) -> None:
+        """Invalidates every session token handed out so far."""
+        self._tokens.clear()
+
     def send_subscription_data(self, data: object) -> None:
-        """Sends a message to any listenting subscriptions."""
-        self._subscription_queue.put_nowait(data)
+        """Sends a message to every client subscribed to its collection."""
+        copies = 2 if self._take_fault(Fault.DUPLICATE_EVENT) else 1
+        for connection in self._connections:
+            for _ in range(copies):
+                connection.queue_subscription_data(data)
+
+    @property
+    def connections(self) -> int:
+        """The number of clients connected to the server."""
+        return len(self._connections)
 
     @property
     def username(self) -> str:
@@ -91,7 +333,7 @@ class TrueNASServer(object):
     @property
     def host(self) -> str:
         """The host to use to connect to this server."""
-        return "localhost:8000"
+        return f"localhost:{self._port}"
 
     @property
     def api_key(self) -> str:
@@ -99,17 +341,21 @@ class TrueNASServer(object):
         return self._api_key
 
     async def _handle_messages(self, websocket: WebSocketServerProtocol, _path: str):
-        async def send(data: object) -> None:
-            await websocket.send(ejson.dumps(data))
+        connection = _Connection(websocket, self.bandwidth)
+        self._connections.add(connection)
+        try:
+            await self._handle_connection(connection)
+        except ConnectionClosed:
+            pass
+        finally:
+            self._connections.discard(connection)
+            connection.cancel_tasks()
 
-        self._subscription_task = asyncio.create_task(
-            self._send_subscription_messages(
-                send=send,
-            )
-        )
+    async def _handle_connection(self, connection: _Connection) -> None:
+        websocket = connection.websocket
 
         async def fail():
-            await send(
+            await connection.send(
                 {
                     "msg": "failed",
                     "version": "1",
@@ -119,52 +365,81 @@ class TrueNASServer(object):
         data = ejson.loads(await websocket.recv())
         if data["msg"] != "connect":
             return await fail()
-        await websocket.send(
-            ejson.dumps({"msg": "connected", "session": str(uuid.uuid4())})
-        )
+        await connection.send({"msg": "connected", "session": str(uuid.uuid4())})
         async for message in websocket:
             data = ejson.loads(message)
             if data["msg"] == "method":
-                assert data["method"] in self._method_handlers
-                await send(
-                    {
-                        "id": data["id"],
-                        "msg": "result",
-                        "result": self._method_handlers[data["method"]](
-                            *data["params"]
-                        ),
-                    }
-                )
+                connection.start_task(self._handle_method(connection, data))
                 continue
             if data["msg"] == "sub":
-                self._subscriptions[data["name"]] = data["id"]
-                await send(
-                    {
-                        "msg": "ready",
-                        "subs": [data["id"]],
-                    }
-                )
+                connection.subscriptions[data["name"]] = data["id"]
+                connection.start_task(self._handle_subscribe(connection, data))
                 continue
             if data["msg"] == "unsub":
                 topic = [
                     topic
-                    for topic, id in self._subscriptions.items()
+                    for topic, id in connection.subscriptions.items()
                     if id == data["id"]
                 ][0]
-                del self._subscriptions[topic]
+                del connection.subscriptions[topic]
                 # Nothing to respond with in this case.
                 continue
 
             await fail()
 
-    async def _send_subscription_messages(
-        self, send: Callable[[object], Awaitable[None]]
+    async def _handle_subscribe(
+        self, connection: _Connection, data: Dict[str, Any]
     ) -> None:
-        queue = self._subscription_queue
-        while True:
-            item = await queue.get()
-            await send(item)
-            queue.task_done()
+        fault = self._take_fault(Fault.SLOW_READY, data["name"])
+        if fault is not None:
+            await asyncio.sleep(fault.delay)
+        await connection.send(
+            {
+                "msg": "ready",
+                "subs": [data["id"]],
+            }
+        )
+        if data["name"] in self._replay_events:
+            await self._replay_subscription_events(connection, data["name"])
+
+    async def _handle_method(
+        self, connection: _Connection, data: Dict[str, Any]
+    ) -> None:
+        method = data["method"]
+        await asyncio.sleep(self._call_latency())
+        reply: Dict[str, Any] = {"id": data["id"], "msg": "result"}
+        try:
+            if method.startswith("auth.") and self._take_fault(Fault.AUTH_FAILURE):
+                reply["result"] = False
+            else:
+                result = self._method_handlers[method](*data["params"])
+                if inspect.isawaitable(result):
+                    result = await result
+                reply["result"] = result
+        except Exception as exc:
+            # As the real server does, so the call fails rather than hangs.
+            reply["error"] = {"error": None, "errname": None, "reason": repr(exc)}
+
+        if self._take_fault(Fault.DROP_REPLY, method):
+            return
+        fault = self._take_fault(Fault.DELAY_REPLY, method)
+        if fault is not None:
+            await asyncio.sleep(fault.delay)
+        if self._take_fault(Fault.REORDER_REPLY, method):
+            connection.held_replies.append(reply)
+            return
+        if self._take_fault(Fault.DISCONNECT, method):
+            await connection.disconnect_mid_frame(reply)
+            return
+        await connection.send(reply)
+        while connection.held_replies:
+            await connection.send(connection.held_replies.pop(0))
+
+    def _call_latency(self) -> float:
+        latency = self.latency() if callable(self.latency) else self.latency
+        if self.jitter:
+            latency += random.uniform(0, self.jitter)
+        return max(latency, 0)
 
 
 class CommonQueries:
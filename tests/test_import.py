@@ -0,0 +1,45 @@
+import subprocess
+import sys
+import unittest
+
+# Modules that only the websockets client needs, and that are slow to import.
+HEAVY_MODULES = ["asyncio", "ejson", "pprint", "ssl", "uuid", "websockets"]
+
+
+def modules_loaded_by(statement: str) -> set:
+    output = subprocess.run(
+        [sys.executable, "-c", f"{statement}; import sys; print(*sys.modules)"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return set(output.split())
+
+
+class TestImport(unittest.TestCase):
+    def test_package_is_lazy(self) -> None:
+        for statement in (
+            "import aiotruenas_client",
+            "from aiotruenas_client.pool import PoolStatus",
+            "import aiotruenas_client.websockets",
+        ):
+            with self.subTest(statement=statement):
+                loaded = modules_loaded_by(statement)
+                self.assertEqual(
+                    [module for module in HEAVY_MODULES if module in loaded], []
+                )
+
+    def test_lazy_attributes(self) -> None:
+        loaded = modules_loaded_by("from aiotruenas_client import CachingMachine")
+        self.assertIn("aiotruenas_client.websockets.machine", loaded)
+        self.assertNotIn("aiotruenas_client.websockets.shard", loaded)
+
+        import aiotruenas_client
+
+        self.assertIn("Fleet", dir(aiotruenas_client))
+        with self.assertRaises(AttributeError):
+            aiotruenas_client.NotAThing  # type: ignore
+
+
+if __name__ == "__main__":
+    unittest.main()
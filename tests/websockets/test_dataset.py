@@ -257,6 +257,152 @@ class TestPool(IsolatedAsyncioTestCase):
         new_dataset = self._machine.datasets[0]
         self.assertIs(original_dataset, new_dataset)
 
+    async def test_hierarchy(self) -> None:
+        self._server.register_method_handler(
+            "pool.dataset.query",
+            lambda *args: [
+                {"id": "tank", "used": {"parsed": 100}},
+                {"id": "tank/home", "used": {"parsed": 60}},
+                {"id": "tank/home/alice", "used": {"parsed": 20}},
+                {"id": "tank/home/bob", "used": {"parsed": 30}},
+                {"id": "tank/vm", "used": {"parsed": 10}},
+            ],
+        )
+        await self._machine.get_datasets()
+        datasets = {dataset.id: dataset for dataset in self._machine.datasets}
+
+        self.assertEqual(
+            [dataset.id for dataset in datasets["tank"].children()],
+            ["tank/home", "tank/vm"],
+        )
+        self.assertEqual(
+            [dataset.id for dataset in datasets["tank"].descendants()],
+            ["tank/home", "tank/vm", "tank/home/alice", "tank/home/bob"],
+        )
+        self.assertEqual(datasets["tank/vm"].children(), [])
+        self.assertEqual(datasets["tank"].subtree_count, 5)
+        self.assertEqual(datasets["tank/home"].subtree_count, 3)
+        self.assertEqual(datasets["tank"].subtree_used_bytes, 220)
+        self.assertEqual(datasets["tank/home"].subtree_used_bytes, 110)
+
+    async def test_subtree_rollups_follow_changes(self) -> None:
+        self._server.register_method_handler(
+            "pool.dataset.query",
+            lambda *args: [
+                {"id": "tank", "used": {"parsed": 100}},
+                {"id": "tank/home", "used": {"parsed": 60}},
+                {"id": "tank/home/alice", "used": {"parsed": 20}},
+                {"id": "tank/vm", "used": {"parsed": 10}},
+            ],
+        )
+        await self._machine.get_datasets()
+        datasets = {dataset.id: dataset for dataset in self._machine.datasets}
+        self.assertEqual(datasets["tank"].subtree_used_bytes, 190)
+
+        self._server.register_method_handler(
+            "pool.dataset.query",
+            lambda *args: [
+                {"id": "tank", "used": {"parsed": 100}},
+                {"id": "tank/home", "used": {"parsed": 60}},
+                {"id": "tank/home/alice", "used": {"parsed": 25}},
+                {"id": "tank/home/bob", "used": {"parsed": 5}},
+                {"id": "tank/vm", "used": {"parsed": 10}},
+            ],
+            override=True,
+        )
+        await self._machine.get_datasets()
+
+        # Only the rollups along the changed path are dropped.
+        fetcher = self._machine._dataset_fetcher  # type: ignore
+        self.assertNotIn("tank", fetcher._subtree_rollups)
+        self.assertNotIn("tank/home", fetcher._subtree_rollups)
+        self.assertIn("tank/vm", fetcher._subtree_rollups)
+        self.assertEqual(datasets["tank"].subtree_used_bytes, 200)
+        self.assertEqual(datasets["tank"].subtree_count, 5)
+        self.assertEqual(
+            [dataset.id for dataset in datasets["tank/home"].children()],
+            ["tank/home/alice", "tank/home/bob"],
+        )
+
+        self.assertEqual(datasets["tank/home"].subtree_used_bytes, 90)
+        bob = self._machine.get_dataset("tank/home/bob")
+        assert bob is not None
+
+        # Stale datasets keep their last known rollup.
+        self._server.register_method_handler(
+            "pool.dataset.query",
+            lambda *args: [{"id": "tank", "used": {"parsed": 100}}],
+            override=True,
+        )
+        await self._machine.get_datasets()
+        self.assertFalse(datasets["tank/home"].available)
+        self.assertEqual(datasets["tank/home"].subtree_used_bytes, 90)
+        self.assertEqual(datasets["tank"].subtree_count, 1)
+        with self.assertRaises(ValueError):
+            bob.subtree_count
+
+    async def test_lookup(self) -> None:
+        self._server.register_method_handler(
+            "pool.dataset.query",
+            lambda *args: [
+                {"id": "ssd0", "pool": "ssd0"},
+                {"id": "ssd0/iscsi", "pool": "ssd0"},
+                {"id": "tank", "pool": "tank"},
+            ],
+        )
+        await self._machine.get_datasets()
+
+        dataset = self._machine.get_dataset("ssd0/iscsi")
+        assert dataset is not None
+        self.assertEqual(dataset.id, "ssd0/iscsi")
+        self.assertIsNone(self._machine.get_dataset("ssd0/missing"))
+        self.assertEqual(
+            sorted(dataset.id for dataset in self._machine.get_pool_datasets("ssd0")),
+            ["ssd0", "ssd0/iscsi"],
+        )
+        self.assertEqual(self._machine.get_pool_datasets("missing"), [])
+
+    async def test_refresh(self) -> None:
+        datasets = {
+            "tank": {"id": "tank", "pool": "tank", "used": {"parsed": 100}},
+            "tank/home": {"id": "tank/home", "pool": "tank", "used": {"parsed": 60}},
+            "tank/vm": {"id": "tank/vm", "pool": "tank", "used": {"parsed": 10}},
+        }
+        queries = []
+
+        def query_handler(filters, options):
+            queries.append(filters)
+            if filters:
+                [[field, operator, ids]] = filters
+                self.assertEqual((field, operator), ("id", "in"))
+                return [datasets[id] for id in ids if id in datasets]
+            return list(datasets.values())
+
+        self._server.register_method_handler("pool.dataset.query", query_handler)
+        await self._machine.get_datasets()
+        tank = self._machine.get_dataset("tank")
+        home = self._machine.get_dataset("tank/home")
+        assert tank is not None and home is not None
+        self.assertEqual(tank.subtree_used_bytes, 170)
+
+        datasets["tank/home"]["used"] = {"parsed": 80}
+        del datasets["tank/vm"]
+        await self._machine._dataset_fetcher.refresh_ids(  # type: ignore
+            ["tank/home", "tank/vm"]
+        )
+
+        self.assertEqual(queries[-1], [["id", "in", ["tank/home", "tank/vm"]]])
+        self.assertIs(self._machine.get_dataset("tank/home"), home)
+        self.assertIsNone(self._machine.get_dataset("tank/vm"))
+        self.assertEqual(home.subtree_used_bytes, 80)
+        self.assertEqual(tank.subtree_used_bytes, 180)
+        self.assertEqual(tank.subtree_count, 2)
+
+        datasets["tank"]["used"] = {"parsed": 120}
+        await tank.refresh()
+        self.assertEqual(queries[-1], [["id", "in", ["tank"]]])
+        self.assertEqual(tank.subtree_used_bytes, 200)
+
     def test_eq_impl(self) -> None:
         self._machine._dataset_fetcher._state = {  # type: ignore
             "ssd0": {
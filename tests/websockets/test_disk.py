@@ -4,7 +4,7 @@ from unittest import IsolatedAsyncioTestCase
 from aiotruenas_client.disk import DiskType
 from aiotruenas_client.websockets.disk import CachingDisk
 from aiotruenas_client.websockets.machine import CachingMachine
-from tests.fakes.fakeserver import TrueNASServer
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
 
 
 class TestDisk(IsolatedAsyncioTestCase):
@@ -223,6 +223,59 @@ class TestDisk(IsolatedAsyncioTestCase):
         new_disk = self._machine.disks[0]
         self.assertIs(original_disk, new_disk)
 
+    async def test_lookup(self) -> None:
+        self._server.register_method_handler(
+            "disk.query",
+            CommonQueries.disk_query_result,
+        )
+        await self._machine.get_disks()
+        await self._machine.get_disks()
+
+        self.assertEqual(len(self._machine.disks), 2)
+        disk = self._machine.get_disk("da0")
+        assert disk is not None
+        self.assertEqual(disk.serial, "WD-NOTAREALSERIAL")
+        self.assertIs(self._machine.get_disk_by_serial("WD-NOTAREALSERIAL"), disk)
+        self.assertIsNone(self._machine.get_disk("ada1"))
+
+        self._server.register_method_handler(
+            "disk.query",
+            lambda *args: CommonQueries.disk_query_result()[:1],
+            override=True,
+        )
+        await self._machine.get_disks()
+        self.assertIsNone(self._machine.get_disk("da0"))
+        self.assertIsNotNone(self._machine.get_disk("ada0"))
+
+    async def test_refresh(self) -> None:
+        queries = []
+
+        def query_handler(filters, options):
+            queries.append(filters)
+            disks = CommonQueries.disk_query_result()
+            if filters:
+                [[field, operator, names]] = filters
+                self.assertEqual((field, operator), ("name", "in"))
+                disks = [
+                    {**disk, "description": "Refreshed"}
+                    for disk in disks
+                    if disk["name"] in names
+                ]
+            return disks
+
+        self._server.register_method_handler("disk.query", query_handler)
+        await self._machine.get_disks()
+        disk = self._machine.get_disk("da0")
+        other_disk = self._machine.get_disk("ada0")
+        assert disk is not None and other_disk is not None
+
+        await disk.refresh()
+
+        self.assertEqual(queries[-1], [["name", "in", ["da0"]]])
+        self.assertEqual(disk.description, "Refreshed")
+        self.assertEqual(other_disk.description, "Some Desc")
+        self.assertIs(self._machine.get_disk("da0"), disk)
+
     def test_eq_impl(self) -> None:
         self._machine._disk_fetcher._state = {  # type: ignore
             "ada0": {
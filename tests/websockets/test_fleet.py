@@ -0,0 +1,71 @@
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from aiotruenas_client.websockets import Fleet
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
+
+UNREACHABLE_HOST = "localhost:1"
+
+
+class TestFleet(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+    _fleet: Fleet
+
+    def setUp(self):
+        self._server = TrueNASServer()
+
+    async def asyncSetUp(self):
+        self._fleet = await Fleet.create(
+            {
+                self._server.host: {"api_key": self._server.api_key, "secure": False},
+                UNREACHABLE_HOST: {"api_key": "nope", "secure": False},
+            },
+            max_concurrency=1,
+        )
+
+    async def asyncTearDown(self):
+        await self._fleet.close()
+        await self._server.stop()
+
+    async def test_connect(self) -> None:
+        self.assertEqual(self._fleet.hosts, [self._server.host, UNREACHABLE_HOST])
+        self.assertEqual(list(self._fleet.machines), [self._server.host])
+        self.assertTrue(self._fleet.health[self._server.host].healthy)
+        self.assertFalse(self._fleet.health[UNREACHABLE_HOST].healthy)
+        self.assertIsInstance(self._fleet.health[UNREACHABLE_HOST].error, OSError)
+
+    async def test_get_pools(self) -> None:
+        self._server.register_method_handler(
+            "pool.query",
+            CommonQueries.pool_query_result,
+        )
+
+        pools = await self._fleet.get_pools()
+
+        self.assertEqual(list(pools), [self._server.host])
+        self.assertEqual([pool.name for pool in pools[self._server.host]], ["testpool"])
+
+    async def test_failures_are_recorded(self) -> None:
+        self._server.register_method_handler(
+            "pool.query",
+            CommonQueries.pool_query_result,
+        )
+        await self._fleet.get_pools()
+        # A pool without a guid can not be cached.
+        self._server.register_method_handler(
+            "pool.query",
+            lambda *args: [{"name": "broken"}],
+            override=True,
+        )
+
+        pools = await self._fleet.get_pools()
+
+        self.assertEqual(pools, {})
+        health = self._fleet.health[self._server.host]
+        self.assertFalse(health.healthy)
+        self.assertIsInstance(health.error, KeyError)
+        self.assertIsNotNone(health.last_success)
+
+
+if __name__ == "__main__":
+    unittest.main()
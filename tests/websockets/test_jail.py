@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import unittest
 from unittest import IsolatedAsyncioTestCase
@@ -105,6 +106,23 @@ class TestJail(IsolatedAsyncioTestCase):
         new_jail = self._machine.jails[0]
         self.assertIs(original_jail, new_jail)
 
+    async def test_lookup(self) -> None:
+        self._server.register_method_handler(
+            "jail.query",
+            lambda *args: [
+                {
+                    "id": "jail01",
+                    "state": "up",
+                },
+            ],
+        )
+        await self._machine.get_jails()
+
+        jail = self._machine.get_jail("jail01")
+        assert jail is not None
+        self.assertIs(jail, self._machine.jails[0])
+        self.assertIsNone(self._machine.get_jail("jail02"))
+
     async def test_start(self) -> None:
         NAME = "jail01"
         self._server.register_method_handler(
@@ -319,6 +337,115 @@ class TestJail(IsolatedAsyncioTestCase):
 
         self.assertTrue(await jail.restart())
 
+    async def test_bulk_restart(self) -> None:
+        jail_states = {
+            name: {"id": name, "state": "up"} for name in ("jail01", "jail02", "jail03")
+        }
+        queries = []
+        restarted_names = []
+
+        def query_handler(filters, options):
+            queries.append(filters)
+            if filters:
+                [[field, operator, names]] = filters
+                self.assertEqual((field, operator), ("id", "in"))
+                return [jail_states[name] for name in names]
+            return list(jail_states.values())
+
+        def restart_handler(name) -> int:
+            restarted_names.append(name)
+            return 100 + len(restarted_names)
+
+        async def finish_jobs() -> None:
+            while len(restarted_names) < 3:
+                await asyncio.sleep(0.01)
+            for index, name in enumerate(restarted_names):
+                failed = name == "jail03"
+                self._server.send_subscription_data(
+                    {
+                        "msg": "changed",
+                        "collection": "core.get_jobs",
+                        "id": 101 + index,
+                        "fields": {
+                            "error": "[EFAULT] jail03 is broken" if failed else None,
+                            "id": 101 + index,
+                            "method": "jail.restart",
+                            "progress": {},
+                            "result": None if failed else True,
+                            "state": "FAILED" if failed else "SUCCESS",
+                        },
+                    }
+                )
+
+        self._server.register_method_handler("jail.query", query_handler)
+        self._server.register_method_handler("jail.restart", restart_handler)
+        self._server.register_method_handler(
+            "core.get_jobs",
+            lambda filters: [
+                {
+                    "error": None,
+                    "id": id,
+                    "method": "jail.restart",
+                    "progress": {},
+                    "result": None,
+                    "state": "RUNNING",
+                }
+                for id in filters[0][2]
+            ],
+        )
+        await self._machine.get_jails()
+        jails = sorted(self._machine.jails, key=lambda jail: jail.name)
+        jail_states["jail02"]["state"] = "down"
+        finisher = asyncio.create_task(finish_jobs())
+
+        results = await self._machine.restart_jails(
+            jails, max_concurrency=2, return_exceptions=True
+        )
+        await finisher
+
+        self.assertEqual(results[:2], [True, True])
+        self.assertIsInstance(results[2], RuntimeError)
+        self.assertEqual(sorted(restarted_names), ["jail01", "jail02", "jail03"])
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(sorted(queries[1][0][2]), ["jail01", "jail02", "jail03"])
+        self.assertEqual(jails[1].status, JailStatus.DOWN)
+
+    async def test_bulk_start_rejects_running_jails(self) -> None:
+        self._server.register_method_handler(
+            "jail.query",
+            lambda *args: [{"id": "jail01", "state": "up"}],
+        )
+        await self._machine.get_jails()
+
+        with self.assertRaises(RuntimeError):
+            await self._machine.start_jails(self._machine.jails)
+
+    async def test_refresh(self) -> None:
+        jail_states = {
+            name: {"id": name, "state": "up"} for name in ("jail01", "jail02")
+        }
+        queries = []
+
+        def query_handler(filters, options):
+            queries.append(filters)
+            if filters:
+                return [jail_states[name] for name in filters[0][2]]
+            return list(jail_states.values())
+
+        self._server.register_method_handler("jail.query", query_handler)
+        await self._machine.get_jails()
+        jail = self._machine.get_jail("jail01")
+        other_jail = self._machine.get_jail("jail02")
+        assert jail is not None and other_jail is not None
+        jail_states["jail01"] = {"id": "jail01", "state": "down"}
+        jail_states["jail02"] = {"id": "jail02", "state": "down"}
+
+        await jail.refresh()
+
+        self.assertEqual(queries[-1], [["id", "in", ["jail01"]]])
+        self.assertEqual(jail.status, JailStatus.DOWN)
+        self.assertEqual(other_jail.status, JailStatus.UP)
+
     def test_eq_impl(self) -> None:
         self._machine._jail_fetcher._state = {  # type: ignore
             "jail01": {"id": "jail01", "state": "up"}
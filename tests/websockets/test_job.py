@@ -1,5 +1,7 @@
+import asyncio
 import datetime
 import unittest
+from typing import Any, Dict, List, Set
 from unittest import IsolatedAsyncioTestCase
 
 from aiotruenas_client.job import JobStatus
@@ -151,6 +153,425 @@ class TestJob(IsolatedAsyncioTestCase):
         self.assertEqual(job.method, "jail.stop")
         self.assertEqual(job.status, JobStatus.WAITING)
 
+    async def test_batched_lookups(self) -> None:
+        calls = []
+
+        def get_jobs_handler(filters):
+            calls.append(filters)
+            [[field, operator, ids]] = filters
+            self.assertEqual((field, operator), ("id", "in"))
+            return [
+                {
+                    "error": None,
+                    "id": id,
+                    "method": "vm.stop",
+                    "progress": {},
+                    "result": None,
+                    "state": "SUCCESS",
+                }
+                for id in ids
+                if id != 13
+            ]
+
+        self._server.register_method_handler("core.get_jobs", get_jobs_handler)
+
+        jobs = await asyncio.gather(
+            *(self._machine.get_job(id) for id in (1, 2, 3, 2)),
+        )
+        self.assertEqual([job.id for job in jobs], [1, 2, 3, 2])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(calls[0][0][2]), [1, 2, 3])
+
+        with self.assertRaises(RuntimeError):
+            await self._machine.get_job(13)
+        self.assertEqual(len(calls), 2)
+
+        # Cached jobs are not looked up again.
+        await self._machine.get_job(1)
+        self.assertEqual(len(calls), 2)
+
+
+def job_state(id: int, state: str, **fields: Any) -> Dict[str, Any]:
+    """A `core.get_jobs` entry, as the server would send it."""
+    return {
+        "abortable": False,
+        "arguments": [],
+        "error": None,
+        "exc_info": None,
+        "exception": None,
+        "id": id,
+        "logs_excerpt": None,
+        "logs_path": None,
+        "method": "vm.stop",
+        "progress": {"description": None, "extra": None, "percent": None},
+        "result": None,
+        "state": state,
+        "time_finished": None,
+        "time_started": None,
+        **fields,
+    }
+
+
+class JobFetcherTestCase(IsolatedAsyncioTestCase):
+    """Connects to a fake server, and feeds it jobs through `core.get_jobs`."""
+
+    _server: TrueNASServer
+    _machine: CachingMachine
+    _machine_options: Dict[str, Any] = {}
+    _aborted_job_ids: List[int]
+
+    def setUp(self):
+        self._server = TrueNASServer()
+        self._server.register_method_handler(
+            "core.get_jobs",
+            lambda filters: [job_state(id, "RUNNING") for id in filters[0][2]],
+        )
+        self._aborted_job_ids = []
+        self._server.register_method_handler(
+            "core.job_abort",
+            lambda id: self._aborted_job_ids.append(id),
+        )
+
+    async def asyncSetUp(self):
+        self._machine = await CachingMachine.create(
+            self._server.host,
+            api_key=self._server.api_key,
+            secure=False,
+            **self._machine_options,
+        )
+
+    async def asyncTearDown(self):
+        await self._machine.close()
+        await self._server.stop()
+
+    @property
+    def _cached_jobs(self) -> Dict[int, Dict[str, Any]]:
+        return self._machine._job_fetcher._state  # type: ignore
+
+    @property
+    def _job_wait_futures(self) -> Dict[int, asyncio.Future]:
+        return self._machine._job_fetcher._job_wait_futures  # type: ignore
+
+    @property
+    def _progress_listeners(self) -> Dict[int, Set[Any]]:
+        return self._machine._job_fetcher._progress_listeners  # type: ignore
+
+    def _send_job(self, id: int, state: str, **fields: Any) -> None:
+        self._server.send_subscription_data(
+            {
+                "msg": "changed",
+                "collection": "core.get_jobs",
+                "id": id,
+                "fields": job_state(id, state, **fields),
+            }
+        )
+
+    async def _push_job(self, id: int, state: str, **fields: Any) -> None:
+        """Sends a job update, and waits for the client to process it."""
+        self._send_job(id, state, **fields)
+        for _ in range(100):
+            if self._cached_jobs.get(id, {}).get("state") == state:
+                return
+            await asyncio.sleep(0.01)
+        self.fail(f"job {id} was never updated to {state}")
+
+    async def _wait_for_aborts(self, ids: List[int]) -> None:
+        """Waits for the server to have been asked to abort exactly `ids`."""
+        for _ in range(100):
+            if self._aborted_job_ids == ids:
+                return
+            await asyncio.sleep(0.01)
+        self.assertEqual(self._aborted_job_ids, ids)
+
+    async def _cancel(self, task: asyncio.Task) -> None:
+        """Cancels a waiter, and lets the fetcher react to it."""
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.01)
+
+
+class TestJobCache(JobFetcherTestCase):
+    _machine_options = {"max_jobs": 2}
+
+    async def test_projection(self) -> None:
+        await self._push_job(1, "SUCCESS", logs_excerpt="lots of output")
+
+        self.assertEqual(
+            self._cached_jobs[1],
+            {
+                "abortable": False,
+                "error": None,
+                "id": 1,
+                "method": "vm.stop",
+                "progress": {"description": None, "extra": None, "percent": None},
+                "result": None,
+                "state": "SUCCESS",
+            },
+        )
+
+    async def test_capacity_eviction(self) -> None:
+        await self._push_job(1, "SUCCESS", result=True)
+        await self._push_job(2, "SUCCESS")
+        job = await self._machine.get_job(1)
+        await self._push_job(3, "SUCCESS")
+
+        # Job 1 was used more recently than job 2.
+        self.assertEqual(list(self._cached_jobs), [1, 3])
+        await self._push_job(4, "SUCCESS")
+        self.assertEqual(list(self._cached_jobs), [3, 4])
+
+        # Evicted jobs keep their last known state.
+        self.assertFalse(job.available)
+        self.assertEqual(job.status, JobStatus.SUCCESS)
+        self.assertEqual(job.result, True)
+
+    async def test_waited_jobs_are_not_evicted(self) -> None:
+        await self._push_job(1, "RUNNING")
+        wait_task = asyncio.create_task(self._machine.wait_for_job(1))
+        await asyncio.sleep(0.01)
+        await self._push_job(2, "SUCCESS")
+        await self._push_job(3, "SUCCESS")
+
+        self.assertIn(1, self._cached_jobs)
+        self.assertEqual(len(self._cached_jobs), 2)
+        await self._cancel(wait_task)
+
+    async def test_waited_jobs_fill_cache(self) -> None:
+        await self._push_job(1, "RUNNING")
+        await self._push_job(2, "RUNNING")
+        wait_tasks = [
+            asyncio.create_task(self._machine.wait_for_job(id)) for id in (1, 2)
+        ]
+        await asyncio.sleep(0.01)
+
+        # Every cached job is being waited on, so the cache goes over capacity.
+        await self._push_job(3, "RUNNING")
+        self.assertEqual(list(self._cached_jobs), [1, 2, 3])
+
+        self._send_job(1, "SUCCESS")
+        job = await asyncio.wait_for(wait_tasks[0], 1)
+        self.assertEqual(job.status, JobStatus.SUCCESS)
+        # The subscription is still being processed.
+        fetcher = self._machine._job_fetcher  # type: ignore
+        self.assertFalse(fetcher._subscription_task.done())
+        await self._cancel(wait_tasks[1])
+
+
+class TestJobCacheAge(JobFetcherTestCase):
+    _machine_options = {"max_job_age": 0.05}
+
+    async def test_age_eviction(self) -> None:
+        await self._push_job(1, "SUCCESS")
+        await asyncio.sleep(0.1)
+        await self._push_job(2, "SUCCESS")
+
+        self.assertEqual(list(self._cached_jobs), [2])
+
+
+class TestWaitForJob(JobFetcherTestCase):
+    async def test_already_completed_in_cache(self) -> None:
+        await self._push_job(42, "SUCCESS")
+
+        job = await self._machine.wait_for_job(42, timeout=1)
+
+        self.assertEqual(job.status, JobStatus.SUCCESS)
+        self.assertEqual(self._job_wait_futures, {})
+
+    async def test_already_completed_on_server(self) -> None:
+        self._server.register_method_handler(
+            "core.get_jobs",
+            lambda *args: [job_state(42, "FAILED")],
+            override=True,
+        )
+
+        job = await self._machine.wait_for_job(42, timeout=1)
+
+        self.assertEqual(job.status, JobStatus.FAILED)
+
+    async def test_started_during_lookup(self) -> None:
+        async def get_jobs_handler(filters):
+            # The job starts after the lookup was answered, and its first event
+            # arrives before the answer does.
+            self._send_job(42, "RUNNING")
+            await asyncio.sleep(0.05)
+            return []
+
+        self._server.register_method_handler(
+            "core.get_jobs", get_jobs_handler, override=True
+        )
+
+        waiter = asyncio.create_task(self._machine.wait_for_job(42, timeout=1))
+        await asyncio.sleep(0.2)
+        self._send_job(42, "SUCCESS")
+        job = await waiter
+
+        self.assertEqual(job.status, JobStatus.SUCCESS)
+
+    async def test_multiple_waiters(self) -> None:
+        waiters = [
+            asyncio.create_task(self._machine.wait_for_job(42, timeout=1))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(self._job_wait_futures), 1)
+
+        self._send_job(42, "SUCCESS")
+        jobs = await asyncio.gather(*waiters)
+
+        self.assertEqual([job.status for job in jobs], [JobStatus.SUCCESS] * 3)
+        self.assertEqual(self._job_wait_futures, {})
+
+    async def test_timeout(self) -> None:
+        other_waiter = asyncio.create_task(self._machine.wait_for_job(42))
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await self._machine.wait_for_job(42, timeout=0.05)
+
+        # The remaining waiter keeps the job tracked until it gives up too.
+        self.assertIn(42, self._job_wait_futures)
+        other_waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await other_waiter
+        self.assertEqual(self._job_wait_futures, {})
+
+
+class TestWaitForJobs(JobFetcherTestCase):
+    async def test_completion_order(self) -> None:
+        await self._push_job(4, "SUCCESS")
+
+        jobs = self._machine.wait_for_jobs([1, 2, 3, 4, 2], timeout=1)
+        self.assertEqual((await jobs.__anext__()).id, 4)
+        await asyncio.sleep(0.01)
+        self._send_job(3, "SUCCESS")
+        self.assertEqual((await jobs.__anext__()).id, 3)
+        self._send_job(1, "FAILED")
+        self._send_job(2, "SUCCESS")
+        self.assertEqual([job.id async for job in jobs], [1, 2])
+        self.assertEqual(self._job_wait_futures, {})
+
+    async def test_max_concurrency(self) -> None:
+        jobs = self._machine.wait_for_jobs([1, 2, 3], max_concurrency=2, timeout=1)
+        next_job = asyncio.create_task(jobs.__anext__())
+        await asyncio.sleep(0.05)
+        self.assertEqual(set(self._job_wait_futures), {1, 2})
+
+        self._send_job(2, "SUCCESS")
+        self.assertEqual((await next_job).id, 2)
+        self.assertEqual(set(self._job_wait_futures), {1, 3})
+        await jobs.aclose()
+        self.assertEqual(self._job_wait_futures, {})
+
+    async def test_timeout(self) -> None:
+        await self._push_job(1, "SUCCESS")
+
+        completed = []
+        with self.assertRaises(asyncio.TimeoutError):
+            async for job in self._machine.wait_for_jobs([1, 2], timeout=0.1):
+                completed.append(job.id)
+
+        self.assertEqual(completed, [1])
+        self.assertEqual(self._job_wait_futures, {})
+
+
+def scrub_progress(percent: int, description: str) -> Dict[str, Any]:
+    return {"description": description, "extra": None, "percent": percent}
+
+
+class TestJobProgress(JobFetcherTestCase):
+    async def test_progress_data_interpretation(self) -> None:
+        await self._push_job(42, "RUNNING", progress=scrub_progress(10, "Scrubbing"))
+
+        job = await self._machine.get_job(42)
+
+        self.assertEqual(job.progress.percent, 10)
+        self.assertEqual(job.progress.description, "Scrubbing")
+
+    async def test_progress_updates_coalesce(self) -> None:
+        await self._push_job(42, "RUNNING", progress=scrub_progress(0, "Starting"))
+        job = await self._machine.get_job(42)
+        updates = job.progress_updates(min_interval=0.1)
+
+        first = await updates.__anext__()
+        self.assertEqual(first.percent, 0)
+        for percent in (10, 20, 30):
+            self._send_job(42, "RUNNING", progress=scrub_progress(percent, "Scrub"))
+        second = await updates.__anext__()
+        self.assertEqual(second.percent, 30)
+
+        self._send_job(42, "SUCCESS", progress=scrub_progress(100, "Done"))
+        self.assertEqual(
+            [(progress.percent, progress.description) async for progress in updates],
+            [(100, "Done")],
+        )
+        self.assertEqual(self._progress_listeners, {})
+
+    async def test_progress_updates_completed_job(self) -> None:
+        await self._push_job(42, "SUCCESS", progress=scrub_progress(100, "Done"))
+        job = await self._machine.get_job(42)
+
+        self.assertEqual(
+            [progress.percent async for progress in job.progress_updates()],
+            [100],
+        )
+
+
+class TestJobAbort(JobFetcherTestCase):
+    async def test_abort(self) -> None:
+        await self._push_job(42, "RUNNING", abortable=True)
+        job = await self._machine.get_job(42)
+
+        self.assertTrue(job.abortable)
+        await job.abort()
+
+        self.assertEqual(self._aborted_job_ids, [42])
+
+    async def test_cancelled_wait_without_policy(self) -> None:
+        await self._push_job(42, "RUNNING", abortable=True)
+        await self._cancel(asyncio.create_task(self._machine.wait_for_job(42)))
+
+        self.assertEqual(self._aborted_job_ids, [])
+
+
+class TestJobAbortCancelled(JobFetcherTestCase):
+    _machine_options = {"abort_cancelled_jobs": True}
+
+    async def test_cancelled_wait_aborts_job(self) -> None:
+        await self._push_job(42, "RUNNING", abortable=True)
+        first = asyncio.create_task(self._machine.wait_for_job(42))
+        second = asyncio.create_task(self._machine.wait_for_job(42))
+
+        await self._cancel(first)
+        # Another caller is still waiting on the job.
+        self.assertEqual(self._aborted_job_ids, [])
+        await self._cancel(second)
+        await self._wait_for_aborts([42])
+
+    async def test_cancelled_wait_aborts_uncached_job(self) -> None:
+        wait_task = asyncio.create_task(self._machine.wait_for_job(42))
+        # Cancel before the lookup of the job has completed.
+        await asyncio.sleep(0)
+        wait_task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await wait_task
+
+        await self._wait_for_aborts([42])
+
+    async def test_cancelled_wait_skips_unabortable_job(self) -> None:
+        await self._push_job(42, "RUNNING", abortable=False)
+        await self._cancel(asyncio.create_task(self._machine.wait_for_job(42)))
+
+        self.assertEqual(self._aborted_job_ids, [])
+
+    async def test_timed_out_wait_does_not_abort(self) -> None:
+        await self._push_job(42, "RUNNING", abortable=True)
+        with self.assertRaises(asyncio.TimeoutError):
+            await self._machine.wait_for_job(42, timeout=0.01)
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(self._aborted_job_ids, [])
+
 
 if __name__ == "__main__":
     unittest.main()
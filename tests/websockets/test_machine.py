@@ -1,9 +1,12 @@
+import asyncio
+import time
 import unittest
+from typing import List
 from unittest import IsolatedAsyncioTestCase
 
-from aiotruenas_client.websockets import CachingMachine
+from aiotruenas_client.websockets import AuthTokenCache, CachingMachine
 from tests.fakes.fakeserver import TrueNASServer
-from websockets.exceptions import SecurityError
+from websockets.exceptions import ConnectionClosed, SecurityError
 
 
 class TestCachingMachineAuth(IsolatedAsyncioTestCase):
@@ -83,6 +86,102 @@ class TestCachingMachineAuth(IsolatedAsyncioTestCase):
             )
 
 
+class TestCachingMachineTokenAuth(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+
+    def setUp(self):
+        self._server = TrueNASServer()
+        self._logins: List[str] = []
+        self._generated: List[str] = []
+        login = self._server._method_handlers["auth.login"]
+        generate_token = self._server._method_handlers["auth.generate_token"]
+
+        def counting_login(username, password):
+            self._logins.append(username)
+            return login(username, password)
+
+        def counting_generate_token(*args):
+            token = generate_token(*args)
+            self._generated.append(token)
+            return token
+
+        self._server.register_method_handler(
+            "auth.login", counting_login, override=True
+        )
+        self._server.register_method_handler(
+            "auth.generate_token", counting_generate_token, override=True
+        )
+
+    async def asyncTearDown(self):
+        await self._server.stop()
+
+    async def _create_machine(self, tokens: AuthTokenCache) -> CachingMachine:
+        return await CachingMachine.create(
+            self._server.host,
+            username=self._server.username,
+            password=self._server.password,
+            secure=False,
+            auth_tokens=tokens,
+        )
+
+    async def test_reconnect_uses_token(self):
+        tokens = AuthTokenCache()
+        for _ in range(3):
+            machine = await self._create_machine(tokens)
+            await machine.close()
+
+        self.assertEqual(len(self._logins), 1)
+        self.assertEqual(len(self._generated), 1)
+
+    async def test_revoked_token_falls_back_to_password(self):
+        tokens = AuthTokenCache()
+        machine = await self._create_machine(tokens)
+        await machine.close()
+        self._server.revoke_tokens()
+
+        machine = await self._create_machine(tokens)
+        await machine.close()
+
+        self.assertEqual(len(self._logins), 2)
+        self.assertEqual(
+            tokens.get(f"{self._server.username}@{self._server.host}"),
+            self._generated[-1],
+        )
+
+    async def test_token_refreshed_before_expiry(self):
+        tokens = AuthTokenCache(ttl=1, refresh_margin=0.8)
+        machine = await self._create_machine(tokens)
+        try:
+            await asyncio.sleep(0.5)
+            self.assertGreaterEqual(len(self._generated), 2)
+        finally:
+            await machine.close()
+
+    async def test_old_cached_token_refreshed_at_once(self):
+        tokens = AuthTokenCache(ttl=10, refresh_margin=0.2)
+        machine = await self._create_machine(tokens)
+        await machine.close()
+        # Issued long ago, so it is within the refresh margin of expiring.
+        key = f"{self._server.username}@{self._server.host}"
+        tokens._tokens[key] = (tokens._tokens[key][0], time.monotonic() + 1)
+
+        machine = await self._create_machine(tokens)
+        try:
+            for _ in range(100):
+                if tokens.get(key) != self._generated[0]:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(len(self._logins), 1)
+            self.assertEqual(len(self._generated), 2)
+            self.assertEqual(tokens.get(key), self._generated[-1])
+        finally:
+            await machine.close()
+
+    def test_invalid_refresh_margin(self):
+        with self.assertRaises(ValueError):
+            AuthTokenCache(refresh_margin=1)
+
+
 class TestCachingMachineGetSystemInfo(IsolatedAsyncioTestCase):
     _server: TrueNASServer
     _machine: CachingMachine
@@ -117,6 +216,39 @@ class TestCachingMachineGetSystemInfo(IsolatedAsyncioTestCase):
         self.assertEqual(info["hostname"], HOSTNAME)
 
 
+class TestCachingMachineMaxMessageSize(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+
+    def setUp(self):
+        self._server = TrueNASServer()
+        # Over the default limit of 1 MiB.
+        self._server.register_method_handler("system.info", lambda: "x" * 2**21)
+
+    async def asyncTearDown(self):
+        await self._server.stop()
+
+    async def _create_machine(self, **kwargs) -> CachingMachine:
+        return await CachingMachine.create(
+            self._server.host,
+            api_key=self._server.api_key,
+            secure=False,
+            **kwargs,
+        )
+
+    async def test_default_limit(self) -> None:
+        machine = await self._create_machine()
+        with self.assertRaises(ConnectionClosed):
+            await machine.get_system_info()
+        self.assertTrue(machine.closed)
+
+    async def test_no_limit(self) -> None:
+        machine = await self._create_machine(max_message_size=None)
+        try:
+            self.assertEqual(len(await machine.get_system_info()), 2**21)
+        finally:
+            await machine.close()
+
+
 class TestCachingMachineClosed(IsolatedAsyncioTestCase):
     def setUp(self):
         self._server = TrueNASServer()
@@ -4,7 +4,7 @@ from unittest import IsolatedAsyncioTestCase
 from aiotruenas_client.pool import PoolStatus
 from aiotruenas_client.websockets import CachingMachine
 from aiotruenas_client.websockets.pool import CachingPool
-from tests.fakes.fakeserver import TrueNASServer
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
 
 
 class TestPool(IsolatedAsyncioTestCase):
@@ -153,6 +153,58 @@ class TestPool(IsolatedAsyncioTestCase):
         new_pool = self._machine.pools[0]
         self.assertIs(original_pool, new_pool)
 
+    async def test_lookup(self) -> None:
+        self._server.register_method_handler(
+            "pool.query",
+            CommonQueries.pool_query_result,
+        )
+        await self._machine.get_pools()
+
+        pool = self._machine.get_pool("testpool")
+        assert pool is not None
+        self.assertIs(self._machine.get_pool_by_id(4), pool)
+        self.assertIs(self._machine.get_pool_by_guid("16006326459371220184"), pool)
+        self.assertIsNone(self._machine.get_pool("otherpool"))
+
+        self._server.register_method_handler(
+            "pool.query",
+            lambda *args: [],
+            override=True,
+        )
+        await self._machine.get_pools()
+        self.assertIsNone(self._machine.get_pool("testpool"))
+        self.assertIsNone(self._machine.get_pool_by_id(4))
+
+    async def test_refresh(self) -> None:
+        queries = []
+
+        def query_handler(filters, options):
+            queries.append(filters)
+            return [
+                {**pool, "status": "DEGRADED" if filters else "ONLINE"}
+                for pool in CommonQueries.pool_query_result()
+            ]
+
+        self._server.register_method_handler("pool.query", query_handler)
+        await self._machine.get_pools()
+        pool = self._machine.pools[0]
+        self.assertEqual(pool.status, PoolStatus.ONLINE)
+
+        await pool.refresh()
+
+        self.assertEqual(queries[-1], [["guid", "in", ["16006326459371220184"]]])
+        self.assertEqual(pool.status, PoolStatus.DEGRADED)
+        self.assertIs(self._machine.get_pool("testpool"), pool)
+
+        self._server.register_method_handler(
+            "pool.query",
+            lambda *args: [],
+            override=True,
+        )
+        await pool.refresh()
+        self.assertFalse(pool.available)
+        self.assertIsNone(self._machine.get_pool_by_id(4))
+
     def test_eq_impl(self) -> None:
         self._machine._pool_fetcher._state = {  # type: ignore
             "200": {
@@ -1,11 +1,16 @@
-from typing import cast
+import asyncio
+import datetime
+import time
+from typing import List, cast
 from unittest.async_case import IsolatedAsyncioTestCase
 
+from aiotruenas_client.websockets import CachingMachine
 from aiotruenas_client.websockets.protocol import (
     TrueNASWebSocketClientProtocol,
     truenas_api_key_auth_protocol_factory,
 )
-from tests.fakes.fakeserver import TrueNASServer
+from tests.fakes.fakeserver import Fault, TrueNASServer
+from websockets.exceptions import ConnectionClosed, SecurityError
 from websockets.legacy.client import connect
 
 
@@ -41,3 +46,285 @@ class TestProtocolSubscriptions(IsolatedAsyncioTestCase):
         finally:
             await client1.close()
             await client2.close()
+
+
+class TestProtocolUnderLoad(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+
+    def setUp(self):
+        self._server = TrueNASServer(port=0)
+        self._clients: List[TrueNASWebSocketClientProtocol] = []
+
+    async def asyncTearDown(self):
+        for client in self._clients:
+            await client.close()
+        await self._server.stop()
+
+    async def _connect(self) -> TrueNASWebSocketClientProtocol:
+        client = cast(
+            TrueNASWebSocketClientProtocol,
+            await connect(
+                f"ws://{self._server.host}/websocket",
+                create_protocol=truenas_api_key_auth_protocol_factory(
+                    self._server.api_key
+                ),
+            ),
+        )
+        self._clients.append(client)
+        return client
+
+    async def test_slow_call_does_not_block_others(self):
+        async def sleep(seconds):
+            await asyncio.sleep(seconds)
+            return seconds
+
+        self._server.register_method_handler("test.sleep", sleep)
+        client = await self._connect()
+
+        finished = []
+
+        async def call(seconds):
+            finished.append(await client.invoke_method("test.sleep", [seconds]))
+
+        await asyncio.gather(call(0.2), call(0))
+        self.assertEqual(finished, [0, 0.2])
+
+    async def test_many_clients(self):
+        self._server.register_method_handler("test.echo", lambda value: value)
+        clients = await asyncio.gather(*(self._connect() for _ in range(20)))
+        self.assertEqual(self._server.connections, 20)
+
+        results = await asyncio.gather(
+            *(
+                client.invoke_method("test.echo", [i])
+                for i, client in enumerate(clients)
+            )
+        )
+        self.assertEqual(results, list(range(20)))
+
+        # Events only go to the clients subscribed to their collection.
+        queue = await clients[0].subscribe("test")
+        self._server.send_subscription_data(
+            {"msg": "added", "collection": "other", "id": 1, "fields": {}}
+        )
+        self._server.send_subscription_data(
+            {"msg": "added", "collection": "test", "id": 2, "fields": {}}
+        )
+        message = await asyncio.wait_for(queue.get(), 5)
+        self.assertEqual(message["id"], 2)
+        self.assertTrue(queue.empty())
+
+    async def test_latency(self):
+        self._server.latency = 0.1
+        self._server.jitter = 0.05
+        self._server.register_method_handler("test.echo", lambda value: value)
+        client = await self._connect()
+
+        start = time.monotonic()
+        await client.invoke_method("test.echo", [1])
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+    async def test_bandwidth(self):
+        self._server.bandwidth = 100000
+        self._server.register_method_handler("test.data", lambda: "x" * 20000)
+        client = await self._connect()
+
+        start = time.monotonic()
+        await asyncio.gather(*(client.invoke_method("test.data") for _ in range(3)))
+        # The first reply is sent right away, and each after waits for the link.
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
+
+class TestProtocolFaults(IsolatedAsyncioTestCase):
+    """How quickly the client recovers from a bad network, and what it leaks."""
+
+    # Generous, so slow machines do not make the tests flaky.
+    MAX_RECOVERY_SECONDS = 2.0
+
+    _server: TrueNASServer
+
+    def setUp(self):
+        self._server = TrueNASServer(port=0)
+        self._server.register_method_handler("test.echo", lambda value: value)
+        self._clients: List[TrueNASWebSocketClientProtocol] = []
+
+    async def asyncTearDown(self):
+        for client in self._clients:
+            await client.close()
+        await self._server.stop()
+
+    async def _connect(self) -> TrueNASWebSocketClientProtocol:
+        client = cast(
+            TrueNASWebSocketClientProtocol,
+            await connect(
+                f"ws://{self._server.host}/websocket",
+                create_protocol=truenas_api_key_auth_protocol_factory(
+                    self._server.api_key
+                ),
+            ),
+        )
+        self._clients.append(client)
+        return client
+
+    def _assert_no_leaks(self, client: TrueNASWebSocketClientProtocol) -> None:
+        self.assertEqual(client._invoke_method_futures, {})
+        self.assertEqual(client._pending_subscription_data, {})
+
+    def _assert_recovered(self, since: float) -> None:
+        recovery = time.monotonic() - since
+        self.assertLess(
+            recovery,
+            self.MAX_RECOVERY_SECONDS,
+            f"Took {recovery:.3f}s to recover.",
+        )
+
+    async def test_dropped_reply(self):
+        client = await self._connect()
+        self._server.inject_fault(Fault.DROP_REPLY, method="test.echo")
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.invoke_method("test.echo", [1]), 0.1)
+        timed_out = time.monotonic()
+        self._assert_no_leaks(client)
+
+        self.assertEqual(await client.invoke_method("test.echo", [2]), 2)
+        self._assert_recovered(timed_out)
+        self._assert_no_leaks(client)
+
+    async def test_delayed_reply(self):
+        client = await self._connect()
+        self._server.inject_fault(Fault.DELAY_REPLY, method="test.echo", delay=0.3)
+
+        slow = asyncio.ensure_future(client.invoke_method("test.echo", [1]))
+        await asyncio.sleep(0)
+        start = time.monotonic()
+        # Other calls on the connection are not held up.
+        self.assertEqual(await client.invoke_method("test.echo", [2]), 2)
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertEqual(await slow, 1)
+        self._assert_no_leaks(client)
+
+    async def test_out_of_order_results(self):
+        client = await self._connect()
+        self._server.inject_fault(Fault.REORDER_REPLY, method="test.echo")
+
+        finished = []
+
+        async def call(value):
+            finished.append(await client.invoke_method("test.echo", [value]))
+
+        first = asyncio.ensure_future(call(1))
+        await asyncio.sleep(0.05)
+        await asyncio.gather(first, call(2))
+        self.assertEqual(finished, [2, 1])
+        self._assert_no_leaks(client)
+
+    async def test_disconnect_mid_frame(self):
+        client = await self._connect()
+        self._server.inject_fault(Fault.DISCONNECT, method="test.echo")
+
+        start = time.monotonic()
+        with self.assertRaises(ConnectionClosed):
+            await asyncio.wait_for(
+                asyncio.gather(
+                    client.invoke_method("test.echo", [1]),
+                    client.subscribe("test"),
+                ),
+                self.MAX_RECOVERY_SECONDS,
+            )
+        self._assert_recovered(start)
+        self._assert_no_leaks(client)
+        with self.assertRaises(ConnectionClosed):
+            await client.invoke_method("test.echo", [2])
+        self._assert_no_leaks(client)
+
+        client = await self._connect()
+        self.assertEqual(await client.invoke_method("test.echo", [3]), 3)
+        self._assert_recovered(start)
+
+    async def test_slow_ready(self):
+        client = await self._connect()
+        self._server.inject_fault(Fault.SLOW_READY, method="test", delay=0.3)
+
+        subscribing = asyncio.ensure_future(client.subscribe("test"))
+        await asyncio.sleep(0)
+        start = time.monotonic()
+        self.assertEqual(await client.invoke_method("test.echo", [1]), 1)
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertFalse(subscribing.done())
+
+        await subscribing
+        self._assert_no_leaks(client)
+
+    async def test_cancelled_subscribe(self):
+        client = await self._connect()
+        self._server.inject_fault(Fault.SLOW_READY, method="test", delay=0.2)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.subscribe("test"), 0.05)
+        self._assert_no_leaks(client)
+        # The late `ready` is ignored.
+        await asyncio.sleep(0.3)
+        self.assertEqual(client._subscription_data, {})
+
+    async def test_duplicate_changed_events(self):
+        self._server.register_method_handler("core.get_jobs", lambda filters: [])
+        machine = await CachingMachine.create(
+            self._server.host, api_key=self._server.api_key, secure=False
+        )
+        try:
+            self._server.inject_fault(Fault.DUPLICATE_EVENT, count=2)
+            for state in ("RUNNING", "SUCCESS"):
+                self._server.send_subscription_data(
+                    {
+                        "msg": "changed",
+                        "collection": "core.get_jobs",
+                        "id": 42,
+                        "fields": {
+                            "error": None,
+                            "id": 42,
+                            "method": "pool.scrub",
+                            "progress": {
+                                "description": None,
+                                "extra": None,
+                                "percent": None,
+                            },
+                            "result": None,
+                            "state": state,
+                            "time_started": datetime.datetime(
+                                2021, 1, 7, 21, 30, 0, tzinfo=datetime.timezone.utc
+                            ),
+                        },
+                    }
+                )
+            job = await machine.wait_for_job(42, timeout=self.MAX_RECOVERY_SECONDS)
+            self.assertEqual(job.id, 42)
+            self._assert_no_leaks(machine._client)
+        finally:
+            await machine.close()
+
+    async def test_cancelled_login_closes_connection(self):
+        # Logging in takes longer than the caller is willing to wait.
+        self._server.latency = 1.0
+
+        start = time.monotonic()
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self._connect(), 0.1)
+        self._assert_recovered(start)
+        for _ in range(100):
+            if self._server.connections == 0:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(self._server.connections, 0)
+
+    async def test_authentication_flap(self):
+        self._server.inject_fault(Fault.AUTH_FAILURE, count=2)
+
+        start = time.monotonic()
+        for _ in range(2):
+            with self.assertRaises(SecurityError):
+                await self._connect()
+        client = await self._connect()
+        self._assert_recovered(start)
+        self.assertEqual(await client.invoke_method("test.echo", [1]), 1)
+        self._assert_no_leaks(client)
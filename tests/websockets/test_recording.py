@@ -0,0 +1,144 @@
+import asyncio
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from aiotruenas_client.job import JobStatus
+from aiotruenas_client.websockets import AuthTokenCache, CachingMachine
+from aiotruenas_client.websockets.recording import (
+    RECEIVED,
+    REDACTED,
+    SENT,
+    read_recording,
+)
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
+
+JOB_ID = 42
+
+
+def job_changed(state: str) -> dict:
+    return {
+        "msg": "changed",
+        "collection": "core.get_jobs",
+        "id": JOB_ID,
+        "fields": {
+            "error": None,
+            "id": JOB_ID,
+            "method": "pool.scrub",
+            "progress": {"description": None, "extra": None, "percent": None},
+            "result": None,
+            "state": state,
+            "time_started": datetime.datetime(
+                2021, 1, 7, 21, 30, 0, tzinfo=datetime.timezone.utc
+            ),
+        },
+    }
+
+
+class TestRecording(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+
+    def setUp(self):
+        self._server = TrueNASServer()
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, "traffic.log")
+
+    async def asyncTearDown(self):
+        await self._server.stop()
+        self._directory.cleanup()
+
+    async def _create_machine(self, **kwargs) -> CachingMachine:
+        return await CachingMachine.create(
+            self._server.host,
+            api_key=self._server.api_key,
+            secure=False,
+            **kwargs,
+        )
+
+    async def _record(self) -> None:
+        self._server.register_method_handler(
+            "pool.query",
+            CommonQueries.pool_query_result,
+        )
+        machine = await self._create_machine(record_traffic=self._path)
+        await machine.get_pools()
+        await asyncio.sleep(0.05)
+        self._server.send_subscription_data(job_changed("RUNNING"))
+        await asyncio.sleep(0.05)
+        self._server.send_subscription_data(job_changed("SUCCESS"))
+        await machine.wait_for_job(JOB_ID, timeout=1)
+        await machine.close()
+
+    async def test_recording(self) -> None:
+        await self._record()
+
+        frames = read_recording(self._path)
+        self.assertEqual(frames[0].direction, SENT)
+        self.assertEqual(frames[0].message["msg"], "connect")
+        methods = [
+            frame.message["method"]
+            for frame in frames
+            if frame.direction == SENT and frame.message["msg"] == "method"
+        ]
+        self.assertIn("pool.query", methods)
+        events = [
+            frame
+            for frame in frames
+            if frame.direction == RECEIVED and frame.message["msg"] == "changed"
+        ]
+        self.assertEqual(len(events), 2)
+        self.assertEqual(
+            [frame.elapsed for frame in frames],
+            sorted(frame.elapsed for frame in frames),
+        )
+
+    async def test_credentials_redacted(self) -> None:
+        tokens = AuthTokenCache()
+        for _ in range(2):
+            # The first login uses the password, and the second a token.
+            machine = await CachingMachine.create(
+                self._server.host,
+                username=self._server.username,
+                password=self._server.password,
+                secure=False,
+                auth_tokens=tokens,
+                record_traffic=self._path,
+            )
+            await machine.close()
+            with open(self._path, "r", encoding="utf-8") as file:
+                recording = file.read()
+
+            self.assertNotIn(self._server.password, recording)
+            self.assertNotIn(self._server.username, recording)
+            for token, _ in tokens._tokens.values():  # type: ignore
+                self.assertNotIn(token, recording)
+            self.assertIn(REDACTED, recording)
+
+    async def test_replay(self) -> None:
+        await self._record()
+        self._server.register_method_handler(
+            "pool.query",
+            lambda *args: [],
+            override=True,
+        )
+
+        self._server.replay(self._path, speed=10)
+        # The job may be looked up before its events are replayed.
+        self._server.register_method_handler(
+            "core.get_jobs",
+            lambda *args: [job_changed("RUNNING")["fields"]],
+        )
+        machine = await self._create_machine()
+        try:
+            pools = await machine.get_pools()
+            self.assertEqual([pool.name for pool in pools], ["testpool"])
+            job = await machine.wait_for_job(JOB_ID, timeout=1)
+            self.assertEqual(job.status, JobStatus.SUCCESS)
+        finally:
+            await machine.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
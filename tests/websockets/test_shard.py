@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import multiprocessing
+import unittest
+from typing import Any
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from aiotruenas_client.websockets.shard import ShardedFleet, StateDelta, _run_shard
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
+
+
+class TestShardedFleet(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+    _fleet: ShardedFleet
+
+    def setUp(self):
+        self._server = TrueNASServer()
+        self._server.register_method_handler(
+            "pool.query",
+            CommonQueries.pool_query_result,
+        )
+
+    async def asyncSetUp(self):
+        self._fleet = ShardedFleet(
+            {self._server.host: {"api_key": self._server.api_key, "secure": False}},
+            processes=2,
+            interval=0.05,
+            kinds=["pools"],
+        )
+        await self._fleet.start()
+
+    async def asyncTearDown(self):
+        await self._fleet.close()
+        await self._server.stop()
+
+    async def _next_delta(self) -> StateDelta:
+        return await asyncio.wait_for(self._fleet.updates().__anext__(), 30)
+
+    async def test_deltas(self) -> None:
+        GUID = "16006326459371220184"
+        delta = await self._next_delta()
+
+        self.assertEqual((delta.host, delta.kind), (self._server.host, "pools"))
+        self.assertEqual(list(delta.changed), [GUID])
+        self.assertEqual(
+            self._fleet.state[self._server.host]["pools"][GUID]["status"], "ONLINE"
+        )
+
+        # Unchanged rows are not sent again.
+        self._server.register_method_handler(
+            "pool.query",
+            lambda *args: [],
+            override=True,
+        )
+        delta = await self._next_delta()
+        self.assertEqual((delta.changed, delta.removed), ({}, [GUID]))
+        self.assertEqual(self._fleet.state[self._server.host]["pools"], {})
+        self.assertIsNone(self._fleet.errors[self._server.host])
+
+    async def test_deltas_not_kept_without_consumer(self) -> None:
+        await self._next_delta()
+        self._server.register_method_handler(
+            "pool.query",
+            lambda *args: [],
+            override=True,
+        )
+        # Give the workers time to send the removal, with nobody reading.
+        for _ in range(300):
+            if not self._fleet.state[self._server.host]["pools"]:
+                break
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(self._fleet.state[self._server.host]["pools"], {})
+        self.assertEqual(self._fleet._update_queues, set())  # type: ignore
+
+    def test_unknown_kind(self) -> None:
+        with self.assertRaises(ValueError):
+            ShardedFleet({}, kinds=["snapshots"])
+
+
+async def fail_to_poll(*args: Any) -> None:
+    raise RuntimeError("Unable to poll.")
+
+
+class TestShardWorkerFailure(IsolatedAsyncioTestCase):
+    async def test_failure_reported(self) -> None:
+        fleet = ShardedFleet({"nas": {}}, processes=1, kinds=["pools"])
+        parent_connection, child_connection = multiprocessing.Pipe(duplex=False)
+        loop = asyncio.get_event_loop()
+        updates = fleet.updates()
+        next_delta = asyncio.ensure_future(updates.__anext__())
+        await asyncio.sleep(0)
+
+        with patch("aiotruenas_client.websockets.shard._poll_shard", fail_to_poll):
+            with self.assertRaises(RuntimeError):
+                await loop.run_in_executor(
+                    None,
+                    _run_shard,
+                    {"nas": {}},
+                    None,
+                    1.0,
+                    ["pools"],
+                    child_connection,
+                    multiprocessing.Event(),
+                )
+        with self.assertLogs("aiotruenas_client.websockets.shard", logging.ERROR):
+            await loop.run_in_executor(
+                None, fleet._read_deltas, loop, parent_connection  # type: ignore
+            )
+            delta = await asyncio.wait_for(next_delta, 1)
+
+        self.assertEqual((delta.host, delta.kind), ("nas", "pools"))
+        self.assertEqual(delta.error, "RuntimeError: Unable to poll.")
+        self.assertEqual(fleet.errors["nas"], "RuntimeError: Unable to poll.")
+        await updates.aclose()
+        parent_connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
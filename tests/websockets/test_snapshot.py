@@ -0,0 +1,169 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from aiotruenas_client.job import JobStatus
+from aiotruenas_client.pool import PoolStatus
+from aiotruenas_client.websockets import CachingMachine
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
+from tests.websockets.test_job import job_state
+
+
+class TestSnapshot(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+    _machine: CachingMachine
+
+    def setUp(self):
+        self._server = TrueNASServer()
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, "snapshot")
+
+    async def asyncSetUp(self):
+        self._machine = await self._create_machine()
+
+    async def asyncTearDown(self):
+        await self._machine.close()
+        await self._server.stop()
+        self._directory.cleanup()
+
+    async def _create_machine(self, **kwargs) -> CachingMachine:
+        return await CachingMachine.create(
+            self._server.host,
+            api_key=self._server.api_key,
+            secure=False,
+            **kwargs,
+        )
+
+    async def test_warm_start(self) -> None:
+        self._server.register_method_handler(
+            "pool.query",
+            CommonQueries.pool_query_result,
+        )
+        self._server.register_method_handler(
+            "vm.query",
+            CommonQueries.vm_query_result,
+        )
+        await self._machine.get_pools()
+        await self._machine.get_vms()
+        await self._machine.save_snapshot(self._path)
+        self._server.register_method_handler(
+            "pool.query",
+            lambda *args: [
+                {**pool, "status": "DEGRADED"}
+                for pool in CommonQueries.pool_query_result()
+            ],
+            override=True,
+        )
+
+        machine = await self._create_machine(warm_start=self._path)
+        try:
+            # Served from the snapshot before anything is fetched.
+            self.assertTrue(machine.stale)
+            self.assertEqual(len(machine.vms), len(self._machine.vms))
+            pool = machine.get_pool("testpool")
+            assert pool is not None
+            self.assertEqual(pool.status, PoolStatus.ONLINE)
+
+            for _ in range(100):
+                if not machine.stale:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertFalse(machine.stale)
+            self.assertEqual(pool.status, PoolStatus.DEGRADED)
+        finally:
+            await machine.close()
+
+    async def test_missing_snapshot(self) -> None:
+        machine = await self._create_machine(warm_start=self._path)
+        try:
+            self.assertFalse(machine.stale)
+            self.assertEqual(machine.pools, [])
+        finally:
+            await machine.close()
+
+    async def test_unsupported_version(self) -> None:
+        with open(self._path, "wb") as file:
+            file.write(b"aiotruenas-client snapshot\n999\n{}")
+
+        machine = await self._create_machine(warm_start=self._path)
+        try:
+            self.assertFalse(machine.stale)
+        finally:
+            await machine.close()
+
+    async def test_missing_keys(self) -> None:
+        await self._machine.save_snapshot(self._path)
+        with open(self._path, "rb") as file:
+            data = file.read()
+        with open(self._path, "wb") as file:
+            file.write(data.replace(b'"disk_temperatures"', b'"temperatures"'))
+
+        machine = await self._create_machine(warm_start=self._path)
+        try:
+            self.assertFalse(machine.stale)
+        finally:
+            await machine.close()
+
+    async def test_running_job_refreshed(self) -> None:
+        self._server.send_subscription_data(
+            {
+                "msg": "changed",
+                "collection": "core.get_jobs",
+                "id": 42,
+                "fields": job_state(42, "RUNNING"),
+            }
+        )
+        for _ in range(100):
+            if 42 in self._machine._job_fetcher._state:  # type: ignore
+                break
+            await asyncio.sleep(0.01)
+        await self._machine.save_snapshot(self._path)
+        # The job finished while no client was connected.
+        self._server.register_method_handler(
+            "core.get_jobs",
+            lambda filters: [job_state(id, "SUCCESS") for id in filters[0][2]],
+        )
+
+        machine = await self._create_machine(warm_start=self._path)
+        try:
+            job = await machine.wait_for_job(42, timeout=1)
+            self.assertEqual(job.status, JobStatus.SUCCESS)
+        finally:
+            await machine.close()
+
+    async def test_refresh_retried(self) -> None:
+        self._server.register_method_handler(
+            "pool.query",
+            CommonQueries.pool_query_result,
+        )
+        await self._machine.get_pools()
+        await self._machine.save_snapshot(self._path)
+        calls = 0
+
+        def pool_query(*args):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RuntimeError("Temporarily unavailable.")
+            return CommonQueries.pool_query_result()
+
+        self._server.register_method_handler("pool.query", pool_query, override=True)
+
+        with patch.object(CachingMachine, "_stale_refresh_retry_delay", 0.01):
+            machine = await self._create_machine(warm_start=self._path)
+        try:
+            for _ in range(100):
+                if not machine.stale:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertFalse(machine.stale)
+            self.assertEqual(calls, 2)
+        finally:
+            await machine.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import ssl
+import unittest
+from typing import Optional
+from unittest import IsolatedAsyncioTestCase
+
+from aiotruenas_client.websockets import CachingMachine, ResumingSSLContext
+from tests.fakes.fakeserver import TrueNASServer
+
+CERTIFICATE = os.path.join(os.path.dirname(__file__), "..", "fakes", "localhost.pem")
+
+
+def create_server() -> TrueNASServer:
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(CERTIFICATE)
+    server = TrueNASServer(port=0, ssl_context=server_context)
+    server.register_method_handler("core.get_jobs", lambda filters: [])
+    return server
+
+
+class TestTLS(IsolatedAsyncioTestCase):
+    _server: TrueNASServer
+    _other_server: TrueNASServer
+
+    def setUp(self):
+        self._server = create_server()
+        # On another port of the same host.
+        self._other_server = create_server()
+
+    async def asyncTearDown(self):
+        await self._server.stop()
+        await self._other_server.stop()
+
+    async def _create_machine(
+        self, server: Optional[TrueNASServer] = None, **kwargs
+    ) -> CachingMachine:
+        server = server or self._server
+        return await CachingMachine.create(
+            server.host, api_key=server.api_key, secure=True, **kwargs
+        )
+
+    def _session_reused(self, machine: CachingMachine) -> bool:
+        assert machine._client is not None
+        return machine._client.transport.get_extra_info("ssl_object").session_reused
+
+    async def test_resumes_session(self) -> None:
+        context = ResumingSSLContext()
+        context.load_verify_locations(CERTIFICATE)
+
+        first = await self._create_machine(ssl_context=context)
+        self.assertFalse(self._session_reused(first))
+        await first.close()
+
+        second = await self._create_machine(ssl_context=context)
+        try:
+            self.assertTrue(self._session_reused(second))
+        finally:
+            await second.close()
+
+    async def test_sessions_kept_per_port(self) -> None:
+        context = ResumingSSLContext()
+        context.load_verify_locations(CERTIFICATE)
+
+        for server in (self._server, self._other_server):
+            machine = await self._create_machine(server, ssl_context=context)
+            self.assertFalse(self._session_reused(machine))
+            await machine.close()
+
+        # The other port's session did not replace this one's.
+        machine = await self._create_machine(ssl_context=context)
+        try:
+            self.assertTrue(self._session_reused(machine))
+        finally:
+            await machine.close()
+
+    async def test_verifies_certificate(self) -> None:
+        with self.assertRaises(ssl.SSLCertVerificationError):
+            await self._create_machine(ssl_context=ResumingSSLContext())
+
+    async def test_default_context(self) -> None:
+        machine = await self._create_machine()
+        try:
+            self.assertFalse(machine.closed)
+        finally:
+            await machine.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import unittest
 from typing import Dict
@@ -7,7 +8,7 @@ from aiotruenas_client.job import TJobId
 from aiotruenas_client.virtualmachine import VirtualMachineState
 from aiotruenas_client.websockets import CachingMachine
 from aiotruenas_client.websockets.virtualmachine import CachingVirtualMachine
-from tests.fakes.fakeserver import TrueNASServer
+from tests.fakes.fakeserver import CommonQueries, TrueNASServer
 
 
 class TestVirtualMachine(IsolatedAsyncioTestCase):
@@ -312,6 +313,220 @@ class TestVirtualMachine(IsolatedAsyncioTestCase):
 
         self.assertTrue(await vm.restart())
 
+    async def test_lookup(self) -> None:
+        self._server.register_method_handler(
+            "vm.query",
+            CommonQueries.vm_query_result,
+        )
+        await self._machine.get_vms()
+
+        vm = self._machine.get_vm("vm02")
+        assert vm is not None
+        self.assertEqual(vm.id, 3)
+        self.assertIs(self._machine.get_vm_by_id(3), vm)
+        self.assertIsNone(self._machine.get_vm("vm03"))
+
+        self._server.register_method_handler(
+            "vm.query",
+            lambda *args: CommonQueries.vm_query_result()[:1],
+            override=True,
+        )
+        await self._machine.get_vms()
+        self.assertIsNone(self._machine.get_vm("vm02"))
+        self.assertIsNotNone(self._machine.get_vm_by_id(1))
+
+    async def test_bulk_stop(self) -> None:
+        vm_states = {
+            id: {
+                "description": "",
+                "id": id,
+                "name": f"vm{id}",
+                "status": {"pid": 10, "state": "RUNNING"},
+            }
+            for id in (1, 2, 3)
+        }
+        queries = []
+        stopped_ids = []
+
+        def job_state(id: int, state: str) -> dict:
+            return {
+                "error": None,
+                "id": 100 + id,
+                "method": "vm.stop",
+                "progress": {},
+                "result": None,
+                "state": state,
+            }
+
+        def query_handler(filters, options):
+            queries.append(filters)
+            if filters:
+                [[field, operator, ids]] = filters
+                self.assertEqual((field, operator), ("id", "in"))
+                return [vm_states[id] for id in ids]
+            return list(vm_states.values())
+
+        def stop_handler(id, options: Dict[str, bool]) -> TJobId:
+            stopped_ids.append(id)
+            return 100 + id
+
+        async def finish_jobs() -> None:
+            while len(stopped_ids) < 3:
+                await asyncio.sleep(0.01)
+            for id in stopped_ids:
+                vm_states[id]["status"] = {"pid": None, "state": "STOPPED"}
+                self._server.send_subscription_data(
+                    {
+                        "msg": "changed",
+                        "collection": "core.get_jobs",
+                        "id": 100 + id,
+                        "fields": job_state(id, "SUCCESS"),
+                    }
+                )
+
+        self._server.register_method_handler("vm.query", query_handler)
+        self._server.register_method_handler("vm.stop", stop_handler)
+        self._server.register_method_handler(
+            "core.get_jobs",
+            lambda filters: [job_state(id - 100, "RUNNING") for id in filters[0][2]],
+        )
+        await self._machine.get_vms()
+        finisher = asyncio.create_task(finish_jobs())
+
+        results = await self._machine.stop_vms(
+            sorted(self._machine.vms, key=lambda vm: vm.id), max_concurrency=2
+        )
+        await finisher
+
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(sorted(stopped_ids), [1, 2, 3])
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(sorted(queries[1][0][2]), [1, 2, 3])
+        self.assertEqual(
+            [vm.status for vm in self._machine.vms],
+            [VirtualMachineState.STOPPED] * 3,
+        )
+        self.assertIs(self._machine.get_vm("vm1"), self._machine.get_vm_by_id(1))
+
+    async def test_bulk_restart_errors(self) -> None:
+        self._server.register_method_handler(
+            "vm.query",
+            lambda *args: [
+                {
+                    "description": "",
+                    "id": id,
+                    "name": f"vm{id}",
+                    "status": {"pid": 10, "state": "RUNNING"},
+                }
+                for id in (1, 2)
+            ],
+        )
+
+        def restart_handler(id) -> TJobId:
+            self._server.send_subscription_data(
+                {
+                    "msg": "changed",
+                    "collection": "core.get_jobs",
+                    "id": 100 + id,
+                    "fields": {
+                        "error": "[EFAULT] vm2 is broken" if id == 2 else None,
+                        "id": 100 + id,
+                        "method": "vm.restart",
+                        "progress": {},
+                        "result": None,
+                        "state": "FAILED" if id == 2 else "SUCCESS",
+                    },
+                }
+            )
+            return 100 + id
+
+        self._server.register_method_handler("vm.restart", restart_handler)
+        await self._machine.get_vms()
+        vms = sorted(self._machine.vms, key=lambda vm: vm.id)
+
+        results = await self._machine.restart_vms(vms, return_exceptions=True)
+
+        self.assertEqual(results[0], True)
+        self.assertIsInstance(results[1], RuntimeError)
+        with self.assertRaises(RuntimeError):
+            await self._machine.restart_vms(vms)
+
+    async def test_bulk_stop_lookup_error(self) -> None:
+        self._server.register_method_handler(
+            "vm.query",
+            lambda *args: [
+                {
+                    "description": "",
+                    "id": id,
+                    "name": f"vm{id}",
+                    "status": {"pid": 10, "state": "RUNNING"},
+                }
+                for id in (1, 2, 3)
+            ],
+        )
+
+        def job_state(id: int, state: str) -> dict:
+            return {
+                "error": None,
+                "id": id,
+                "method": "vm.stop",
+                "progress": {},
+                "result": None,
+                "state": state,
+            }
+
+        def get_jobs_handler(filters):
+            # The job for vm2 is already gone from the server, and the others
+            # finish afterwards.
+            for id in (101, 103):
+                asyncio.get_event_loop().call_later(
+                    0.05,
+                    self._server.send_subscription_data,
+                    {
+                        "msg": "changed",
+                        "collection": "core.get_jobs",
+                        "id": id,
+                        "fields": job_state(id, "SUCCESS"),
+                    },
+                )
+            return [job_state(id, "RUNNING") for id in filters[0][2] if id != 102]
+
+        self._server.register_method_handler("vm.stop", lambda id, options: 100 + id)
+        self._server.register_method_handler("core.get_jobs", get_jobs_handler)
+        await self._machine.get_vms()
+        vms = sorted(self._machine.vms, key=lambda vm: vm.id)
+
+        results = await self._machine.stop_vms(vms, return_exceptions=True)
+
+        self.assertEqual(results[0], True)
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertEqual(results[2], True)
+
+    async def test_refresh(self) -> None:
+        queries = []
+
+        def query_handler(filters, options):
+            queries.append(filters)
+            return [
+                {
+                    "description": "",
+                    "id": 1,
+                    "name": "renamed" if filters else "vm1",
+                    "status": {"pid": None, "state": "STOPPED"},
+                }
+            ]
+
+        self._server.register_method_handler("vm.query", query_handler)
+        await self._machine.get_vms()
+        vm = self._machine.vms[0]
+
+        await vm.refresh()
+
+        self.assertEqual(queries[-1], [["id", "in", [1]]])
+        self.assertEqual(vm.name, "renamed")
+        self.assertIs(self._machine.get_vm("renamed"), vm)
+        self.assertIsNone(self._machine.get_vm("vm1"))
+
     def test_eq_impl(self) -> None:
         self._machine._vm_fetcher._state = {  # type: ignore
             "42": {